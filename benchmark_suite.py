@@ -0,0 +1,243 @@
+import argparse
+import json
+import os
+import platform
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+from compact_transactions import compact_transactions
+from dashboard_index import (
+    build_investor_index, build_transaction_index, category_mask, filter_mask, gather_column, gather_transactions,
+    owner_rows, owner_transactions, page_positions
+)
+from dashboard_snapshot import transaction_columns, transaction_links
+from horizons import DEFAULT_HORIZONS, horizon_labels
+from investor_query_service import build_query_index, filter_positions, top_positions
+from point_in_time_leaderboard import build_leaderboard_index, leaderboard_as_of
+from run_pipeline import INPUT_FILES, read_benchmarks, read_transactions
+from stage_store import write_stage
+from synthetic_data import write_synthetic_inputs
+from transaction_clusters import build_clusters
+from transactions_combined_with_SP500_sector_performance import (
+    build_benchmark_index, add_benchmark_levels, add_benchmark_returns, add_relative_returns
+)
+from transactions_with_split_adjustments import build_split_factors, add_split_adjustments
+from transactions_with_calculated_returns import calculate_returns
+from transactions_with_weighted_returns import (
+    calculate_investor_metrics, calculate_investor_metrics_compact, prepare_transactions
+)
+
+DEFAULT_SIZES = '10k,100k,1M'
+DEFAULT_REPEATS = 5
+# Pipeline stages are slow enough that fewer timed calls (after a warm-up) settle them
+DEFAULT_STAGE_REPEATS = 3
+WARMUP_CALLS = 1
+# A timing regresses when it is this much slower than the baseline...
+DEFAULT_TOLERANCE = 0.25
+# ...and slower by at least this many seconds, so sub-millisecond jitter never fails a run...
+MIN_REGRESSION_SECONDS = 0.005
+# ...and by more than this many times the combined spread of the two runs' timings
+NOISE_SPREADS = 3
+PAGE_SIZE = 50
+
+def parse_sizes(spec):
+    """Row counts from a comma-separated list such as 10k,100k,1M,10M"""
+    multipliers = {'k': 1_000, 'M': 1_000_000}
+    sizes = []
+    for size in spec.split(','):
+        size = size.strip()
+        if size[-1] in multipliers:
+            sizes.append(int(float(size[:-1]) * multipliers[size[-1]]))
+        else:
+            sizes.append(int(size))
+    return sizes
+
+def time_repeated(function, repeats, setup=None, warmup=WARMUP_CALLS):
+    """(result of the last call, timing) over warmup untimed and repeats timed calls
+
+    timing holds the median seconds, the fastest call and the spread (median
+    absolute deviation scaled to a standard deviation). setup() runs untimed
+    before every call and its result is passed to function, so stages that
+    modify their input get a fresh copy each time.
+    """
+    seconds = []
+    for call in range(warmup + repeats):
+        args = (setup(),) if setup else ()
+        start = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - start
+        if call >= warmup:
+            seconds.append(elapsed)
+    seconds = np.array(seconds)
+    median = float(np.median(seconds))
+    return result, {
+        'seconds': median,
+        'seconds_min': float(seconds.min()),
+        'seconds_spread': float(1.4826 * np.median(np.abs(seconds - median))),
+    }
+
+def dashboard_filters(investors):
+    """The dashboard's default filter values: 5% to 500% excess return on every horizon"""
+    min_values = {'Transaction_Count': 0}
+    max_values = {'Avg_Days_Between_Transactions': 10000}
+    for col in investors.columns:
+        if col.startswith('Return_vs_'):
+            min_values[col], max_values[col] = 0.05, 5.0
+    return min_values, max_values
+
+def benchmark_size(data_dir, rows, repeats, stage_repeats=DEFAULT_STAGE_REPEATS, horizons=DEFAULT_HORIZONS):
+    """Time every pipeline stage (stage_repeats calls) and dashboard operation (repeats calls) on one input size"""
+    inputs = {name: os.path.join(data_dir, filename) for name, filename in INPUT_FILES.items()}
+    timings = []
+
+    def record(operation, timing, operation_rows=rows):
+        seconds = timing['seconds']
+        timings.append({'rows': rows, 'operation': operation, **timing,
+                        'rows_per_second': operation_rows / seconds if seconds > 0 else None})
+        print(f"  {operation:<32} {seconds:10.6f}s  +/- {timing['seconds_spread']:.6f}s")
+
+    def stage(operation, function, input_df=None):
+        # Stages get an untimed copy of their input, since several add columns in place
+        setup = (lambda: input_df.copy()) if input_df is not None else None
+        result, timing = time_repeated(function, stage_repeats, setup)
+        record(operation, timing)
+        return result
+
+    def query(operation, function, operation_rows):
+        record(operation, time_repeated(function, repeats)[1], operation_rows)
+
+    # Pipeline stages, in run_pipeline.py order
+    df = stage('read_csv', lambda: read_transactions(inputs['transactions']))
+    split_factors_df = pd.read_csv(inputs['splits'])
+    df = stage('split_adjust', lambda df: add_split_adjustments(df, build_split_factors(split_factors_df)), df)
+    df = stage('returns', lambda df: calculate_returns(df, horizons), df)
+    sp500_sectors_df = read_benchmarks(inputs['benchmarks'])
+    df = stage('benchmark_join', lambda df: add_benchmark_returns(
+        add_benchmark_levels(df, build_benchmark_index(sp500_sectors_df), horizons), sp500_sectors_df, horizons), df)
+    df = stage('relative_returns', lambda df: add_relative_returns(df, horizons), df)
+    with tempfile.TemporaryDirectory() as store_dir:
+        stage('write_stage', lambda: write_stage(df, 'transactions_with_returns_and_relatives', store_dir))
+    investors = stage('investor_metrics', lambda df: calculate_investor_metrics(prepare_transactions(df), horizons), df)
+    compact = stage('compact_transactions', lambda: compact_transactions(df))
+
+    def compact_metrics(facts):
+        return calculate_investor_metrics_compact(dict(compact, facts=prepare_transactions(facts)), horizons)
+    stage('investor_metrics_compact', compact_metrics, compact['facts'])
+    clusters = stage('transaction_clusters', lambda: build_clusters(df, horizons))
+    leaderboard_index = stage('leaderboard_index', lambda: build_leaderboard_index(df, horizons))
+    query('leaderboard_as_of', lambda: leaderboard_as_of(leaderboard_index, '2020-06-30'), len(investors))
+
+    # Dashboard load and queries, as interactive_dashboard.py runs them on the snapshot
+    transactions = df[transaction_columns(horizon_labels(horizons))].sort_values('OWNER_CIK', kind='mergesort')
+    links, facts = transaction_links(transactions.reset_index(drop=True))
+    transaction_index = stage('dashboard_transaction_index',
+                              lambda: build_transaction_index(links, presorted=True, facts=facts))
+    investor_index, timing = time_repeated(lambda: build_investor_index(investors), stage_repeats)
+    record('dashboard_investor_index', timing, len(investors))
+
+    min_values, max_values = dashboard_filters(investors)
+    query('dashboard_filter', lambda: filter_mask(investor_index, min_values, max_values), len(investors))
+    sectors = list(investor_index['categories']['Most_Active_Sector']['values'][:2])
+    query('dashboard_sector_filter', lambda: category_mask(investor_index, 'Most_Active_Sector', sectors), len(investors))
+    mask = filter_mask(investor_index, min_values, max_values)
+    sort_values = investors['Return_vs_SP500_6M'].to_numpy(dtype=float)
+    query('dashboard_first_page', lambda: page_positions(sort_values, mask, 0, PAGE_SIZE), len(investors))
+
+    # The same filtered first page through the query service's presorted index
+    query_index, timing = time_repeated(lambda: build_query_index(investors), stage_repeats)
+    record('query_service_index', timing, len(investors))
+    ranges = {col: (min_values.get(col), max_values.get(col)) for col in {**min_values, **max_values}}
+    query('query_service_first_page', lambda: top_positions(
+        query_index, 'Return_vs_SP500_6M', filter_positions(query_index, ranges), PAGE_SIZE), len(investors))
+
+    # Drill-down into the busiest investor, the worst case for the transaction page
+    busiest = investors.loc[investors['Transaction_Count'].idxmax(), 'OWNER_CIK']
+
+    def drill_down(cik):
+        # As the dashboard pages it: dates for every row, detail columns for the page only
+        rows = owner_rows(transaction_index, cik)
+        dates = gather_column(transaction_index, rows, 'TRANS_DATE').astype('datetime64[ns]')
+        dates = dates.astype(np.int64).astype(float)
+        page_rows = page_positions(dates, np.ones(len(rows), dtype=bool), 0, PAGE_SIZE)
+        return gather_transactions(transaction_index, rows[page_rows])
+    query('dashboard_drill_down', lambda: drill_down(busiest), 1)
+    cluster_index = build_transaction_index(clusters, presorted=True)
+    query('dashboard_cluster_drill_down', lambda: owner_transactions(cluster_index, busiest), 1)
+    return timings
+
+def run_suite(sizes, repeats=DEFAULT_REPEATS, seed=0, data_dir=None, stage_repeats=DEFAULT_STAGE_REPEATS):
+    """Generate (or reuse) synthetic inputs for every size and time them; returns the results document"""
+    results = []
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        for rows in sizes:
+            size_dir = os.path.join(data_dir or scratch_dir, f"rows_{rows}_seed_{seed}")
+            if not os.path.exists(os.path.join(size_dir, INPUT_FILES['transactions'])):
+                print(f"Generating {rows} synthetic transactions...")
+                write_synthetic_inputs(size_dir, rows, seed)
+            print(f"{rows} transactions:")
+            results += benchmark_size(size_dir, rows, repeats, stage_repeats)
+    return {
+        'created': pd.Timestamp.now().isoformat(timespec='seconds'),
+        'seed': seed,
+        'repeats': repeats,
+        'stage_repeats': stage_repeats,
+        'environment': {
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+        },
+        'results': results,
+    }
+
+def compare_to_baseline(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Join timings to a baseline run by (rows, operation) and flag regressions
+
+    A regression must exceed the tolerance, MIN_REGRESSION_SECONDS and
+    NOISE_SPREADS times the combined spread of both runs, so operations that
+    measured noisy need a larger slowdown to fail. Baselines written before
+    spreads were recorded count as spread 0.
+    """
+    columns = ['rows', 'operation', 'seconds', 'seconds_spread']
+    current = pd.DataFrame(results['results']).reindex(columns=columns)
+    previous = pd.DataFrame(baseline['results']).reindex(columns=columns)
+    comparison = current.merge(previous, on=['rows', 'operation'], how='left', suffixes=('', '_baseline'))
+    comparison['ratio'] = comparison['seconds'] / comparison['seconds_baseline']
+    noise = NOISE_SPREADS * np.hypot(comparison['seconds_spread'].fillna(0), comparison['seconds_spread_baseline'].fillna(0))
+    comparison['regression'] = (comparison['ratio'] > 1 + tolerance) & \
+        (comparison['seconds'] - comparison['seconds_baseline'] > np.maximum(noise, MIN_REGRESSION_SECONDS))
+    return comparison
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time every pipeline stage and dashboard query on synthetic data")
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help=f"Comma-separated transaction counts (default: {DEFAULT_SIZES}; up to 10M)")
+    parser.add_argument('--repeats', type=int, default=DEFAULT_REPEATS, help="Timed calls per dashboard query")
+    parser.add_argument('--stage-repeats', type=int, default=DEFAULT_STAGE_REPEATS,
+                        help=f"Timed calls per pipeline stage, after a warm-up (default: {DEFAULT_STAGE_REPEATS})")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-dir', help="Keep generated inputs here and reuse them on later runs")
+    parser.add_argument('--output', default="benchmark_results.json")
+    parser.add_argument('--baseline', help="Results file to compare against; exits with an error on regressions")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="Allowed slowdown vs the baseline (default: 0.25 = 25%%)")
+    args = parser.parse_args()
+
+    results = run_suite(parse_sizes(args.sizes), args.repeats, args.seed, args.data_dir, args.stage_repeats)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults saved to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        comparison = compare_to_baseline(results, baseline, args.tolerance)
+        print(f"\nCompared to {args.baseline} ({baseline['created']}):")
+        print(comparison.to_string(index=False, float_format=lambda value: f"{value:.4f}"))
+        regressions = comparison[comparison['regression']]
+        if len(regressions):
+            print(f"\n{len(regressions)} regression(s) beyond {args.tolerance:.0%}")
+            raise SystemExit(1)
+        print("\nNo regressions")
@@ -0,0 +1,146 @@
+import argparse
+import numpy as np
+import pandas as pd
+
+from instrumentation import step
+from stage_store import DEFAULT_STORE_DIR, STRING_COLUMNS, read_stage, write_stage
+
+# A multi-owner filing (e.g. BERKSHIRE HATHAWAY INC and BUFFETT WARREN E on one
+# OXY filing) repeats every transaction line once per owner. The compact form
+# stores each line once as a fact, the distinct owners once, and a link row per
+# (fact, owner) pair carrying what differs between the owners of a filing
+OWNER_KEYS = ['OWNER_CIK', 'OWNER_NAME']
+LINK_COLUMNS = ['OWNER_RELATIONSHIP']
+# Per-filing and per-owner identifiers are nearly unique, so they stay plain strings;
+# a dictionary that large is also repeated in every Parquet row group
+PLAIN_STRING_COLUMNS = ['ACCESSION_NUMBER', 'OWNER_NAME']
+FACTS_STAGE = 'transaction_facts'
+LINKS_STAGE = 'transaction_owner_links'
+OWNERS_STAGE = 'transaction_owners'
+
+def category_codes(values):
+    """Integer codes (-1 for missing) and sorted categories of a string column, categorical or not"""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        if values.cat.categories.is_monotonic_increasing:
+            return values.cat.codes.to_numpy(), values.cat.categories
+        values = values.astype(object)
+    codes, categories = pd.factorize(values, sort=True)
+    return codes, pd.Index(categories)
+
+def narrow_column(col, values, rows=None):
+    """One column with repetitive strings as a categorical (sorted dictionary) and integers in the
+    smallest dtype that holds them, optionally taking only the given row positions
+
+    Floats are left at float64 so every value, and everything computed from it,
+    stays bit-for-bit the same.
+    """
+    if col in STRING_COLUMNS and col not in PLAIN_STRING_COLUMNS:
+        codes, categories = category_codes(values)
+        return pd.Categorical.from_codes(codes if rows is None else codes[rows], categories)
+    array = values.array if rows is None else values.array.take(rows)
+    if pd.api.types.is_integer_dtype(values) and not isinstance(values.dtype, pd.api.extensions.ExtensionDtype):
+        return pd.to_numeric(array, downcast='integer')
+    return array
+
+def narrow_columns(df, rows=None):
+    # copy=False keeps one array per column instead of stacking them into 2D blocks
+    return pd.DataFrame({col: narrow_column(col, df[col], rows) for col in df.columns}, copy=False)
+
+def compact_transactions(df):
+    """Split transaction rows into facts, owners and (fact, owner) links
+
+    Returns a dict of DataFrames:
+      facts  - one row per distinct transaction line, in first-seen order, without owner columns
+      owners - the distinct (OWNER_CIK, OWNER_NAME) pairs sorted by both; OWNER_CODE is the row position
+      links  - FACT_ID, OWNER_CODE and OWNER_RELATIONSHIP for every input row, in input order
+
+    Rows are the same line when their filing and every non-owner column match.
+    Repeats of a line for the same owner (which do occur) stay separate facts,
+    so expand_transactions gives back exactly the input rows. Owners are keyed
+    by whichever of OWNER_CIK and OWNER_NAME df has.
+    """
+    owner_keys = [col for col in OWNER_KEYS if col in df.columns]
+    fact_columns = [col for col in df.columns if col not in OWNER_KEYS + LINK_COLUMNS]
+
+    owners = df[owner_keys].drop_duplicates().sort_values(owner_keys, kind='mergesort').reset_index(drop=True)
+    owner_codes = pd.MultiIndex.from_frame(owners).get_indexer(pd.MultiIndex.from_frame(df[owner_keys]))
+
+    # The filing number (when present) is part of the key, so two lines only share
+    # a fact on a full 64-bit hash match within the same filing
+    line_hash = pd.util.hash_pandas_object(df[fact_columns], index=False).to_numpy()
+    filing, _ = pd.factorize(df['ACCESSION_NUMBER']) if 'ACCESSION_NUMBER' in df.columns else (np.zeros(len(df), dtype=np.int64), None)
+    keys = pd.DataFrame({'filing': filing, 'line': line_hash, 'owner': owner_codes})
+    keys['repeat'] = keys.groupby(['filing', 'line', 'owner'], sort=False).cumcount()
+    fact_ids = keys.groupby(['filing', 'line', 'repeat'], sort=False).ngroup().to_numpy()
+    first_rows = np.unique(fact_ids, return_index=True)[1]
+
+    links = pd.DataFrame({'FACT_ID': fact_ids.astype(np.int32), 'OWNER_CODE': owner_codes.astype(np.int32)})
+    for col in LINK_COLUMNS:
+        if col in df.columns:
+            links[col] = pd.Categorical(df[col])
+    return {
+        'facts': narrow_columns(df[fact_columns], first_rows),
+        # Owner names are nearly all distinct, so the owner table stays plain
+        'owners': owners,
+        'links': links,
+    }
+
+def expand_transactions(compact, columns=None):
+    """The original transaction rows (in their original order) from the compact form
+
+    Only needed for exports and checks; investor aggregation and the dashboard
+    read the compact form directly.
+    """
+    facts, owners, links = compact['facts'], compact['owners'], compact['links']
+    fact_ids, owner_codes = links['FACT_ID'].to_numpy(), links['OWNER_CODE'].to_numpy()
+    expanded = {}
+    for col in columns or list(owners.columns) + list(links.columns[2:]) + list(facts.columns):
+        if col in owners.columns:
+            expanded[col] = owners[col].to_numpy()[owner_codes]
+        elif col in links.columns:
+            expanded[col] = links[col].to_numpy()
+        elif col in facts.columns:
+            values = facts[col]
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                values = values.astype(values.cat.categories.dtype)
+            expanded[col] = values.to_numpy()[fact_ids]
+    return pd.DataFrame(expanded)
+
+def write_compact(compact, store_dir):
+    write_stage(compact['facts'], FACTS_STAGE, store_dir)
+    write_stage(compact['links'], LINKS_STAGE, store_dir)
+    write_stage(compact['owners'], OWNERS_STAGE, store_dir)
+
+def read_compact(store_dir, fact_columns=None):
+    """Read the compact stages back (string columns come back categorical), optionally projecting the facts"""
+    facts = read_stage(FACTS_STAGE, store_dir, columns=fact_columns)
+    return {
+        'facts': narrow_columns(facts),
+        'owners': read_stage(OWNERS_STAGE, store_dir),
+        'links': read_stage(LINKS_STAGE, store_dir),
+    }
+
+def compact_memory(compact):
+    return sum(df.memory_usage(deep=True).sum() for df in compact.values())
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write the deduplicated, dictionary-encoded transaction stages")
+    parser.add_argument('--store-dir', default=DEFAULT_STORE_DIR)
+    parser.add_argument('--verify', action='store_true', help="Check that expanding the compact form gives back every row")
+    args = parser.parse_args()
+
+    df = read_stage('transactions_with_returns_and_relatives', args.store_dir)
+    with step('compact_transactions', rows_in=len(df)) as info:
+        compact = compact_transactions(df)
+        info['rows_out'] = len(compact['facts'])
+    write_compact(compact, args.store_dir)
+
+    before, after = df.memory_usage(deep=True).sum(), compact_memory(compact)
+    print(f"{len(df)} transaction rows -> {len(compact['facts'])} facts, {len(compact['owners'])} owners, "
+          f"{len(compact['links'])} links")
+    print(f"In memory: {before / 2 ** 20:.1f} MB -> {after / 2 ** 20:.1f} MB ({before / after:.1f}x smaller)")
+    if args.verify:
+        # Integer columns come back narrowed; every value must match
+        pd.testing.assert_frame_equal(expand_transactions(read_compact(args.store_dir), list(df.columns)), df,
+                                      check_dtype=False)
+        print("Expanded compact stages match the source rows")
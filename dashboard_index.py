@@ -0,0 +1,150 @@
+import numpy as np
+import pandas as pd
+
+# Filter column -> (fill for minimum filters, fill for maximum filters). Missing
+# metrics are filled the way the dashboard has always treated them; None means
+# the column has no filter on that side
+FILTER_FILLS = {
+    'Transaction_Count': (0, None),
+    'Unique_Transaction_Years': (0, None),
+    'Number_of_Companies': (0, None),
+    'Min_Transaction_Value': (0, None),
+    'Avg_Transaction_Value': (0, None),
+    'Avg_Days_Between_Transactions': (None, 365000),
+}
+RETURN_FILTER_FILLS = (-100, 100)
+# Investors without significance results pass the default (non-restrictive) bounds
+P_VALUE_FILTER_FILLS = (None, 1.0)
+CI_LOW_FILTER_FILLS = (-100, None)
+
+# Text columns filtered by membership, compared as integer codes
+CATEGORY_COLUMNS = ['Most_Active_Sector', 'Most_Common_Company_Cap_Category']
+
+def filter_fills(columns):
+    """Fill values for every filterable investor column, including each Return_vs_* horizon and significance column"""
+    fills = {col: fill for col, fill in FILTER_FILLS.items() if col in columns}
+    fills.update({col: RETURN_FILTER_FILLS for col in columns if col.startswith('Return_vs_')})
+    fills.update({col: P_VALUE_FILTER_FILLS for col in columns if col.startswith('P_Value_vs_')})
+    fills.update({col: CI_LOW_FILTER_FILLS for col in columns if col.startswith('CI_Low_vs_')})
+    return fills
+
+def build_investor_index(investors_df):
+    """Precompute NaN-filled filter arrays, category codes and a name -> CIK map once at load time"""
+    min_arrays, max_arrays = {}, {}
+    for col, (min_fill, max_fill) in filter_fills(investors_df.columns).items():
+        values = investors_df[col].to_numpy(dtype=float)
+        missing = np.isnan(values)
+        if min_fill is not None:
+            min_arrays[col] = np.where(missing, min_fill, values)
+        if max_fill is not None:
+            max_arrays[col] = np.where(missing, max_fill, values)
+
+    categories = {}
+    for col in CATEGORY_COLUMNS:
+        # Missing values get their own code so they can be selected like any other option
+        codes, values = pd.factorize(investors_df[col], use_na_sentinel=False)
+        categories[col] = {'codes': codes, 'values': pd.Index(values)}
+
+    # The first row wins for a repeated name, like the old equality lookup
+    names = investors_df.drop_duplicates('OWNER_NAME', keep='first')
+    return {
+        'row_count': len(investors_df),
+        'min_arrays': min_arrays,
+        'max_arrays': max_arrays,
+        'categories': categories,
+        'name_to_cik': dict(zip(names['OWNER_NAME'], names['OWNER_CIK'])),
+    }
+
+def filter_mask(investor_index, min_values=None, max_values=None):
+    """Boolean mask of investors passing every column >= min and column <= max filter"""
+    mask = np.ones(investor_index['row_count'], dtype=bool)
+    for col, bound in (min_values or {}).items():
+        mask &= investor_index['min_arrays'][col] >= bound
+    for col, bound in (max_values or {}).items():
+        mask &= investor_index['max_arrays'][col] <= bound
+    return mask
+
+def category_mask(investor_index, column, selected):
+    """Boolean mask of investors whose category is one of the selected values"""
+    category = investor_index['categories'][column]
+    selected_codes = category['values'].get_indexer(pd.Index(list(selected), dtype=object))
+    return np.isin(category['codes'], selected_codes[selected_codes >= 0])
+
+def build_transaction_index(transactions_df, presorted=False, facts=None):
+    """Sort transactions by OWNER_CIK (keeping file order within an owner) and record each owner's row range
+
+    With facts (the compact form, compact_transactions.py), transactions_df holds
+    only OWNER_CIK and FACT_ID links and each owner's rows are gathered from facts.
+    """
+    transactions = transactions_df
+    if not presorted:
+        transactions = transactions.sort_values('OWNER_CIK', kind='mergesort').reset_index(drop=True)
+    ciks, starts, counts = np.unique(transactions['OWNER_CIK'].to_numpy(), return_index=True, return_counts=True)
+    return {
+        'transactions': transactions,
+        'fact_ids': transactions['FACT_ID'].to_numpy() if facts is not None else None,
+        'facts': facts,
+        'ciks': ciks,
+        'starts': starts,
+        'ends': starts + counts,
+    }
+
+def transaction_source(transaction_index):
+    """The frame owner_rows points into: the facts in the compact form, otherwise the sorted transactions"""
+    if transaction_index['facts'] is not None:
+        return transaction_index['facts']
+    return transaction_index['transactions']
+
+def _owner_range(transaction_index, cik):
+    """(start, end) of one owner's rows in the sorted transactions, found by binary search"""
+    ciks = transaction_index['ciks']
+    position = np.searchsorted(ciks, cik)
+    if position < len(ciks) and ciks[position] == cik:
+        return transaction_index['starts'][position], transaction_index['ends'][position]
+    return 0, 0
+
+def owner_rows(transaction_index, cik):
+    """Row positions in transaction_source of one owner's transactions"""
+    start, end = _owner_range(transaction_index, cik)
+    if transaction_index['facts'] is not None:
+        return transaction_index['fact_ids'][start:end]
+    return np.arange(start, end)
+
+def gather_transactions(transaction_index, rows, columns=None):
+    """The given rows of transaction_source, optionally narrowed to some columns"""
+    gathered = transaction_source(transaction_index).take(rows)
+    return gathered if columns is None else gathered[list(columns)]
+
+def gather_column(transaction_index, rows, column):
+    """One column of the given rows as an array, without gathering the other columns"""
+    return transaction_source(transaction_index)[column].to_numpy()[rows]
+
+def owner_transactions(transaction_index, cik):
+    """All transactions of one owner as a contiguous slice (or its facts)"""
+    start, end = _owner_range(transaction_index, cik)
+    if transaction_index['facts'] is not None:
+        return transaction_index['facts'].take(transaction_index['fact_ids'][start:end])
+    return transaction_index['transactions'].iloc[start:end]
+
+def page_positions(values, mask, offset, page_size, ascending=False):
+    """Row positions of one page of the masked rows sorted by values, without sorting every row
+
+    Missing values sort last and ties keep row order, like a stable sort_values.
+    Only the rows up to the end of the page are fully sorted.
+    """
+    positions = np.flatnonzero(mask)
+    keys = np.asarray(values, dtype=float)[positions]
+    if not ascending:
+        keys = -keys
+    keys[np.isnan(keys)] = np.inf
+
+    end = min(offset + page_size, len(positions))
+    if end <= offset:
+        return positions[:0]
+    if end < len(positions):
+        # Keep only rows that can land on or before this page (ties at the boundary included)
+        boundary = np.partition(keys, end - 1)[end - 1]
+        candidates = keys <= boundary
+        positions, keys = positions[candidates], keys[candidates]
+    order = np.lexsort((positions, keys))
+    return positions[order[offset:end]]
@@ -0,0 +1,283 @@
+import argparse
+import gc
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from compact_transactions import compact_transactions
+from horizons import horizon_labels, horizons_in_columns, price_column
+from instrumentation import current_rss_mb, process_peak_rss_mb
+from stage_store import new_version_dir, publish_version, read_current, read_stage, stage_files
+from transaction_clusters import CLUSTER_GAP_DAYS, build_clusters
+
+# Bump when the snapshot layout changes so old snapshots are rebuilt
+SNAPSHOT_VERSION = 4
+SNAPSHOT_DIR_NAME = "dashboard_snapshot"
+SNAPSHOT_FILES = ['transactions', 'facts', 'clusters', 'investors']
+SOURCE_STAGES = ['investor_weighted_returns', 'transactions_with_returns_and_relatives', 'investor_significance']
+
+def return_columns(labels):
+    """Per-transaction stock and relative return columns, grouped by kind in horizon order"""
+    return [f'{prefix}_{label}' for prefix in ['RETURN', 'Vs_SP500', 'Vs_Sector'] for label in labels]
+
+def transaction_columns(labels):
+    """Transaction columns the dashboard reads from the stage store"""
+    return [
+        'OWNER_CIK', 'ISSUERNAME', 'ISSUERTRADINGSYMBOL', 'GICS_SECTOR', 'GICS_SUB_INDUSTRY',
+        'TRANS_DATE', 'ADJUSTED_TRANS_SHARES', 'ADJUSTED_TRANS_PRICEPERSHARE', 'ADJUSTED_TOTAL_TRANS_VALUE',
+    ] + [price_column(label) for label in labels] + return_columns(labels)
+
+def default_snapshot_dir(store_dir):
+    return os.path.join(store_dir, SNAPSHOT_DIR_NAME)
+
+def source_fingerprint(store_dir):
+    """Hash of the snapshot version and the name, size and mtime of every source stage file"""
+    digest = hashlib.sha256(f"v{SNAPSHOT_VERSION}".encode())
+    for stage in SOURCE_STAGES:
+        for path in stage_files(stage, store_dir):
+            stat = os.stat(path)
+            digest.update(f"{stage}|{os.path.basename(path)}|{stat.st_size}|{stat.st_mtime_ns}".encode())
+    return digest.hexdigest()
+
+def _to_arrow(df):
+    """Arrow table that keeps float NaN as NaN rather than null, so float columns map without a copy
+
+    Categorical columns are written as dictionary arrays and map back as categoricals.
+    """
+    arrays = []
+    for col in df.columns:
+        if pd.api.types.is_float_dtype(df[col]):
+            arrays.append(pa.array(df[col].to_numpy(dtype=float)))
+        else:
+            arrays.append(pa.Array.from_pandas(df[col]))
+    return pa.Table.from_arrays(arrays, names=list(df.columns))
+
+def transaction_links(transactions):
+    """(OWNER_CIK, FACT_ID) links in the row order of transactions, and the distinct facts they point to
+
+    Transaction lines shared by the owners of a joint filing are stored once,
+    with dictionary-encoded strings (compact_transactions.py).
+    """
+    compact = compact_transactions(transactions)
+    links = pd.DataFrame({
+        'OWNER_CIK': compact['owners']['OWNER_CIK'].to_numpy()[compact['links']['OWNER_CODE'].to_numpy()],
+        'FACT_ID': compact['links']['FACT_ID'].to_numpy(),
+    })
+    return links, compact['facts']
+
+def _read_version_manifest(version_dir):
+    path = os.path.join(version_dir, "manifest.json")
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def read_manifest(snapshot_dir):
+    """Manifest of the current snapshot version, or None when there is no snapshot"""
+    return read_current(snapshot_dir, lambda version_dir: _read_version_manifest(version_dir or snapshot_dir))
+
+def build_snapshot(store_dir='.', snapshot_dir=None):
+    """Read the source stages once and write the typed, owner-sorted Arrow files the dashboard maps
+
+    Each build is a new version directory of snapshot_dir, published once
+    complete. Files a running dashboard still maps are never replaced (which
+    Windows refuses), so it picks up the new version on its next load.
+    """
+    snapshot_dir = snapshot_dir or default_snapshot_dir(store_dir)
+    start = time.perf_counter()
+    fingerprint = source_fingerprint(store_dir)
+
+    investors = read_stage('investor_weighted_returns', store_dir)
+    if stage_files('investor_significance', store_dir):
+        # Bootstrap intervals and p-values (investor_significance.py) are optional filter columns
+        significance = read_stage('investor_significance', store_dir)
+        investors = investors.merge(significance, on=['OWNER_CIK', 'OWNER_NAME'], how='left')
+    # Horizons follow whatever the investor metrics were computed with
+    horizons = horizons_in_columns(investors.columns)
+    labels = horizon_labels(horizons)
+    transactions = read_stage('transactions_with_returns_and_relatives', store_dir, columns=transaction_columns(labels))
+    # Presorted by owner so the drill-down index needs no sort at load time
+    transactions = transactions.sort_values('OWNER_CIK', kind='mergesort').reset_index(drop=True)
+    # Clusters are numbered in owner order, so they come out presorted too
+    clusters = build_clusters(transactions, horizons, CLUSTER_GAP_DAYS)
+    links, facts = transaction_links(transactions)
+
+    os.makedirs(snapshot_dir, exist_ok=True)
+    version_dir = new_version_dir(snapshot_dir)
+    for name, df in [('investors', investors), ('facts', facts), ('transactions', links), ('clusters', clusters)]:
+        feather.write_feather(_to_arrow(df), os.path.join(version_dir, f"{name}.arrow"), compression='uncompressed')
+
+    manifest = {
+        'version': SNAPSHOT_VERSION,
+        'fingerprint': fingerprint,
+        'horizons': labels,
+        'investors': len(investors),
+        'transactions': len(transactions),
+        'facts': len(facts),
+        'clusters': len(clusters),
+        'cluster_gap_days': CLUSTER_GAP_DAYS,
+        'build_seconds': round(time.perf_counter() - start, 3),
+    }
+    with open(os.path.join(version_dir, "manifest.json"), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    publish_version(snapshot_dir, version_dir)
+    # Files of the older flat layout are superseded by the first version
+    for name in [f"{name}.arrow" for name in SNAPSHOT_FILES] + ["manifest.json"]:
+        try:
+            os.remove(os.path.join(snapshot_dir, name))
+        except OSError:
+            pass
+    return manifest
+
+def snapshot_is_current(store_dir='.', snapshot_dir=None):
+    manifest = read_manifest(snapshot_dir or default_snapshot_dir(store_dir))
+    return manifest is not None and manifest['fingerprint'] == source_fingerprint(store_dir)
+
+def _map_frame(path):
+    """Memory-map an Arrow file; numeric columns stay backed by the shared page cache"""
+    table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+    return table.to_pandas(split_blocks=True)
+
+def load_snapshot(store_dir='.', snapshot_dir=None):
+    """Map the dashboard snapshot, rebuilding it first if the source stages changed
+
+    Returns (transactions_df, facts_df, clusters_df, investors_df, horizon labels);
+    transactions are (OWNER_CIK, FACT_ID) links into facts, and they and the
+    clusters are sorted by OWNER_CIK.
+    """
+    snapshot_dir = snapshot_dir or default_snapshot_dir(store_dir)
+    manifest = read_manifest(snapshot_dir)
+    if manifest is None or manifest['fingerprint'] != source_fingerprint(store_dir):
+        build_snapshot(store_dir, snapshot_dir)
+
+    # Every file and the manifest come from the same version
+    def map_version(version_dir):
+        version_dir = version_dir or snapshot_dir
+        frames = [_map_frame(os.path.join(version_dir, f"{name}.arrow")) for name in SNAPSHOT_FILES]
+        return frames, _read_version_manifest(version_dir)
+    (transactions, facts, clusters, investors), manifest = read_current(snapshot_dir, map_version)
+    return transactions, facts, clusters, investors, manifest['horizons']
+
+def load_snapshot_investors(store_dir='.', snapshot_dir=None):
+    """Map only the investor table of the snapshot (building it if missing); returns (investors_df, manifest)"""
+    snapshot_dir = snapshot_dir or default_snapshot_dir(store_dir)
+    if read_manifest(snapshot_dir) is None:
+        build_snapshot(store_dir, snapshot_dir)
+
+    def map_version(version_dir):
+        version_dir = version_dir or snapshot_dir
+        return _map_frame(os.path.join(version_dir, "investors.arrow")), _read_version_manifest(version_dir)
+    return read_current(snapshot_dir, map_version)
+
+def _probe(mode, store_dir, snapshot_dir):
+    """Load the dashboard data one way in this (fresh) process and report time and peak memory"""
+    from dashboard_index import build_investor_index, build_transaction_index
+
+    start = time.perf_counter()
+    if mode == 'snapshot':
+        transactions, facts, clusters, investors, _ = load_snapshot(store_dir, snapshot_dir)
+        build_transaction_index(transactions, presorted=True, facts=facts)
+        build_transaction_index(clusters, presorted=True)
+    else:
+        investors = read_stage('investor_weighted_returns', store_dir)
+        labels = horizon_labels(horizons_in_columns(investors.columns))
+        transactions = read_stage('transactions_with_returns_and_relatives', store_dir, columns=transaction_columns(labels))
+        build_transaction_index(transactions)
+    build_investor_index(investors)
+    result = {'mode': mode, 'seconds': time.perf_counter() - start, 'peak_rss_mb': process_peak_rss_mb()}
+    print(json.dumps(result))
+
+def _probe_sessions(store_dir, sessions):
+    """Open sessions dashboard sessions at once in this (fresh) process and report the RSS they add
+
+    The first session loads the shared snapshot and indexes; the others then
+    run concurrently (as the Streamlit server runs each session's script on its
+    own thread) and stay open, so what is left is their per-session state.
+    """
+    from streamlit.testing.v1 import AppTest
+
+    os.chdir(store_dir)  # the dashboard reads the stage store from its working directory
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "interactive_dashboard.py")
+
+    def open_session(number):
+        session = AppTest.from_file(script, default_timeout=600)
+        session.run()
+        if number % 2:
+            # Every other session switches to the clustered drill-down
+            session.toggle[0].set_value(True).run()
+        return session
+
+    open_sessions = [open_session(0)]
+    gc.collect()
+    first_rss = current_rss_mb()
+    with ThreadPoolExecutor(max_workers=sessions) as pool:
+        open_sessions += list(pool.map(open_session, range(1, sessions)))
+    gc.collect()
+    rss = current_rss_mb()
+    print(json.dumps({'sessions': len(open_sessions), 'first_session_rss_mb': first_rss, 'rss_mb': rss,
+                      'per_session_mb': (rss - first_rss) / max(sessions - 1, 1)}))
+
+def measure_sessions(store_dir='.', session_counts=(2, 5, 10)):
+    """RSS with N concurrent dashboard sessions, each N in a fresh process; per_session_mb should stay flat"""
+    rows = []
+    for sessions in session_counts:
+        command = [sys.executable, os.path.abspath(__file__), '--store-dir', store_dir,
+                   'probe', 'sessions', '--sessions', str(sessions)]
+        output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+        rows.append(json.loads(output.strip().splitlines()[-1]))
+    return pd.DataFrame(rows).set_index('sessions')
+
+def measure_cold_start(store_dir='.', snapshot_dir=None, repeats=3):
+    """Time dashboard data loading from the stage files and from the snapshot, each in a fresh process"""
+    if not snapshot_is_current(store_dir, snapshot_dir):
+        build_snapshot(store_dir, snapshot_dir)
+    rows = []
+    for mode in ['stages', 'snapshot']:
+        for _ in range(repeats):
+            command = [sys.executable, os.path.abspath(__file__), '--store-dir', store_dir]
+            if snapshot_dir:
+                command += ['--snapshot-dir', snapshot_dir]
+            command += ['probe', mode]
+            output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+            rows.append(json.loads(output.strip().splitlines()[-1]))
+    return pd.DataFrame(rows).groupby('mode', sort=False).median()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build and check the prebuilt dashboard snapshot")
+    parser.add_argument('--store-dir', default='.')
+    parser.add_argument('--snapshot-dir', help=f"Default: <store-dir>/{SNAPSHOT_DIR_NAME}")
+    subparsers = parser.add_subparsers(dest='action', required=True)
+    subparsers.add_parser('build', help="Rebuild the snapshot from the source stages")
+    subparsers.add_parser('status', help="Show whether the snapshot matches the source stages")
+    time_parser = subparsers.add_parser('time', help="Measure cold-start load time, stages vs snapshot")
+    time_parser.add_argument('--repeats', type=int, default=3)
+    sessions_parser = subparsers.add_parser('sessions', help="Measure memory with N concurrent dashboard sessions")
+    sessions_parser.add_argument('--counts', default='2,5,10', help="Comma-separated session counts")
+    probe_parser = subparsers.add_parser('probe')
+    probe_parser.add_argument('mode', choices=['stages', 'snapshot', 'sessions'])
+    probe_parser.add_argument('--sessions', type=int, default=2)
+    args = parser.parse_args()
+
+    if args.action == 'build':
+        manifest = build_snapshot(args.store_dir, args.snapshot_dir)
+        print(f"Snapshot built in {manifest['build_seconds']}s: {manifest['investors']} investors, "
+              f"{manifest['transactions']} transactions ({manifest['facts']} distinct), {manifest['clusters']} clusters")
+    elif args.action == 'status':
+        state = "current" if snapshot_is_current(args.store_dir, args.snapshot_dir) else "stale or missing"
+        print(f"Snapshot is {state}")
+    elif args.action == 'time':
+        print(measure_cold_start(args.store_dir, args.snapshot_dir, args.repeats).to_string())
+    elif args.action == 'sessions':
+        counts = [int(count) for count in args.counts.split(',')]
+        print(measure_sessions(args.store_dir, counts).to_string(float_format=lambda value: f"{value:.1f}"))
+    elif args.mode == 'sessions':
+        _probe_sessions(args.store_dir, args.sessions)
+    else:
+        _probe(args.mode, args.store_dir, args.snapshot_dir)
@@ -0,0 +1,56 @@
+import re
+
+# Horizon label -> days after the transaction date. 6M/1Y/18M are the offsets the
+# pipeline has always used; labels not listed here use 30 days per month, 365 per year
+HORIZON_DAYS = {
+    '1M': 30,
+    '3M': 90,
+    '6M': 180,
+    '1Y': 365,
+    '18M': 547,
+    '2Y': 730,
+    '3Y': 1095,
+}
+UNIT_DAYS = {'D': 1, 'M': 30, 'Y': 365}
+UNIT_NAMES = {'D': 'Day', 'M': 'Month', 'Y': 'Year'}
+
+# Market_Condition is classified from the 6M S&P 500 return, so 6M is always computed
+REQUIRED_HORIZONS = ['6M']
+
+def horizon_days(label):
+    """Days after the transaction date for a horizon label such as 3M, 2Y or 45D"""
+    if label in HORIZON_DAYS:
+        return HORIZON_DAYS[label]
+    match = re.fullmatch(r'(\d+)([DMY])', label)
+    if not match:
+        raise ValueError(f"Unknown horizon '{label}' (expected e.g. 3M, 2Y or 45D)")
+    return int(match.group(1)) * UNIT_DAYS[match.group(2)]
+
+def parse_horizons(spec):
+    """Turn '1M,3M,1Y' (or a list of labels) into (label, days) pairs ordered by days"""
+    labels = spec.split(',') if isinstance(spec, str) else list(spec)
+    labels = [label.strip().upper() for label in labels if label.strip()]
+    labels += [label for label in REQUIRED_HORIZONS if label not in labels]
+    horizons = {label: horizon_days(label) for label in labels}
+    return sorted(horizons.items(), key=lambda item: item[1])
+
+DEFAULT_HORIZONS = parse_horizons('6M,1Y,18M')
+
+def horizon_labels(horizons):
+    return [label for label, _ in horizons]
+
+def horizon_name(label):
+    """Readable horizon name, e.g. '18M' -> '18 Month'"""
+    return f"{label[:-1]} {UNIT_NAMES[label[-1]]}"
+
+def price_column(label):
+    """Forward price column for a horizon, e.g. '1Y' -> '1 Year Price'"""
+    return f"{horizon_name(label)} Price"
+
+def forward_price_columns(horizons):
+    """Forward price column -> days after the transaction date"""
+    return {price_column(label): days for label, days in horizons}
+
+def horizons_in_columns(columns, prefix='Weighted_Return_'):
+    """Recover the horizons a stage was computed with from its column names"""
+    return parse_horizons([col[len(prefix):] for col in columns if col.startswith(prefix)])
@@ -0,0 +1,209 @@
+import os
+import argparse
+import pandas as pd
+
+from transactions_combined_with_SP500_sector_performance import (
+    build_benchmark_index, add_benchmark_levels, add_benchmark_returns, add_relative_returns
+)
+from transactions_with_split_adjustments import build_split_factors, add_split_adjustments
+from transactions_with_calculated_returns import calculate_returns
+from transactions_with_weighted_returns import (
+    INVESTOR_KEYS, investor_aggregation_columns, prepare_transactions, investor_partial_sums, merge_partial_sums,
+    finalize_investor_metrics
+)
+from horizons import DEFAULT_HORIZONS, parse_horizons
+from stage_store import (
+    DEFAULT_STORE_DIR, stage_exists, read_stage, write_stage, append_stage, part_path, new_version_dir,
+    publish_version, read_current
+)
+
+STORE_STAGE = 'transactions_with_returns_and_relatives'
+
+# A filing is ingested once per owner; rows sharing both keys arrive together
+FILING_KEYS = ['ACCESSION_NUMBER', 'OWNER_CIK']
+PARTIAL_TABLES = ['investors', 'years', 'companies', 'sectors']
+# Filing keys are tagged with the batch that ingested them; a rebuild tags them all alike
+REBUILD_BATCH_ID = 'rebuild'
+
+def write_csv_atomic(df, path, index=False):
+    """Write a CSV next to its destination and swap it in, so readers never see a partial file"""
+    tmp_path = f"{path}.tmp"
+    df.to_csv(tmp_path, index=index)
+    os.replace(tmp_path, path)
+
+def save_state(partials, filing_keys, state_dir):
+    """Persist per-investor running sums and the set of ingested filing keys
+
+    The files go to a new version directory that is published in one swap, so
+    the sums and the filing keys (which say which batches they include) always
+    come from the same save. A batch counts as ingested once its keys are there.
+    """
+    os.makedirs(state_dir, exist_ok=True)
+    version_dir = new_version_dir(state_dir)
+    for table in PARTIAL_TABLES:
+        partials[table].to_csv(os.path.join(version_dir, f"{table}.csv"), index=(table == 'investors'))
+    filing_keys.to_csv(os.path.join(version_dir, "filing_keys.csv"), index=False)
+    publish_version(state_dir, version_dir)
+    # Files of the older flat layout are superseded by the first version
+    for name in [f"{table}.csv" for table in PARTIAL_TABLES] + ["filing_keys.csv"]:
+        if os.path.exists(os.path.join(state_dir, name)):
+            os.remove(os.path.join(state_dir, name))
+
+def _load_state_version(version_dir):
+    partials = {}
+    for table in PARTIAL_TABLES:
+        partials[table] = pd.read_csv(os.path.join(version_dir, f"{table}.csv"))
+    investors = partials['investors'].set_index(INVESTOR_KEYS)
+    investors['Date_Min'] = pd.to_datetime(investors['Date_Min'])
+    investors['Date_Max'] = pd.to_datetime(investors['Date_Max'])
+    partials['investors'] = investors
+    filing_keys = pd.read_csv(os.path.join(version_dir, "filing_keys.csv"), dtype={'BATCH_ID': str})
+    if 'BATCH_ID' not in filing_keys.columns:
+        filing_keys['BATCH_ID'] = REBUILD_BATCH_ID
+    return partials, filing_keys
+
+def load_state(state_dir):
+    """Load running sums and ingested filing keys written by save_state (or the older flat layout)"""
+    return read_current(state_dir, lambda version_dir: _load_state_version(version_dir or state_dir))
+
+def state_exists(state_dir):
+    return read_current(state_dir, lambda version_dir: os.path.exists(
+        os.path.join(version_dir or state_dir, "filing_keys.csv")))
+
+def rebuild_state(store_dir, state_dir, horizons=DEFAULT_HORIZONS):
+    """Build running sums from the full transaction store (one-time, or after a schema or horizon change)"""
+    store = read_stage(STORE_STAGE, store_dir, columns=investor_aggregation_columns(horizons) + ['ACCESSION_NUMBER'])
+    partials = investor_partial_sums(prepare_transactions(store), horizons)
+    filing_keys = store[FILING_KEYS].drop_duplicates().assign(BATCH_ID=REBUILD_BATCH_ID)
+    save_state(partials, filing_keys, state_dir)
+    print(f"Rebuilt state for {len(partials['investors'])} investors from {len(store)} transactions")
+    return partials, filing_keys
+
+def batch_id(new_rows):
+    """Content id of a batch's new filings, so a retried batch maps to the same store part"""
+    keys = new_rows[FILING_KEYS].drop_duplicates().sort_values(FILING_KEYS)
+    return f"{pd.util.hash_pandas_object(keys, index=False).sum() & 0xFFFFFFFFFFFF:012x}"
+
+def pending_batch_path(state_dir):
+    return os.path.join(state_dir, "pending_batch.csv")
+
+def select_new_rows(batch, filing_keys):
+    """Drop batch rows whose (ACCESSION_NUMBER, OWNER_CIK) has already been ingested"""
+    seen = pd.MultiIndex.from_frame(filing_keys[FILING_KEYS])
+    already_ingested = pd.MultiIndex.from_frame(batch[FILING_KEYS]).isin(seen)
+    return batch[~already_ingested]
+
+def process_new_rows(batch, sp500_sectors_df, split_factors, horizons=DEFAULT_HORIZONS):
+    """Run the benchmark join, split adjustment, return and relative-return steps on new rows only"""
+    batch = batch.copy()
+    batch['TRANS_DATE'] = pd.to_datetime(batch['TRANS_DATE']).dt.tz_localize(None)
+    batch = add_benchmark_levels(batch, build_benchmark_index(sp500_sectors_df), horizons)
+    batch = add_benchmark_returns(batch, sp500_sectors_df, horizons)
+    batch = add_split_adjustments(batch, split_factors)
+    batch = calculate_returns(batch, horizons)
+    return add_relative_returns(batch, horizons)
+
+def select_investors(partials, investor_index):
+    """Restrict partial sums to the given (OWNER_CIK, OWNER_NAME) index"""
+    selected = {'investors': partials['investors'].loc[investor_index]}
+    for table in PARTIAL_TABLES[1:]:
+        rows = partials[table]
+        selected[table] = rows[pd.MultiIndex.from_frame(rows[INVESTOR_KEYS]).isin(investor_index)]
+    return selected
+
+def upsert_investor_metrics(updated, store_dir, export_csv=False, touched=None):
+    """Replace the rows of touched investors (by default, those in updated) in the investor metrics stage"""
+    if stage_exists('investor_weighted_returns', store_dir):
+        existing = read_stage('investor_weighted_returns', store_dir)
+        if touched is None:
+            touched = pd.MultiIndex.from_frame(updated[INVESTOR_KEYS])
+        keep = ~pd.MultiIndex.from_frame(existing[INVESTOR_KEYS]).isin(touched)
+        merged = pd.concat([existing[keep], updated], ignore_index=True)
+    else:
+        merged = updated
+    merged = merged.sort_values(INVESTOR_KEYS, kind='mergesort')
+    if '0' in merged.columns and merged['0'].isna().all():
+        merged = merged.drop(columns='0')
+    write_stage(merged, 'investor_weighted_returns', store_dir, export_csv=export_csv)
+    return merged
+
+def recover_pending_batch(partials, filing_keys, store_dir, state_dir, export_csv=False, horizons=DEFAULT_HORIZONS):
+    """Undo a batch that stopped before its state was saved
+
+    Its store part is removed and its investors' metrics are recomputed from
+    the saved state, so its filings are simply ingested again by a later batch.
+    """
+    path = pending_batch_path(state_dir)
+    if not os.path.exists(path):
+        return
+    pending = pd.read_csv(path, dtype={'BATCH_ID': str})
+    pending_id = pending['BATCH_ID'].iloc[0]
+    if pending_id not in set(filing_keys['BATCH_ID']):
+        print(f"Rolling back interrupted batch {pending_id}")
+        if os.path.exists(part_path(STORE_STAGE, store_dir, f"batch-{pending_id}")):
+            os.remove(part_path(STORE_STAGE, store_dir, f"batch-{pending_id}"))
+        touched = pd.MultiIndex.from_frame(pending[INVESTOR_KEYS])
+        # Investors first seen in the interrupted batch have no saved sums and are dropped
+        known = touched[touched.isin(partials['investors'].index)]
+        restored = finalize_investor_metrics(select_investors(partials, known), horizons)
+        upsert_investor_metrics(restored, store_dir, export_csv=export_csv, touched=touched)
+    os.remove(path)
+
+def apply_batch(batch, sp500_sectors_df, split_factors, store_dir, state_dir, export_csv=False,
+                horizons=DEFAULT_HORIZONS):
+    """Ingest a batch of new filings and refresh metrics for the investors it touches
+
+    The batch's investors are recorded in pending_batch.csv before anything is
+    written, and the state is saved only after the store part and the metrics
+    are. If the batch stops part way, the next run rolls it back first.
+    """
+    partials, filing_keys = load_state(state_dir)
+    recover_pending_batch(partials, filing_keys, store_dir, state_dir, export_csv, horizons)
+
+    new_rows = select_new_rows(batch, filing_keys)
+    if new_rows.empty:
+        print("No new filings in batch")
+        return None
+    print(f"Processing {len(new_rows)} new transactions ({len(batch) - len(new_rows)} already ingested)")
+
+    new_rows = process_new_rows(new_rows, sp500_sectors_df, split_factors, horizons)
+    current_id = batch_id(new_rows)
+
+    # Only the investors in the batch get new sums and new metrics
+    batch_partials = investor_partial_sums(prepare_transactions(new_rows.copy()), horizons)
+    touched = batch_partials['investors'].index
+    write_csv_atomic(touched.to_frame(index=False).assign(BATCH_ID=current_id), pending_batch_path(state_dir))
+
+    append_stage(new_rows, STORE_STAGE, store_dir, part_name=f"batch-{current_id}")
+    partials = merge_partial_sums(partials, batch_partials)
+    updated = finalize_investor_metrics(select_investors(partials, touched), horizons)
+    upsert_investor_metrics(updated, store_dir, export_csv=export_csv)
+
+    new_keys = new_rows[FILING_KEYS].drop_duplicates().assign(BATCH_ID=current_id)
+    save_state(partials, pd.concat([filing_keys, new_keys], ignore_index=True), state_dir)
+    os.remove(pending_batch_path(state_dir))
+    print(f"Updated metrics for {len(touched)} investors")
+    return updated
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Incrementally add new Form 4 filings to the transaction store and investor metrics")
+    parser.add_argument('batch', nargs='?', help="CSV of new transactions (insider_transactions_with_prices_final.csv layout)")
+    parser.add_argument('--store-dir', default=DEFAULT_STORE_DIR)
+    parser.add_argument('--state-dir', default=os.path.join(DEFAULT_STORE_DIR, "incremental_state"))
+    parser.add_argument('--csv', action='store_true', help="Also export investor metrics as CSV")
+    parser.add_argument('--rebuild', action='store_true',
+                        help="Rebuild running sums from the full store first (needed after changing --horizons)")
+    parser.add_argument('--horizons', default='6M,1Y,18M',
+                        help="Comma-separated return horizons, e.g. 1M,3M,6M,1Y,18M,2Y,3Y")
+    args = parser.parse_args()
+    horizons = parse_horizons(args.horizons)
+
+    if args.rebuild or not state_exists(args.state_dir):
+        rebuild_state(args.store_dir, args.state_dir, horizons)
+
+    if args.batch:
+        sp500_sectors_df = pd.read_csv(os.path.join(args.store_dir, "S_P_500_and_Sectors_Ten_Yr_Performance.csv"))
+        sp500_sectors_df['Date'] = pd.to_datetime(sp500_sectors_df['Date']).dt.tz_localize(None)
+        split_factors = build_split_factors(pd.read_csv(os.path.join(args.store_dir, "stock_splits_history_final.csv")))
+        apply_batch(pd.read_csv(args.batch), sp500_sectors_df, split_factors, args.store_dir, args.state_dir,
+                    export_csv=args.csv, horizons=horizons)
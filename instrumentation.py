@@ -0,0 +1,266 @@
+import argparse
+import atexit
+import json
+import os
+import platform
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+import pandas as pd
+
+# Setting FORM4_RUN_REPORT=<path> instruments any script (and the dashboard) and writes
+# the report there on exit; FORM4_PROFILE_STEP=<step> also samples that step's stacks
+REPORT_ENV = 'FORM4_RUN_REPORT'
+PROFILE_ENV = 'FORM4_PROFILE_STEP'
+PROFILE_INTERVAL = 0.005
+PROFILE_TOP = 30
+
+_state = {'enabled': False, 'process_peak': None}
+
+def enable(profile_step=None, profile_interval=PROFILE_INTERVAL):
+    """Start recording steps (and sample the stacks of profile_step, if given)"""
+    _state.update({
+        'enabled': True,
+        'started': time.time(),
+        'start_wall': time.perf_counter(),
+        'start_cpu': time.process_time(),
+        'steps': {},
+        'stack': [],
+        'peaks': [],
+        'profile_step': profile_step,
+        'profile_interval': profile_interval,
+        'profile': None,
+    })
+
+def disable():
+    _state['enabled'] = False
+
+def is_enabled():
+    return _state['enabled']
+
+def _io_counters():
+    """Bytes read and written by this process so far (Linux /proc; None elsewhere)"""
+    try:
+        with open('/proc/self/io') as f:
+            counters = dict(line.split(': ') for line in f.read().splitlines())
+        return int(counters['rchar']), int(counters['wchar'])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+def current_rss_mb():
+    """Current resident set size in MB (Linux /proc; None elsewhere)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def _peak_rss_mb():
+    """High-water mark of the process RSS in MB, or None where resource is unavailable (Windows)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 1024
+
+def _high_water_mb():
+    """RSS high-water mark since the last _reset_high_water in MB (Linux /proc; None elsewhere)"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+def _reset_high_water():
+    """Restart the VmHWM high-water mark from the current RSS; False where the kernel does not allow it"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def _fold_peak(peak):
+    """Raise the running peak of every open step, and of the process, to at least peak"""
+    if peak is not None:
+        _state['peaks'] = [None if running is None else max(running, peak) for running in _state['peaks']]
+        _state['process_peak'] = max(_state['process_peak'] or 0, peak)
+
+def process_peak_rss_mb():
+    """High-water mark of the process RSS in MB, including marks from before steps restarted it"""
+    peaks = [peak for peak in (_state['process_peak'], _peak_rss_mb()) if peak is not None]
+    return max(peaks) if peaks else None
+
+class StackSampler(threading.Thread):
+    """Sample one thread's Python stack at a fixed interval and count collapsed stacks
+
+    Samples are taken when the sampler gets the GIL, so time inside C code
+    that holds it is attributed to the Python line that called into it.
+    """
+
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    def summary(self, step_name):
+        """Sample counts per function (self and total) and the most frequent collapsed stacks"""
+        self_counts, total_counts = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            functions = stack.split(';')
+            self_counts[functions[-1]] += count
+            for function in set(functions):
+                total_counts[function] += count
+        return {
+            'step': step_name,
+            'interval_seconds': self.interval,
+            'samples': sum(self.stacks.values()),
+            'functions': [{'function': function, 'self_samples': self_counts[function], 'total_samples': count}
+                          for function, count in total_counts.most_common(PROFILE_TOP)],
+            # Flame graph input: "outer;inner count"
+            'stacks': dict(self.stacks.most_common(PROFILE_TOP)),
+        }
+
+def _new_totals():
+    return {'calls': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'rss_delta_mb': 0.0, 'peak_rss_mb': None,
+            'rows_in': None, 'rows_out': None, 'bytes_read': None, 'bytes_written': None}
+
+def _add(totals, key, value):
+    if value is not None:
+        totals[key] = (totals[key] or 0) + value
+
+@contextmanager
+def step(name, rows_in=None):
+    """Record one named step; yields a dict the caller can set rows_out (and rows_in) on
+
+    Repeated steps (e.g. one per chunk) are summed under their name. Bytes read
+    and written come from the process I/O counters, and peak_rss_mb is the
+    highest RSS while the step ran (Linux only; None elsewhere). When
+    instrumentation is disabled this only costs one dict lookup.
+    """
+    info = {'rows_in': rows_in}
+    if not _state['enabled']:
+        yield info
+        return
+
+    sampler = None
+    if name == _state['profile_step'] and _state['profile'] is None:
+        sampler = StackSampler(threading.get_ident(), _state['profile_interval'])
+        sampler.start()
+    path = '/'.join(_state['stack'] + [name])
+    _state['stack'].append(name)
+    # Each step restarts the kernel's high-water mark; what the enclosing steps
+    # reached so far is kept in their running peaks first
+    _fold_peak(_high_water_mb())
+    _state['peaks'].append(current_rss_mb() if _reset_high_water() else None)
+    read_before, written_before = _io_counters()
+    rss_before = current_rss_mb()
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    try:
+        yield info
+    finally:
+        wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+        _fold_peak(_high_water_mb())
+        peak = _state['peaks'].pop()
+        _state['stack'].pop()
+        if sampler is not None:
+            sampler.stop()
+            _state['profile'] = sampler.summary(name)
+        read_after, written_after = _io_counters()
+        rss_after = current_rss_mb()
+
+        totals = _state['steps'].setdefault(path, _new_totals())
+        totals['calls'] += 1
+        totals['wall_seconds'] += wall
+        totals['cpu_seconds'] += cpu
+        if rss_before is not None and rss_after is not None:
+            totals['rss_delta_mb'] += rss_after - rss_before
+        if peak is not None:
+            totals['peak_rss_mb'] = max(totals['peak_rss_mb'] or 0, peak)
+        _add(totals, 'rows_in', info.get('rows_in'))
+        _add(totals, 'rows_out', info.get('rows_out'))
+        if read_before is not None:
+            _add(totals, 'bytes_read', read_after - read_before)
+            _add(totals, 'bytes_written', written_after - written_before)
+
+def run_report():
+    """The recorded steps (in first-seen order) and run totals as a JSON-ready dict"""
+    return {
+        'started': pd.Timestamp(_state['started'], unit='s').isoformat(timespec='seconds'),
+        'argv': sys.argv,
+        'python': platform.python_version(),
+        'wall_seconds': time.perf_counter() - _state['start_wall'],
+        'cpu_seconds': time.process_time() - _state['start_cpu'],
+        'peak_rss_mb': process_peak_rss_mb(),
+        'steps': [{'step': path, **totals} for path, totals in _state['steps'].items()],
+        'profile': _state['profile'],
+    }
+
+def write_report(path):
+    report = run_report()
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump(report, f, indent=2)
+    os.replace(f"{path}.tmp", path)
+    return report
+
+def step_table(report):
+    """Steps of a report as a DataFrame indexed by step path"""
+    return pd.DataFrame(report['steps']).set_index('step')
+
+def compare_reports(old, new):
+    """Wall time, CPU time and peak RSS per step of two run reports, with new / old ratios"""
+    columns = ['wall_seconds', 'cpu_seconds', 'peak_rss_mb']
+    comparison = step_table(old)[columns].join(step_table(new)[columns], how='outer', lsuffix='_old', rsuffix='_new')
+    for column in columns[:2]:
+        comparison[f'{column}_ratio'] = comparison[f'{column}_new'] / comparison[f'{column}_old']
+    return comparison
+
+def _enable_from_environment():
+    report_path = os.environ.get(REPORT_ENV)
+    if report_path:
+        enable(os.environ.get(PROFILE_ENV))
+        atexit.register(write_report, report_path)
+
+_enable_from_environment()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show or compare run reports written with FORM4_RUN_REPORT or --report")
+    parser.add_argument('report')
+    parser.add_argument('other', nargs='?', help="A later report to compare against the first")
+    args = parser.parse_args()
+
+    with open(args.report) as f:
+        report = json.load(f)
+    if args.other:
+        with open(args.other) as f:
+            print(compare_reports(report, json.load(f)).to_string(float_format=lambda value: f"{value:.3f}"))
+    else:
+        print(step_table(report).to_string(float_format=lambda value: f"{value:.3f}"))
+        if report['profile']:
+            print(f"\nProfile of {report['profile']['step']} ({report['profile']['samples']} samples):")
+            print(pd.DataFrame(report['profile']['functions']).to_string(index=False))
@@ -1,38 +1,45 @@
 import streamlit as st
+import numpy as np
 import pandas as pd
 
+from dashboard_index import (
+    build_investor_index, build_transaction_index, filter_mask, category_mask, gather_column, gather_transactions,
+    owner_rows, page_positions, transaction_source
+)
+from dashboard_snapshot import load_snapshot, return_columns, source_fingerprint
+from horizons import horizon_name, price_column
+from instrumentation import step
+
 # Page config must be the first Streamlit command
 st.set_page_config(page_title="Insider Trading Analysis", layout="wide")
 
-# Load the data
-@st.cache_data
-def load_data():
-    transactions_df = pd.read_csv("transactions_with_returns_and_relatives.csv")
-    investor_analysis_df = pd.read_csv("investor_weighted_returns.csv")
-    
-    # Convert all return and performance columns to numeric
-    return_columns = [
-        'Weighted_Return_6M', 'Weighted_Return_1Y', 'Weighted_Return_18M',
-        'Weighted_SP500_6M', 'Weighted_SP500_1Y', 'Weighted_SP500_18M',
-        'Weighted_Sector_6M', 'Weighted_Sector_1Y', 'Weighted_Sector_18M',
-        'Return_vs_SP500_6M', 'Return_vs_SP500_1Y', 'Return_vs_SP500_18M',
-        'Return_vs_Sector_6M', 'Return_vs_Sector_1Y', 'Return_vs_Sector_18M'
-    ]
-    
-    # Only convert columns that exist
-    for col in return_columns:
-        if col in investor_analysis_df.columns:
-            investor_analysis_df[col] = pd.to_numeric(investor_analysis_df[col], errors='coerce')
-    
-    # Convert monetary values
-    monetary_columns = ['Min_Transaction_Value', 'Avg_Transaction_Value', 'Total_Transaction_Value']
-    for col in monetary_columns:
-        if col in investor_analysis_df.columns:
-            investor_analysis_df[col] = pd.to_numeric(investor_analysis_df[col], errors='coerce')
-    
-    return transactions_df, investor_analysis_df
-
-transactions_df, investor_analysis_df = load_data()
+# Load the prebuilt snapshot (rebuilt when the stage files change) and build the
+# query indexes once per process; they are shared by every session and rerun,
+# so the app treats them as read-only
+@st.cache_resource(max_entries=1)
+def load_data(fingerprint):
+    with step('load_data'):
+        with step('load_snapshot') as info:
+            transactions_df, facts_df, clusters_df, investor_analysis_df, labels = load_snapshot('.')
+            info['rows_out'] = len(transactions_df)
+        with step('build_indexes', rows_in=len(transactions_df) + len(clusters_df)):
+            transaction_index = build_transaction_index(transactions_df, presorted=True, facts=facts_df)
+            cluster_index = build_transaction_index(clusters_df, presorted=True)
+            investor_index = build_investor_index(investor_analysis_df)
+    return transaction_index, cluster_index, investor_analysis_df, investor_index, labels
+
+(transaction_index, cluster_index, investor_analysis_df, investor_index,
+ horizon_labels_shown) = load_data(source_fingerprint('.'))
+
+def page_controls(key, total_rows):
+    """Rows-per-page and page widgets; returns (offset, page_size)"""
+    col1, col2 = st.columns(2)
+    with col1:
+        page_size = st.selectbox("Rows per page", [25, 50, 100, 250], index=1, key=f"{key}_page_size")
+    page_count = max(1, -(-total_rows // page_size))
+    with col2:
+        page = st.number_input(f"Page (of {page_count})", min_value=1, value=1, step=1, key=f"{key}_page")
+    return (min(page, page_count) - 1) * page_size, page_size
 
 st.title("Insider Trading Analysis Dashboard")
 
@@ -40,25 +47,41 @@ st.title("Insider Trading Analysis Dashboard")
 st.subheader("Filter Investors")
 
 # Returns vs Market Filters
+return_filters = []
 with st.expander("Returns vs Market Filters"):
     col1, col2 = st.columns(2)
     with col1:
         st.markdown("**Min Returns**")
-        min_return_sp500_6m = st.number_input("6 Month Min vs S&P500 (%)", value=5.0, format="%.1f") / 100
-        min_return_sp500_1y = st.number_input("1 Year Min vs S&P500 (%)", value=5.0, format="%.1f") / 100
-        min_return_sp500_18m = st.number_input("18 Month Min vs S&P500 (%)", value=5.0, format="%.1f") / 100
-        min_return_sector_6m = st.number_input("6 Month Min vs Sector (%)", value=5.0, format="%.1f") / 100
-        min_return_sector_1y = st.number_input("1 Year Min vs Sector (%)", value=5.0, format="%.1f") / 100
-        min_return_sector_18m = st.number_input("18 Month Min vs Sector (%)", value=5.0, format="%.1f") / 100
-
     with col2:
         st.markdown("**Max Returns**")
-        max_return_sp500_6m = st.number_input("6 Month Max vs S&P500 (%)", value=500.0, format="%.1f") / 100
-        max_return_sp500_1y = st.number_input("1 Year Max vs S&P500 (%)", value=500.0, format="%.1f") / 100
-        max_return_sp500_18m = st.number_input("18 Month Max vs S&P500 (%)", value=500.0, format="%.1f") / 100
-        max_return_sector_6m = st.number_input("6 Month Max vs Sector (%)", value=500.0, format="%.1f") / 100
-        max_return_sector_1y = st.number_input("1 Year Max vs Sector (%)", value=500.0, format="%.1f") / 100
-        max_return_sector_18m = st.number_input("18 Month Max vs Sector (%)", value=500.0, format="%.1f") / 100
+    for benchmark, benchmark_name in [('SP500', 'S&P500'), ('Sector', 'Sector')]:
+        for label in horizon_labels_shown:
+            with col1:
+                min_return = st.number_input(f"{horizon_name(label)} Min vs {benchmark_name} (%)", value=5.0, format="%.1f") / 100
+            with col2:
+                max_return = st.number_input(f"{horizon_name(label)} Max vs {benchmark_name} (%)", value=500.0, format="%.1f") / 100
+            return_filters.append((f'Return_vs_{benchmark}_{label}', min_return, max_return))
+
+# Significance Filters, when investor_significance.py has been run
+significance_filters = []
+if any(col.startswith('P_Value_vs_') for col in investor_analysis_df.columns):
+    with st.expander("Significance Filters"):
+        col1, col2 = st.columns(2)
+        with col1:
+            st.markdown("**Max p-value**")
+        with col2:
+            st.markdown("**Min Confidence Interval Low (%)**")
+        for benchmark, benchmark_name in [('SP500', 'S&P500'), ('Sector', 'Sector')]:
+            for label in horizon_labels_shown:
+                if f'P_Value_vs_{benchmark}_{label}' not in investor_analysis_df.columns:
+                    continue
+                with col1:
+                    max_p_value = st.number_input(f"{horizon_name(label)} p-value vs {benchmark_name}",
+                                                  min_value=0.0, max_value=1.0, value=1.0, step=0.01)
+                with col2:
+                    min_ci_low = st.number_input(f"{horizon_name(label)} CI Low vs {benchmark_name} (%)",
+                                                 value=-10000.0, format="%.1f") / 100
+                significance_filters.append((f'{benchmark}_{label}', max_p_value, min_ci_low))
 
 # Transaction Pattern Filters
 with st.expander("Transaction Pattern Filters"):
@@ -78,177 +101,142 @@ with st.expander("Company/Sector Filters"):
     with col1:
         selected_sectors = st.multiselect(
             "Filter by Most Active Sector",
-            options=investor_analysis_df['Most_Active_Sector'].unique()
+            options=investor_index['categories']['Most_Active_Sector']['values']
         )
     with col2:
         selected_cap_categories = st.multiselect(
             "Filter by Market Cap Category",
-            options=investor_analysis_df['Most_Common_Company_Cap_Category'].unique()
+            options=investor_index['categories']['Most_Common_Company_Cap_Category']['values']
         )
 
-# Apply filters
-filtered_investors = investor_analysis_df[
-    (investor_analysis_df['Return_vs_SP500_6M'].fillna(-100) >= min_return_sp500_6m) &
-    (investor_analysis_df['Return_vs_SP500_6M'].fillna(100) <= max_return_sp500_6m) &
-    (investor_analysis_df['Return_vs_SP500_1Y'].fillna(-100) >= min_return_sp500_1y) &
-    (investor_analysis_df['Return_vs_SP500_1Y'].fillna(100) <= max_return_sp500_1y) &
-    (investor_analysis_df['Return_vs_SP500_18M'].fillna(-100) >= min_return_sp500_18m) &
-    (investor_analysis_df['Return_vs_SP500_18M'].fillna(100) <= max_return_sp500_18m) &
-    (investor_analysis_df['Return_vs_Sector_6M'].fillna(-100) >= min_return_sector_6m) &
-    (investor_analysis_df['Return_vs_Sector_1Y'].fillna(-100) >= min_return_sector_1y) &
-    (investor_analysis_df['Return_vs_Sector_18M'].fillna(-100) >= min_return_sector_18m) &
-    (investor_analysis_df['Transaction_Count'].fillna(0) >= min_transaction_count) &
-    (investor_analysis_df['Unique_Transaction_Years'].fillna(0) >= min_unique_years) &
-    (investor_analysis_df['Number_of_Companies'].fillna(0) >= min_companies) &
-    (investor_analysis_df['Min_Transaction_Value'].fillna(0) >= min_transaction_value * 1_000_000) &
-    (investor_analysis_df['Avg_Transaction_Value'].fillna(0) >= min_avg_transaction_value * 1_000_000) &
-    (investor_analysis_df['Avg_Days_Between_Transactions'].fillna(365000) <= max_days_between)
-]
+# Apply filters on the precomputed arrays
+min_values = {
+    'Transaction_Count': min_transaction_count,
+    'Unique_Transaction_Years': min_unique_years,
+    'Number_of_Companies': min_companies,
+    'Min_Transaction_Value': min_transaction_value * 1_000_000,
+    'Avg_Transaction_Value': min_avg_transaction_value * 1_000_000,
+}
+max_values = {'Avg_Days_Between_Transactions': max_days_between}
+for column, min_return, max_return in return_filters:
+    min_values[column] = min_return
+    max_values[column] = max_return
+for suffix, max_p_value, min_ci_low in significance_filters:
+    max_values[f'P_Value_vs_{suffix}'] = max_p_value
+    min_values[f'CI_Low_vs_{suffix}'] = min_ci_low
+investor_mask = filter_mask(investor_index, min_values, max_values)
 
 # Add debug information
 st.write("Total rows before filtering:", len(investor_analysis_df))
-st.write("Total rows after filtering:", len(filtered_investors))
+st.write("Total rows after filtering:", int(investor_mask.sum()))
 
 # Apply sector and market cap filters if selected
 if selected_sectors:
-    filtered_investors = filtered_investors[filtered_investors['Most_Active_Sector'].isin(selected_sectors)]
+    investor_mask &= category_mask(investor_index, 'Most_Active_Sector', selected_sectors)
 if selected_cap_categories:
-    filtered_investors = filtered_investors[filtered_investors['Most_Common_Company_Cap_Category'].isin(selected_cap_categories)]
+    investor_mask &= category_mask(investor_index, 'Most_Common_Company_Cap_Category', selected_cap_categories)
+filtered_count = int(investor_mask.sum())
 
 # Display results without the index
-st.subheader(f"All Investors Overview ({len(filtered_investors)} investors)")
+st.subheader(f"All Investors Overview ({filtered_count} investors)")
+horizon_investor_cols = [
+    f'{prefix}_{label}'
+    for label in horizon_labels_shown
+    for prefix in ['Weighted_Return', 'Return_vs_SP500', 'Return_vs_Sector']
+]
+# Older metric files only have some of the win rates
+win_rate_cols = [f'Pct_Positive_vs_SP500_{label}' for label in horizon_labels_shown]
+win_rate_cols = [col for col in win_rate_cols if col in investor_analysis_df.columns]
+p_value_cols = [f'P_Value_vs_SP500_{label}' for label in horizon_labels_shown]
+p_value_cols = [col for col in p_value_cols if col in investor_analysis_df.columns]
 cols_to_show = [
     'OWNER_NAME', 'Transaction_Count', 'Earliest_Transaction_Year', 'Most_Recent_Transaction_Year',
-    'Weighted_Return_6M', 'Return_vs_SP500_6M', 'Return_vs_Sector_6M',
-    'Weighted_Return_1Y', 'Return_vs_SP500_1Y', 'Return_vs_Sector_1Y',
-    'Weighted_Return_18M', 'Return_vs_SP500_18M', 'Return_vs_Sector_18M',
-    'Pct_Positive_vs_SP500_6M', 'Pct_Positive_vs_SP500_1Y',
+] + horizon_investor_cols + win_rate_cols + p_value_cols + [
     'Avg_Transaction_Value', 'Total_Transaction_Value',
     'Number_of_Companies', 'Most_Common_Company', 'Most_Active_Sector',
     'Most_Common_Company_Cap_Category'
 ]
 
-filtered_display = filtered_investors[cols_to_show].copy()
+# Only the visible page is sorted out of the filtered rows and formatted
+sort_column = st.selectbox("Sort by", horizon_investor_cols + win_rate_cols + p_value_cols + [
+    'Transaction_Count', 'Avg_Transaction_Value', 'Total_Transaction_Value', 'Number_of_Companies'
+], index=horizon_investor_cols.index('Return_vs_SP500_6M'))
+offset, page_size = page_controls('investors', filtered_count)
+# Lowest p-values first, highest everything else
+page_rows = page_positions(investor_analysis_df[sort_column].to_numpy(dtype=float), investor_mask, offset, page_size,
+                           ascending=sort_column.startswith('P_Value_'))
+page_investors = investor_analysis_df.iloc[page_rows]
+
+investor_formats = {
+    'Transaction_Count': '{:.0f}',  # Whole number, no decimals
+    'Number_of_Companies': '{:.0f}',  # Whole number, no decimals
+    'Earliest_Transaction_Year': '{:.0f}',  # Just year, no commas
+    'Most_Recent_Transaction_Year': '{:.0f}',  # Just year, no commas
+    'Avg_Transaction_Value': '${:,.0f}',
+    'Total_Transaction_Value': '${:,.0f}'
+}
+investor_formats.update({col: '{:.1%}' for col in horizon_investor_cols + win_rate_cols})
+investor_formats.update({col: '{:.3f}' for col in p_value_cols})
 
 st.dataframe(
-    filtered_display
-    .sort_values('Return_vs_SP500_6M', ascending=False)
-    .style.format({
-        'Transaction_Count': '{:.0f}',  # Whole number, no decimals
-        'Number_of_Companies': '{:.0f}',  # Whole number, no decimals
-        'Earliest_Transaction_Year': '{:.0f}',  # Just year, no commas
-        'Most_Recent_Transaction_Year': '{:.0f}',  # Just year, no commas
-        'Weighted_Return_6M': '{:.1%}',
-        'Return_vs_SP500_6M': '{:.1%}',
-        'Return_vs_Sector_6M': '{:.1%}',
-        'Weighted_Return_1Y': '{:.1%}',
-        'Return_vs_SP500_1Y': '{:.1%}',
-        'Return_vs_Sector_1Y': '{:.1%}',
-        'Weighted_Return_18M': '{:.1%}',
-        'Return_vs_SP500_18M': '{:.1%}',
-        'Return_vs_Sector_18M': '{:.1%}',
-        'Pct_Positive_vs_SP500_6M': '{:.1%}',
-        'Pct_Positive_vs_SP500_1Y': '{:.1%}',
-        'Avg_Transaction_Value': '${:,.0f}',
-        'Total_Transaction_Value': '${:,.0f}'
-    }),
+    page_investors[cols_to_show]
+    .style.format(investor_formats),
     hide_index=True
 )
 
 # Individual investor details section
 st.subheader("Individual Investor Details")
 selected_investor = st.selectbox(
-    "Select an investor to see their transactions",
-    options=filtered_investors['OWNER_NAME'].tolist()
+    "Select an investor on this page to see their transactions",
+    options=page_investors['OWNER_NAME'].tolist()
 )
 
 if selected_investor:
-    investor_cik = investor_analysis_df[investor_analysis_df['OWNER_NAME'] == selected_investor]['OWNER_CIK'].iloc[0]
-    investor_transactions = transactions_df[transactions_df['OWNER_CIK'] == investor_cik].copy()
-    
-    # Restore original toggle text
+    investor_cik = investor_index['name_to_cik'][selected_investor]
+    # Clusters break after a 30-day gap between an investor's trades in a symbol and
+    # are precomputed in the snapshot, so the toggle only switches which index is read
     aggregate_transactions = st.toggle("Combine transactions within 30 days", value=False)
-    
-    if aggregate_transactions:
-        # Sort by date first
-        investor_transactions['TRANS_DATE'] = pd.to_datetime(investor_transactions['TRANS_DATE'])
-        investor_transactions = investor_transactions.sort_values('TRANS_DATE')
-        
-        # Create monthly groups (restored from 6M)
-        investor_transactions['GROUP_DATE'] = investor_transactions['TRANS_DATE'].dt.to_period('M')
-        
-        # Aggregate the transactions
-        aggregated_transactions = investor_transactions.groupby(['GROUP_DATE', 'ISSUERNAME', 'ISSUERTRADINGSYMBOL', 'GICS_SECTOR', 'GICS_SUB_INDUSTRY']).agg({
-            'TRANS_DATE': 'first',  # Keep the first date in the group
-            'ADJUSTED_TRANS_SHARES': 'sum',
-            'ADJUSTED_TOTAL_TRANS_VALUE': 'sum',
-            'RETURN_6M': lambda x: pd.to_numeric(x, errors='coerce').mean(),
-            'RETURN_1Y': lambda x: pd.to_numeric(x, errors='coerce').mean(),
-            'RETURN_18M': lambda x: pd.to_numeric(x, errors='coerce').mean(),
-            'Vs_SP500_6M': lambda x: pd.to_numeric(x, errors='coerce').mean(),
-            'Vs_SP500_1Y': lambda x: pd.to_numeric(x, errors='coerce').mean(),
-            'Vs_SP500_18M': lambda x: pd.to_numeric(x, errors='coerce').mean(),
-            'Vs_Sector_6M': lambda x: pd.to_numeric(x, errors='coerce').mean(),
-            'Vs_Sector_1Y': lambda x: pd.to_numeric(x, errors='coerce').mean(),
-            'Vs_Sector_18M': lambda x: pd.to_numeric(x, errors='coerce').mean(),
-            '6 Month Price': 'last',
-            '1 Year Price': 'last',
-            '18 Month Price': 'last'
-        }).reset_index()
-        
-        # Calculate new price per share
-        aggregated_transactions['ADJUSTED_TRANS_PRICEPERSHARE'] = (
-            aggregated_transactions['ADJUSTED_TOTAL_TRANS_VALUE'] / 
-            aggregated_transactions['ADJUSTED_TRANS_SHARES']
-        )
-        
-        display_transactions = aggregated_transactions
-    else:
-        display_transactions = investor_transactions.copy()
-        # Convert percentage columns to numeric for non-aggregated view
-        percentage_cols = [
-            'RETURN_6M', 'RETURN_1Y', 'RETURN_18M',
-            'Vs_SP500_6M', 'Vs_SP500_1Y', 'Vs_SP500_18M',
-            'Vs_Sector_6M', 'Vs_Sector_1Y', 'Vs_Sector_18M'
-        ]
-        for col in percentage_cols:
-            display_transactions[col] = pd.to_numeric(display_transactions[col], errors='coerce')
+    display_index = cluster_index if aggregate_transactions else transaction_index
+    transaction_rows = owner_rows(display_index, investor_cik)
+    source_columns = transaction_source(display_index).dtypes
 
     # Modify the columns shown based on aggregation
     display_cols = [
         'ISSUERNAME', 'ISSUERTRADINGSYMBOL', 'GICS_SECTOR', 'GICS_SUB_INDUSTRY',
-        'TRANS_DATE', 'ADJUSTED_TRANS_SHARES', 'ADJUSTED_TRANS_PRICEPERSHARE', 
-        'ADJUSTED_TOTAL_TRANS_VALUE', '6 Month Price', '1 Year Price', '18 Month Price',
-        'RETURN_6M', 'Vs_SP500_6M', 'Vs_Sector_6M',
-        'RETURN_1Y', 'Vs_SP500_1Y', 'Vs_Sector_1Y',
-        'RETURN_18M', 'Vs_SP500_18M', 'Vs_Sector_18M'
+        'TRANS_DATE', 'ADJUSTED_TRANS_SHARES', 'ADJUSTED_TRANS_PRICEPERSHARE',
+        'ADJUSTED_TOTAL_TRANS_VALUE'
+    ] + [price_column(label) for label in horizon_labels_shown] + [
+        f'{prefix}_{label}' for label in horizon_labels_shown for prefix in ['RETURN', 'Vs_SP500', 'Vs_Sector']
     ]
-    
+    if aggregate_transactions:
+        display_cols[5:5] = ['LAST_TRANS_DATE', 'TRANSACTION_COUNT']
+
     # Create a formatter dictionary that checks for numeric columns
     format_dict = {
         'ADJUSTED_TRANS_SHARES': '{:.2f}',
         'ADJUSTED_TRANS_PRICEPERSHARE': '${:.2f}',
         'ADJUSTED_TOTAL_TRANS_VALUE': '${:,.0f}',
-        '6 Month Price': '${:.2f}',
-        '1 Year Price': '${:.2f}',
-        '18 Month Price': '${:.2f}'
     }
-    
+    format_dict.update({price_column(label): '${:.2f}' for label in horizon_labels_shown})
+
     # Only add percentage formatting for columns that exist and are numeric
-    percentage_cols = [
-        'RETURN_6M', 'RETURN_1Y', 'RETURN_18M',
-        'Vs_SP500_6M', 'Vs_SP500_1Y', 'Vs_SP500_18M',
-        'Vs_Sector_6M', 'Vs_Sector_1Y', 'Vs_Sector_18M'
-    ]
-    
+    percentage_cols = return_columns(horizon_labels_shown)
+
     for col in percentage_cols:
-        if col in display_transactions.columns:
-            if pd.api.types.is_numeric_dtype(display_transactions[col]):
+        if col in source_columns.index:
+            if pd.api.types.is_numeric_dtype(source_columns[col]):
                 format_dict[col] = '{:.1%}'
-    
+
+    # Newest first; only TRANS_DATE is gathered for all of the investor's rows, and the
+    # detail columns are pulled from the mapped snapshot for the visible page alone
+    st.caption(f"{len(transaction_rows)} {'clusters' if aggregate_transactions else 'transactions'}")
+    offset, page_size = page_controls('transactions', len(transaction_rows))
+    trans_dates = gather_column(display_index, transaction_rows, 'TRANS_DATE').astype('datetime64[ns]')
+    dates_ns = np.where(np.isnat(trans_dates), np.nan, trans_dates.astype(np.int64).astype(float))
+    page_rows = page_positions(dates_ns, np.ones(len(transaction_rows), dtype=bool), offset, page_size)
+
     st.dataframe(
-        display_transactions[display_cols]
-        .sort_values('TRANS_DATE', ascending=False)
+        gather_transactions(display_index, transaction_rows[page_rows], display_cols)
         .style.format(format_dict),
         hide_index=True
     )
@@ -0,0 +1,131 @@
+import argparse
+import numpy as np
+import pandas as pd
+
+from horizons import DEFAULT_HORIZONS, horizon_labels, parse_horizons
+from stage_store import DEFAULT_STORE_DIR, read_stage, write_stage
+from transactions_with_weighted_returns import (
+    CAP_CATEGORIES, INVESTOR_KEYS, MARKET_CONDITIONS, VALUE_COLUMN,
+    horizon_metric_columns, investor_aggregation_columns, most_common, prepare_transactions
+)
+
+# Every breakdown is split by market regime and market cap bucket; --by adds further keys
+BREAKDOWN_KEYS = ['Market_Condition', 'Market_Cap_Category']
+
+def breakdown_sums(df, keys=BREAKDOWN_KEYS, horizons=DEFAULT_HORIZONS):
+    """Additive sums per (investor x breakdown keys) cell over positive-value transactions
+
+    One groupby produces every cell; coarser breakdowns (per regime, per cap
+    bucket, per investor) are sums of these cells, so extra keys only add a
+    group key rather than another pass over the transactions.
+    """
+    valid = df[df[VALUE_COLUMN] > 0]
+    value = valid[VALUE_COLUMN].to_numpy(dtype=float)
+    weighted_columns, _, win_columns = horizon_metric_columns(horizons)
+    return_cols = list(weighted_columns.values())
+    stock_cols = [return_col for return_col, _ in win_columns.values()]
+    benchmark_cols = [benchmark_col for _, benchmark_col in win_columns.values()]
+    wins = (valid[stock_cols].to_numpy(dtype=float) - valid[benchmark_cols].to_numpy(dtype=float)) > 0
+    market_caps = valid['Market Cap'].to_numpy(dtype=float)
+
+    sums = pd.concat([
+        valid[INVESTOR_KEYS + keys],
+        pd.DataFrame({
+            'Count': 1,
+            'Value_Sum': value,
+            'Market_Cap_Sum': np.nan_to_num(market_caps),
+            'Market_Cap_Count': (~np.isnan(market_caps)).astype(int),
+        }, index=valid.index),
+        pd.DataFrame(value[:, None] * valid[return_cols].to_numpy(dtype=float), index=valid.index,
+                     columns=[f'Value_x_{col}' for col in return_cols]),
+        pd.DataFrame(wins.astype(int), index=valid.index, columns=[f'Wins_{metric}' for metric in win_columns]),
+    ], axis=1)
+    # Missing returns contribute zero, like the investor metrics
+    return sums.groupby(INVESTOR_KEYS + keys, dropna=False, sort=True).sum().reset_index()
+
+def sum_columns(sums):
+    """The additive columns of a breakdown_sums table (everything but the keys)"""
+    totals = ['Count', 'Value_Sum', 'Market_Cap_Sum', 'Market_Cap_Count']
+    return [col for col in sums.columns if col in totals or col.startswith(('Value_x_', 'Wins_'))]
+
+def ratio_metrics(sums, horizons=DEFAULT_HORIZONS):
+    """Weighted returns, relative returns and win rates from summed cells"""
+    weighted_columns, relative_columns, win_columns = horizon_metric_columns(horizons)
+    metrics = pd.DataFrame(index=sums.index)
+    metrics['Transactions'] = sums['Count']
+    metrics['Total_Transaction_Value'] = sums['Value_Sum']
+    for metric, return_col in weighted_columns.items():
+        metrics[metric] = sums[f'Value_x_{return_col}'] / sums['Value_Sum']
+    for metric, (stock_metric, benchmark_metric) in relative_columns.items():
+        metrics[metric] = metrics[stock_metric] - metrics[benchmark_metric]
+    for metric in win_columns:
+        metrics[metric] = sums[f'Wins_{metric}'] / sums['Count']
+    return metrics
+
+def cell_metrics(sums, keys=BREAKDOWN_KEYS, horizons=DEFAULT_HORIZONS):
+    """Long table of metrics for every (investor x breakdown keys) cell"""
+    return pd.concat([sums[INVESTOR_KEYS + keys], ratio_metrics(sums, horizons)], axis=1)
+
+def regime_summary(sums, horizons=DEFAULT_HORIZONS):
+    """Per-investor Bull/Bear market metrics, market timing and market cap mix
+
+    Restores the columns of investor_weighted_returns_backup.csv. Market_Timing_Score
+    is the 6M excess return vs the S&P 500 on Bear market trades minus that on
+    Bull market trades; percentages of trades per cap bucket are 0-100.
+    """
+    labels = horizon_labels(horizons)
+    by_regime = sums.groupby(INVESTOR_KEYS + ['Market_Condition'])[sum_columns(sums)].sum()
+    regime_metrics = ratio_metrics(by_regime, horizons).unstack('Market_Condition')
+    # Regimes an investor never traded in are missing rather than zero
+    regime_metrics = regime_metrics.reindex(
+        columns=pd.MultiIndex.from_product([regime_metrics.columns.levels[0], MARKET_CONDITIONS]))
+
+    summary = pd.DataFrame(index=regime_metrics.index)
+    for condition in MARKET_CONDITIONS:
+        prefix = f'{condition}_Market'
+        summary[f'{prefix}_Transactions'] = regime_metrics[('Transactions', condition)].fillna(0).astype(int)
+        for label in labels:
+            summary[f'{prefix}_Avg_Return_{label}'] = regime_metrics[(f'Weighted_Return_{label}', condition)]
+            summary[f'{prefix}_vs_SP500_{label}'] = regime_metrics[(f'Return_vs_SP500_{label}', condition)]
+            summary[f'{prefix}_vs_Sector_{label}'] = regime_metrics[(f'Return_vs_Sector_{label}', condition)]
+        summary[f'{prefix}_Win_Rate'] = regime_metrics[('Pct_Positive_vs_SP500_6M', condition)]
+    summary['Market_Timing_Score'] = summary['Bear_Market_vs_SP500_6M'] - summary['Bull_Market_vs_SP500_6M']
+
+    cap_counts = sums.groupby(INVESTOR_KEYS + ['Market_Cap_Category'])['Count'].sum()
+    cap_mix = cap_counts.unstack('Market_Cap_Category').reindex(columns=CAP_CATEGORIES).fillna(0)
+    cap_mix = 100 * cap_mix.div(cap_mix.sum(axis=1), axis=0)
+    for category in CAP_CATEGORIES:
+        summary[f"Pct_{category.replace(' ', '_')}_Trades"] = cap_mix[category]
+    preferred = most_common(cap_counts.rename('Count').reset_index(), 'Market_Cap_Category')
+    summary['Preferred_Cap_Category'] = preferred['Market_Cap_Category']
+
+    totals = sums.groupby(INVESTOR_KEYS)[['Market_Cap_Sum', 'Market_Cap_Count']].sum()
+    summary['Avg_Market_Cap'] = totals['Market_Cap_Sum'] / totals['Market_Cap_Count'].where(totals['Market_Cap_Count'] > 0)
+    return summary.reset_index()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Break investor performance down by market regime and market cap")
+    parser.add_argument('--store-dir', default=DEFAULT_STORE_DIR)
+    parser.add_argument('--csv', action='store_true', help="Also export the results as CSV")
+    parser.add_argument('--horizons', default='6M,1Y,18M',
+                        help="Comma-separated return horizons, e.g. 1M,3M,6M,1Y,18M,2Y,3Y")
+    parser.add_argument('--by', default='',
+                        help="Extra comma-separated breakdown columns, e.g. GICS_SECTOR,OWNER_RELATIONSHIP")
+    args = parser.parse_args()
+    horizons = parse_horizons(args.horizons)
+    extra_keys = [key.strip() for key in args.by.split(',') if key.strip()]
+    keys = BREAKDOWN_KEYS + [key for key in extra_keys if key not in BREAKDOWN_KEYS]
+
+    columns = investor_aggregation_columns(horizons)
+    df = read_stage('transactions_with_returns_and_relatives', args.store_dir,
+                    columns=columns + [key for key in extra_keys if key not in columns])
+    df = prepare_transactions(df)
+    print(f"Loaded {len(df)} transactions")
+
+    sums = breakdown_sums(df, keys, horizons)
+    print(f"Summed {len(sums)} cells over {', '.join(keys)}")
+
+    output_path = write_stage(cell_metrics(sums, keys, horizons), 'investor_breakdowns', args.store_dir, export_csv=args.csv)
+    print(f"Breakdown saved to {output_path}")
+    output_path = write_stage(regime_summary(sums, horizons), 'investor_regime_summary', args.store_dir, export_csv=args.csv)
+    print(f"Regime and market cap summary saved to {output_path}")
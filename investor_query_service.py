@@ -0,0 +1,321 @@
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import numpy as np
+import pandas as pd
+
+from dashboard_index import build_investor_index, category_mask, filter_fills
+from dashboard_snapshot import default_snapshot_dir, load_snapshot_investors, read_manifest
+
+# The snapshot manifest is checked for a new build at most this often
+RELOAD_CHECK_SECONDS = 1.0
+DEFAULT_LIMIT = 50
+# Top-N walks the sorted order in blocks of this many rows until enough pass the filters
+TOP_BLOCK_ROWS = 4096
+
+def build_query_index(investors_df):
+    """Per-metric sorted orders over the investor table, plus the dashboard's category codes
+
+    Every numeric column gets its non-missing rows in ascending order (with the
+    sorted values, for binary search) and in descending order, ties in row
+    order like the dashboard's page sort. Missing values are matched through
+    the same fills as the dashboard filters.
+    """
+    metrics = {}
+    positions = np.arange(len(investors_df))
+    fills = filter_fills(investors_df.columns)
+    for col in investors_df.columns:
+        if not pd.api.types.is_numeric_dtype(investors_df[col]):
+            continue
+        values = investors_df[col].to_numpy(dtype=float)
+        present = ~np.isnan(values)
+        ascending = np.lexsort((positions[present], values[present]))
+        descending = np.lexsort((positions[present], -values[present]))
+        metrics[col] = {
+            'values': values,
+            'ascending': positions[present][ascending],
+            'sorted': values[present][ascending],
+            'descending': positions[present][descending],
+            'missing': np.flatnonzero(~present),
+            'fills': fills.get(col, (None, None)),
+        }
+    return {
+        'investors': investors_df,
+        # Pages are gathered from plain numpy columns, several times faster than iloc on a wide frame
+        'arrays': {col: investors_df[col].to_numpy() for col in investors_df.columns},
+        'dtypes': investors_df.dtypes.to_dict(),
+        'row_count': len(investors_df),
+        'metrics': metrics,
+        # Category codes are shared with the dashboard so category_mask works on this index too
+        'categories': build_investor_index(investors_df)['categories'],
+    }
+
+def missing_passes(metric, low=None, high=None):
+    """Whether missing values pass the bounds: like the dashboard, they count as min_fill
+    against a minimum and max_fill against a maximum, and fail a side without a fill"""
+    min_fill, max_fill = metric['fills']
+    return (low is None or (min_fill is not None and min_fill >= low)) and \
+        (high is None or (max_fill is not None and max_fill <= high))
+
+def range_slice(metric, low=None, high=None):
+    """Start and end in the ascending order of the non-missing values within low..high, by binary search"""
+    sorted_values = metric['sorted']
+    start = 0 if low is None else np.searchsorted(sorted_values, low, side='left')
+    end = len(sorted_values) if high is None else np.searchsorted(sorted_values, high, side='right')
+    return start, max(start, end)
+
+def range_positions(metric, low=None, high=None):
+    """Rows with low <= value <= high, including missing rows when their fills pass"""
+    start, end = range_slice(metric, low, high)
+    positions = metric['ascending'][start:end]
+    if missing_passes(metric, low, high) and len(metric['missing']):
+        positions = np.concatenate([positions, metric['missing']])
+    return positions
+
+def in_range(metric, positions, low=None, high=None):
+    """Boolean mask of the given rows passing one range filter"""
+    values = metric['values'][positions]
+    missing = np.isnan(values)
+    passed = ~missing
+    if low is not None:
+        passed &= values >= low
+    if high is not None:
+        passed &= values <= high
+    if missing_passes(metric, low, high):
+        passed |= missing
+    return passed
+
+def filter_positions(index, filters=None, categories=None):
+    """Sorted row positions passing every (low, high) range filter and category filter
+
+    The range with the fewest rows (sized by binary search alone) supplies the
+    candidates and the other filters are checked only on those, so the cost
+    follows the most selective filter rather than the table size.
+    """
+    filters = [(index['metrics'][col], low, high) for col, (low, high) in (filters or {}).items()]
+    if filters:
+        def range_size(metric, low, high):
+            start, end = range_slice(metric, low, high)
+            return end - start + (len(metric['missing']) if missing_passes(metric, low, high) else 0)
+        sizes = [range_size(*bounds) for bounds in filters]
+        # Ranges every row passes (like the dashboard's default bounds) need no check
+        filters = [bounds for size, bounds in sorted(zip(sizes, filters), key=lambda pair: pair[0])
+                   if size < index['row_count']]
+    if filters:
+        candidates = np.sort(range_positions(*filters[0]))
+        for metric, low, high in filters[1:]:
+            candidates = candidates[in_range(metric, candidates, low, high)]
+    else:
+        candidates = np.arange(index['row_count'])
+    for col, selected in (categories or {}).items():
+        candidates = candidates[category_mask(index, col, selected)[candidates]]
+    return candidates
+
+def top_positions(index, sort_by, candidates=None, limit=DEFAULT_LIMIT, offset=0, ascending=False):
+    """Rows offset..offset+limit of the candidates ordered by one metric, walking the presorted order
+
+    Without filters this is a slice; with filters the presorted order is
+    scanned in blocks until enough candidates are found. Missing values come last.
+    """
+    metric = index['metrics'][sort_by]
+    order = metric['ascending'] if ascending else metric['descending']
+    wanted = offset + limit
+    if candidates is None:
+        ranked = np.concatenate([order[:wanted], metric['missing'][:max(0, wanted - len(order))]])
+        return ranked[offset:wanted]
+
+    member = np.zeros(index['row_count'], dtype=bool)
+    member[candidates] = True
+    found = []
+    found_count = 0
+    for block_start in range(0, len(order), TOP_BLOCK_ROWS):
+        block = order[block_start:block_start + TOP_BLOCK_ROWS]
+        block = block[member[block]]
+        found.append(block)
+        found_count += len(block)
+        if found_count >= wanted:
+            break
+    if found_count < wanted:
+        missing = metric['missing']
+        found.append(missing[member[missing]])
+    ranked = np.concatenate(found) if found else candidates[:0]
+    return ranked[offset:wanted]
+
+class InvestorQueryService:
+    """Range filters and top-N queries over the investor snapshot, reloaded when a new snapshot lands
+
+    Queries read one index reference, and a reload builds a new index before
+    swapping it in, so concurrent queries (e.g. from the HTTP server's threads)
+    never see a half-built index.
+    """
+
+    def __init__(self, store_dir='.', snapshot_dir=None):
+        self.store_dir = store_dir
+        self.snapshot_dir = snapshot_dir or default_snapshot_dir(store_dir)
+        self.reload_lock = threading.Lock()
+        self.next_check = 0.0
+        self.load()
+
+    def load(self):
+        investors, manifest = load_snapshot_investors(self.store_dir, self.snapshot_dir)
+        start = time.perf_counter()
+        index = build_query_index(investors)
+        self.state = (index, manifest['fingerprint'])
+        print(f"Indexed {len(investors)} investors x {len(index['metrics'])} metrics in {time.perf_counter() - start:.2f}s")
+
+    def maybe_reload(self):
+        """Reload if the snapshot manifest changed since the last check"""
+        now = time.monotonic()
+        if now < self.next_check:
+            return
+        with self.reload_lock:
+            if now < self.next_check:
+                return
+            self.next_check = now + RELOAD_CHECK_SECONDS
+            manifest = read_manifest(self.snapshot_dir)
+            if manifest is not None and manifest['fingerprint'] != self.state[1]:
+                self.load()
+
+    @property
+    def index(self):
+        return self.state[0]
+
+    def query(self, filters=None, categories=None, sort_by='Return_vs_SP500_6M', ascending=False,
+              limit=DEFAULT_LIMIT, offset=0, columns=None):
+        """One page of investors passing the filters, ordered by sort_by; returns (total matches, page DataFrame)
+
+        filters maps a column to (low, high) with None for an open side; categories
+        maps Most_Active_Sector / Most_Common_Company_Cap_Category to allowed values.
+        """
+        self.maybe_reload()
+        index = self.index
+        if filters or categories:
+            candidates = filter_positions(index, filters, categories)
+            total = len(candidates)
+        else:
+            candidates, total = None, index['row_count']
+        page = top_positions(index, sort_by, candidates, limit, offset, ascending)
+        arrays, dtypes = index['arrays'], index['dtypes']
+        return total, pd.DataFrame({col: pd.array(arrays[col][page], dtype=dtypes[col]) for col in columns or arrays},
+                                   index=index['investors'].index[page])
+
+    def count(self, filters=None, categories=None):
+        self.maybe_reload()
+        return len(filter_positions(self.index, filters, categories))
+
+def parse_query_string(query_string):
+    """query() keyword arguments from ?min.<col>=x&max.<col>=y&category.<col>=a,b&sort=..&limit=..&offset=..&ascending=1"""
+    params = parse_qs(query_string)
+    filters, categories, kwargs = {}, {}, {}
+    for key, values in params.items():
+        value = values[-1]
+        if key.startswith(('min.', 'max.')):
+            side, col = key.split('.', 1)
+            low, high = filters.get(col, (None, None))
+            filters[col] = (float(value), high) if side == 'min' else (low, float(value))
+        elif key.startswith('category.'):
+            categories[key.split('.', 1)[1]] = value.split(',')
+        elif key == 'sort':
+            kwargs['sort_by'] = value
+        elif key in ('limit', 'offset'):
+            kwargs[key] = int(value)
+        elif key == 'ascending':
+            kwargs['ascending'] = value not in ('0', 'false')
+        elif key == 'columns':
+            kwargs['columns'] = value.split(',')
+    return {'filters': filters, 'categories': categories, **kwargs}
+
+def make_handler(service):
+    class QueryHandler(BaseHTTPRequestHandler):
+        def send_json(self, status, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == '/health':
+                self.send_json(200, {'investors': service.index['row_count'], 'fingerprint': service.state[1]})
+                return
+            if url.path != '/query':
+                self.send_json(404, {'error': f"unknown path {url.path}"})
+                return
+            try:
+                total, page = service.query(**parse_query_string(url.query))
+            except KeyError as error:
+                self.send_json(400, {'error': f"unknown column {error}"})
+                return
+            except ValueError as error:
+                self.send_json(400, {'error': str(error)})
+                return
+            self.send_json(200, {'total': total, 'rows': json.loads(page.to_json(orient='records', date_format='iso'))})
+
+        def log_message(self, format, *args):
+            pass
+    return QueryHandler
+
+def random_queries(index, count, seed=0):
+    """Dashboard-like queries: a few excess-return ranges, sometimes a sector, sorted by a random metric"""
+    rng = np.random.default_rng(seed)
+    return_cols = [col for col in index['metrics'] if col.startswith('Return_vs_')]
+    sectors = list(index['categories']['Most_Active_Sector']['values'])
+    queries = []
+    for _ in range(count):
+        filters = {col: (float(rng.choice([-0.5, 0.0, 0.05, 0.2])), 5.0)
+                   for col in rng.choice(return_cols, size=rng.integers(1, 4), replace=False)}
+        filters['Transaction_Count'] = (float(rng.choice([0, 3, 10])), None)
+        categories = {'Most_Active_Sector': list(rng.choice(sectors, size=2))} if rng.random() < 0.3 else {}
+        queries.append({'filters': filters, 'categories': categories, 'sort_by': str(rng.choice(return_cols))})
+    return queries
+
+def measure_qps(service, queries):
+    """Queries per second through the service, and for the same queries as plain pandas filtering"""
+    start = time.perf_counter()
+    for query in queries:
+        service.query(**query)
+    service_qps = len(queries) / (time.perf_counter() - start)
+
+    investors = service.index['investors']
+    start = time.perf_counter()
+    for query in queries:
+        mask = pd.Series(True, index=investors.index)
+        for col, (low, high) in query['filters'].items():
+            min_fill, max_fill = filter_fills([col]).get(col, (None, None))
+            if low is not None:
+                mask &= investors[col].fillna(min_fill if min_fill is not None else np.nan) >= low
+            if high is not None:
+                mask &= investors[col].fillna(max_fill if max_fill is not None else np.nan) <= high
+        for col, selected in query['categories'].items():
+            mask &= investors[col].isin(selected)
+        investors[mask].sort_values(query['sort_by'], ascending=False, kind='mergesort').head(DEFAULT_LIMIT)
+    pandas_qps = len(queries) / (time.perf_counter() - start)
+    return service_qps, pandas_qps
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query investor metrics by range filters and top-N, in process or over HTTP")
+    parser.add_argument('--store-dir', default='.')
+    parser.add_argument('--snapshot-dir', help="Default: <store-dir>/dashboard_snapshot")
+    subparsers = parser.add_subparsers(dest='action', required=True)
+    serve_parser = subparsers.add_parser('serve', help="Serve GET /query and /health")
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8765)
+    bench_parser = subparsers.add_parser('bench', help="Measure queries per second against plain pandas filtering")
+    bench_parser.add_argument('--queries', type=int, default=2000)
+    bench_parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    service = InvestorQueryService(args.store_dir, args.snapshot_dir)
+    if args.action == 'serve':
+        server = ThreadingHTTPServer((args.host, args.port), make_handler(service))
+        print(f"Serving {service.index['row_count']} investors on http://{args.host}:{args.port}/query")
+        server.serve_forever()
+    else:
+        service_qps, pandas_qps = measure_qps(service, random_queries(service.index, args.queries, args.seed))
+        print(f"{args.queries} queries: {service_qps:,.0f} queries/s indexed, {pandas_qps:,.0f} queries/s with pandas "
+              f"({service_qps / pandas_qps:.1f}x)")
@@ -0,0 +1,142 @@
+import argparse
+import time
+import numpy as np
+import pandas as pd
+
+from horizons import DEFAULT_HORIZONS, parse_horizons
+from stage_store import DEFAULT_STORE_DIR, read_stage, write_stage
+from transactions_with_weighted_returns import (
+    INVESTOR_KEYS, VALUE_COLUMN, horizon_metric_columns, investor_aggregation_columns
+)
+
+DEFAULT_RESAMPLES = 2000
+DEFAULT_CONFIDENCE = 0.95
+# Resample draws held in memory at once (resamples x transactions in a block of investors)
+BLOCK_CELLS = 8_000_000
+
+def significance_columns(metric):
+    """Output columns for one Return_vs_* metric, e.g. Return_vs_SP500_6M -> CI_Low_vs_SP500_6M"""
+    suffix = metric[len('Return_vs_'):]
+    return f'CI_Low_vs_{suffix}', f'CI_High_vs_{suffix}', f'P_Value_vs_{suffix}'
+
+def excess_value_returns(df, horizons=DEFAULT_HORIZONS):
+    """Positive-value transactions grouped by investor, with value x excess return per Return_vs_* metric
+
+    Returns (investors, starts, values, excess): investors is the key frame,
+    starts the first row of each investor, and excess maps each metric to
+    value x (stock - benchmark return) with missing returns contributing zero,
+    so sum(excess) / sum(value) reproduces the investor's Return_vs_* metric.
+    """
+    valid = df[df[VALUE_COLUMN] > 0]
+    codes, _ = pd.factorize(pd.MultiIndex.from_frame(valid[INVESTOR_KEYS]))
+    order = np.argsort(codes, kind='stable')
+    valid = valid.iloc[order]
+    starts = np.flatnonzero(np.r_[True, codes[order][1:] != codes[order][:-1]]) if len(valid) else order[:0]
+
+    values = valid[VALUE_COLUMN].to_numpy(dtype=float)
+    weighted_columns, relative_columns, _ = horizon_metric_columns(horizons)
+    excess = {}
+    for metric, (stock_metric, benchmark_metric) in relative_columns.items():
+        stock = np.nan_to_num(values * valid[weighted_columns[stock_metric]].to_numpy(dtype=float))
+        benchmark = np.nan_to_num(values * valid[weighted_columns[benchmark_metric]].to_numpy(dtype=float))
+        excess[metric] = stock - benchmark
+    investors = valid[INVESTOR_KEYS].iloc[starts].reset_index(drop=True)
+    return investors, starts, values, excess
+
+def investor_blocks(starts, total_rows, resamples):
+    """Split investors into consecutive blocks whose resample matrices stay within BLOCK_CELLS
+
+    Yields (first, last, chunk): the block's investor positions and how many
+    resamples to draw at once. An investor with more rows than fit gets a block
+    to itself and is resampled in chunks of fewer resamples.
+    """
+    ends = np.r_[starts[1:], total_rows]
+    max_rows = max(1, BLOCK_CELLS // resamples)
+    first = 0
+    while first < len(starts):
+        last = max(first + 1, np.searchsorted(ends, starts[first] + max_rows, side='right'))
+        rows = ends[last - 1] - starts[first]
+        yield first, last, min(resamples, max(1, BLOCK_CELLS // rows))
+        first = last
+
+def investor_significance(df, horizons=DEFAULT_HORIZONS, resamples=DEFAULT_RESAMPLES,
+                          confidence=DEFAULT_CONFIDENCE, seed=0):
+    """Bootstrap confidence intervals and permutation p-values for every Return_vs_* metric
+
+    The bootstrap resamples each investor's own transactions with replacement
+    and takes percentile bounds of the weighted excess return. The p-value is
+    a one-sided sign-flip test of "excess return <= 0": each transaction's
+    excess is flipped at random, which keeps the investor's value weights but
+    makes a lucky couple of trades as likely to look bad as good.
+    Every investor in a block is resampled at once as (resamples x transactions)
+    index matrices reduced with segment sums; an investor too large for one
+    block is resampled a chunk of resamples at a time.
+    """
+    investors, starts, values, excess = excess_value_returns(df, horizons)
+    rng = np.random.default_rng(seed)
+    tail = (1 - confidence) / 2
+    results = {col: np.full(len(investors), np.nan) for metric in excess for col in significance_columns(metric)}
+
+    for first, last, chunk in investor_blocks(starts, len(values), resamples):
+        row_start = starts[first]
+        row_end = starts[last] if last < len(starts) else len(values)
+        local_starts = starts[first:last] - row_start
+        counts = np.diff(np.r_[local_starts, row_end - row_start])
+        row_offsets = np.repeat(local_starts, counts)
+        row_counts = np.repeat(counts, counts)
+        block_values = values[row_start:row_end]
+        block_excess = {metric: metric_excess[row_start:row_end] for metric, metric_excess in excess.items()}
+        observed = {metric: np.add.reduceat(block_excess[metric], local_starts) for metric in excess}
+        boot = {metric: [] for metric in excess}
+        exceed = {metric: 0 for metric in excess}
+
+        for done in range(0, resamples, chunk):
+            size = min(chunk, resamples - done)
+            # Draw a position within the row's own investor for every (resample, row) cell
+            draws = (rng.random((size, len(row_offsets)), dtype=np.float32) * row_counts).astype(np.int64)
+            draws = row_offsets + np.minimum(draws, row_counts - 1)
+            flips = rng.random((size, len(row_offsets)), dtype=np.float32) < 0.5
+
+            boot_value_sums = np.add.reduceat(block_values[draws], local_starts, axis=1)
+            for metric, metric_excess in block_excess.items():
+                boot[metric].append(np.add.reduceat(metric_excess[draws], local_starts, axis=1) / boot_value_sums)
+                # Value sums are unchanged by sign flips, so the test compares excess sums directly
+                flipped = np.add.reduceat(np.where(flips, -metric_excess, metric_excess), local_starts, axis=1)
+                exceed[metric] = exceed[metric] + (flipped >= observed[metric]).sum(axis=0)
+
+        for metric in excess:
+            low_col, high_col, p_col = significance_columns(metric)
+            low, high = np.quantile(np.concatenate(boot[metric]), [tail, 1 - tail], axis=0)
+            results[low_col][first:last] = low
+            results[high_col][first:last] = high
+            results[p_col][first:last] = (1 + exceed[metric]) / (1 + resamples)
+
+    significance = investors.copy()
+    for col, values_out in results.items():
+        significance[col] = values_out
+    return significance
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bootstrap CIs and permutation p-values for investor excess returns")
+    parser.add_argument('--store-dir', default=DEFAULT_STORE_DIR)
+    parser.add_argument('--csv', action='store_true', help="Also export the results as CSV")
+    parser.add_argument('--horizons', default='6M,1Y,18M',
+                        help="Comma-separated return horizons, e.g. 1M,3M,6M,1Y,18M,2Y,3Y")
+    parser.add_argument('--resamples', type=int, default=DEFAULT_RESAMPLES,
+                        help=f"Bootstrap and permutation resamples per investor (default: {DEFAULT_RESAMPLES})")
+    parser.add_argument('--confidence', type=float, default=DEFAULT_CONFIDENCE,
+                        help="Confidence level of the bootstrap interval (default: 0.95)")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    horizons = parse_horizons(args.horizons)
+
+    df = read_stage('transactions_with_returns_and_relatives', args.store_dir,
+                    columns=investor_aggregation_columns(horizons))
+    print(f"Loaded {len(df)} transactions")
+
+    start = time.perf_counter()
+    significance = investor_significance(df, horizons, args.resamples, args.confidence, args.seed)
+    print(f"Resampled {len(significance)} investors {args.resamples} times in {time.perf_counter() - start:.1f}s")
+
+    output_path = write_stage(significance, 'investor_significance', args.store_dir, export_csv=args.csv)
+    print(f"Results saved to {output_path}")
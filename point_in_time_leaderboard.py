@@ -0,0 +1,191 @@
+import argparse
+import os
+import time
+import numpy as np
+import pandas as pd
+
+from horizons import DEFAULT_HORIZONS, horizon_labels, parse_horizons
+from stage_store import DEFAULT_STORE_DIR, read_stage
+from transactions_with_weighted_returns import (
+    INVESTOR_KEYS, VALUE_COLUMN, horizon_metric_columns, investor_aggregation_columns
+)
+
+# Dates in the index are whole days; queries are batched in blocks of about this many cells
+QUERY_BLOCK_CELLS = 4_000_000
+
+def build_leaderboard_index(df, horizons=DEFAULT_HORIZONS):
+    """Per-investor running sums of value, value x return and wins, ordered by transaction date
+
+    A horizon's return is known once TRANS_DATE + horizon days have passed, so
+    for every horizon "known by D" means TRANS_DATE <= D - horizon days; one
+    ordering by (investor, TRANS_DATE) therefore serves all horizons. Like the
+    batch metrics, only positive-value transactions count and missing returns
+    contribute zero; transactions without a date never become known.
+    """
+    valid = df[(df[VALUE_COLUMN] > 0) & df['TRANS_DATE'].notna()]
+    codes, _ = pd.factorize(pd.MultiIndex.from_frame(valid[INVESTOR_KEYS]))
+    _, first_rows = np.unique(codes, return_index=True)
+    investors = valid[INVESTOR_KEYS].iloc[first_rows].reset_index(drop=True)
+    days = valid['TRANS_DATE'].to_numpy(dtype='datetime64[D]').astype(np.int64)
+    order = np.lexsort((days, codes))
+    codes, days = codes[order], days[order]
+
+    weighted_columns, _, win_columns = horizon_metric_columns(horizons)
+    value = valid[VALUE_COLUMN].to_numpy(dtype=float)[order]
+    sums = {'Count': np.ones(len(valid)), 'Value_Sum': value}
+    for return_col in weighted_columns.values():
+        returns = valid[return_col].to_numpy(dtype=float)[order]
+        sums[f'Value_x_{return_col}'] = np.nan_to_num(value * returns)
+    for metric, (stock_col, benchmark_col) in win_columns.items():
+        stock = valid[stock_col].to_numpy(dtype=float)[order]
+        sums[f'Wins_{metric}'] = ((stock - valid[benchmark_col].to_numpy(dtype=float)[order]) > 0).astype(float)
+
+    # Composite (investor, day) keys sort like the rows, so one searchsorted finds
+    # every investor's cut-off at once
+    first_day = days.min() if len(days) else 0
+    day_span = (days.max() - first_day + 1) if len(days) else 1
+    # Running sums restart for every investor, so precision does not degrade with dataset size
+    running = pd.DataFrame(sums).groupby(codes, sort=False).cumsum().to_numpy()
+    return {
+        'horizons': dict(horizons),
+        'investors': investors,
+        'keys': codes * day_span + (days - first_day),
+        'first_day': first_day,
+        'day_span': day_span,
+        'starts': np.searchsorted(codes, np.arange(len(investors))),
+        'columns': {name: i for i, name in enumerate(sums)},
+        'running': running,
+    }
+
+def as_of_days(dates):
+    """Whole days since the epoch for one date or a sequence of dates"""
+    return pd.to_datetime(np.atleast_1d(dates)).to_numpy(dtype='datetime64[D]').astype(np.int64)
+
+def known_positions(index, days, horizon_days):
+    """(dates x investors) end positions of the transactions whose return is known on each day"""
+    investor_count = len(index['starts'])
+    cutoff = np.clip(days - horizon_days - index['first_day'], -1, index['day_span'] - 1)
+    # A cut-off of -1 lands exactly on the previous investor's last key, i.e. this investor's start
+    queries = np.arange(investor_count)[None, :] * index['day_span'] + cutoff[:, None]
+    return np.searchsorted(index['keys'], queries, side='right')
+
+def metric_components(metric, horizons):
+    """Running-sum columns a metric is computed from and the function combining them"""
+    weighted_columns, relative_columns, win_columns = horizon_metric_columns(horizons)
+    if metric in weighted_columns:
+        return [f'Value_x_{weighted_columns[metric]}', 'Value_Sum'], lambda total, value: total / value
+    if metric in relative_columns:
+        stock_metric, benchmark_metric = relative_columns[metric]
+        columns = [f'Value_x_{weighted_columns[stock_metric]}', f'Value_x_{weighted_columns[benchmark_metric]}', 'Value_Sum']
+        return columns, lambda stock, benchmark, value: (stock - benchmark) / value
+    if metric in win_columns:
+        return [f'Wins_{metric}', 'Count'], lambda wins, count: wins / count
+    raise ValueError(f"Unknown leaderboard metric '{metric}'")
+
+def metric_horizon(metric, horizons):
+    return next(label for label in horizon_labels(horizons) if metric.endswith(f'_{label}'))
+
+def known_sums(index, positions, column):
+    """Per-investor sums of one column over the rows before the given positions"""
+    running = index['running'][:, index['columns'][column]]
+    starts = index['starts']
+    return np.where(positions > starts, running[np.maximum(positions - 1, 0)], 0.0)
+
+def leaderboard_as_of(index, as_of):
+    """Every investor's metrics for every horizon as they were known on one date"""
+    horizons = list(index['horizons'].items())
+    weighted_columns, relative_columns, win_columns = horizon_metric_columns(horizons)
+    day = as_of_days(as_of)
+    board = index['investors'].copy()
+    positions = {label: known_positions(index, day, days)[0] for label, days in horizons}
+    for label in horizon_labels(horizons):
+        board[f'Known_Count_{label}'] = known_sums(index, positions[label], 'Count').astype(int)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for metric in list(weighted_columns) + list(relative_columns) + list(win_columns):
+            columns, combine = metric_components(metric, horizons)
+            label = metric_horizon(metric, horizons)
+            board[metric] = combine(*[known_sums(index, positions[label], column) for column in columns])
+    return board
+
+def leaderboard_history(index, dates, metric='Return_vs_SP500_6M', top=10, min_transactions=1):
+    """Top investors by one metric on each of many dates, as a long (As_Of, Rank) table
+
+    Dates are evaluated in blocks, each with a single batched searchsorted over
+    dates x investors.
+    """
+    horizons = list(index['horizons'].items())
+    label = metric_horizon(metric, horizons)
+    columns, combine = metric_components(metric, horizons)
+    days = as_of_days(dates)
+    investor_count = len(index['starts'])
+    top = min(top, investor_count)
+    block = max(1, QUERY_BLOCK_CELLS // max(investor_count, 1))
+
+    frames = []
+    for block_start in range(0, len(days), block):
+        block_days = days[block_start:block_start + block]
+        positions = known_positions(index, block_days, index['horizons'][label])
+        counts = known_sums(index, positions, 'Count')
+        with np.errstate(divide='ignore', invalid='ignore'):
+            values = combine(*[known_sums(index, positions, column) for column in columns])
+        # Investors below the minimum (or without a value yet) never make the board
+        scores = np.where((counts >= min_transactions) & ~np.isnan(values), values, -np.inf)
+        candidates = np.argpartition(-scores, top - 1, axis=1)[:, :top] if top else np.empty((len(block_days), 0), dtype=int)
+        ranked = np.take_along_axis(candidates, np.argsort(-np.take_along_axis(scores, candidates, axis=1), axis=1, kind='stable'), axis=1)
+        rows = np.arange(len(block_days))[:, None]
+        frame = pd.DataFrame({
+            'As_Of': np.repeat(block_days.astype('datetime64[D]'), top),
+            'Rank': np.tile(np.arange(1, top + 1), len(block_days)),
+            'Investor': ranked.ravel(),
+            metric: values[rows, ranked].ravel(),
+            f'Known_Count_{label}': counts[rows, ranked].ravel().astype(int),
+        })
+        frames.append(frame[np.isfinite(scores[rows, ranked].ravel())])
+
+    history = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    investors = index['investors'].iloc[history['Investor']].reset_index(drop=True)
+    history = pd.concat([history.drop(columns='Investor'), investors], axis=1)
+    history['As_Of'] = history['As_Of'].astype('datetime64[ns]')
+    return history[['As_Of', 'Rank'] + INVESTOR_KEYS + [metric, f'Known_Count_{label}']]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Investor leaderboards as they would have looked on past dates")
+    parser.add_argument('--store-dir', default=DEFAULT_STORE_DIR)
+    parser.add_argument('--horizons', default='6M,1Y,18M',
+                        help="Comma-separated return horizons, e.g. 1M,3M,6M,1Y,18M,2Y,3Y")
+    parser.add_argument('--metric', default='Return_vs_SP500_6M', help="Investor metric to rank by")
+    parser.add_argument('--top', type=int, default=25)
+    parser.add_argument('--min-transactions', type=int, default=3,
+                        help="Minimum transactions with a known return to be ranked")
+    parser.add_argument('--as-of', help="Print the leaderboard on this date")
+    parser.add_argument('--start', help="First date of a leaderboard history")
+    parser.add_argument('--end', help="Last date of a leaderboard history (default: today)")
+    parser.add_argument('--freq', default='ME', help="Pandas frequency of the history dates (default: month end)")
+    args = parser.parse_args()
+    horizons = parse_horizons(args.horizons)
+    if not args.as_of and not args.start:
+        parser.error("pass --as-of for one leaderboard or --start for a history")
+
+    df = read_stage('transactions_with_returns_and_relatives', args.store_dir,
+                    columns=investor_aggregation_columns(horizons))
+    start = time.perf_counter()
+    index = build_leaderboard_index(df, horizons)
+    print(f"Indexed {len(index['keys'])} transactions for {len(index['starts'])} investors "
+          f"in {time.perf_counter() - start:.2f}s")
+
+    if args.as_of:
+        board = leaderboard_as_of(index, args.as_of)
+        label = metric_horizon(args.metric, horizons)
+        board = board[board[f'Known_Count_{label}'] >= args.min_transactions]
+        board = board.sort_values(args.metric, ascending=False, kind='mergesort').head(args.top)
+        print(f"\nLeaderboard as of {args.as_of} by {args.metric}:")
+        print(board[INVESTOR_KEYS + [f'Known_Count_{label}', args.metric]].to_string(index=False))
+
+    if args.start:
+        dates = pd.date_range(args.start, args.end or pd.Timestamp.today(), freq=args.freq)
+        start = time.perf_counter()
+        history = leaderboard_history(index, dates, args.metric, args.top, args.min_transactions)
+        print(f"\nRanked {len(dates)} dates in {time.perf_counter() - start:.2f}s")
+        output_path = os.path.join(args.store_dir, "leaderboard_history.csv")
+        history.to_csv(output_path, index=False)
+        print(f"Leaderboard history saved to {output_path}")
@@ -0,0 +1,271 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pandas as pd
+
+from price_store import FORWARD_PRICE_COLUMNS, ingest_prices
+from stage_store import DEFAULT_STORE_DIR
+
+DEFAULT_CACHE_PATH = os.path.join("cache", "price_history_cache.json")
+
+# HTTP statuses worth retrying; a 404 means the symbol has no data, and any
+# other error (e.g. 401/403 for a bad key or quota) fails without being cached
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+NO_DATA_STATUS = 404
+# Fetched symbols merged into the cache between saves, so an interrupted run keeps them
+SAVE_EVERY = 50
+
+def plan_requests(transactions_df, horizon_days=max(FORWARD_PRICE_COLUMNS.values()), pad_days=7):
+    """One (start, end) range per symbol covering every transaction date through its longest horizon"""
+    dates = pd.to_datetime(transactions_df['TRANS_DATE']).dt.tz_localize(None).dt.normalize()
+    ranges = pd.DataFrame({
+        'Symbol': transactions_df['ISSUERTRADINGSYMBOL'],
+        'Date': dates,
+    }).dropna().groupby('Symbol')['Date'].agg(['min', 'max'])
+    starts = ranges['min'] - pd.Timedelta(days=pad_days)
+    ends = ranges['max'] + pd.Timedelta(days=horizon_days + pad_days)
+    return {
+        symbol: (start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d'))
+        for symbol, start, end in zip(ranges.index, starts, ends)
+    }
+
+def load_cache(cache_path):
+    """Per-symbol cached price history: {symbol: {"start", "end", "prices": {date: close}}}"""
+    if not os.path.exists(cache_path):
+        return {}
+    with open(cache_path) as f:
+        return json.load(f)
+
+def save_cache(cache, cache_path):
+    """Write the cache to a temp file and swap it in so an interrupted run never corrupts it"""
+    os.makedirs(os.path.dirname(cache_path) or '.', exist_ok=True)
+    tmp_path = f"{cache_path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(cache, f)
+    os.replace(tmp_path, cache_path)
+
+def missing_ranges(requests, cache):
+    """Requests the cache does not cover, widened to include the cached span so each symbol stays one range"""
+    pending = {}
+    for symbol, (start, end) in requests.items():
+        cached = cache.get(symbol)
+        if cached and cached['start'] <= start and cached['end'] >= end:
+            continue
+        if cached:
+            start, end = min(start, cached['start']), max(end, cached['end'])
+        pending[symbol] = (start, end)
+    return pending
+
+class RateLimiter:
+    """Space request starts at least 1 / rate_per_second apart"""
+
+    def __init__(self, rate_per_second):
+        self.interval = 1.0 / rate_per_second if rate_per_second else 0.0
+        self.next_slot = 0.0
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self.lock:
+            now = asyncio.get_running_loop().time()
+            delay = self.next_slot - now
+            self.next_slot = max(now, self.next_slot) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+def _http_get_json(url, timeout):
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return json.loads(response.read())
+
+async def fetch_symbol(symbol, start, end, url_template, semaphore, limiter, retries=3, backoff=0.5, timeout=30):
+    """Fetch one symbol's whole range, retrying transient failures with exponential backoff"""
+    url = url_template.format(symbol=urllib.parse.quote(symbol), start=start, end=end)
+    for attempt in range(retries + 1):
+        async with semaphore:
+            await limiter.wait()
+            try:
+                payload = await asyncio.to_thread(_http_get_json, url, timeout)
+                return {row['date']: row['close'] for row in payload['prices']}
+            except urllib.error.HTTPError as e:
+                if e.code == NO_DATA_STATUS:
+                    return {}
+                if e.code not in RETRYABLE_STATUSES:
+                    raise
+                error = e
+            except (urllib.error.URLError, TimeoutError, ConnectionError) as e:
+                error = e
+        if attempt < retries:
+            await asyncio.sleep(backoff * (2 ** attempt) * (1 + random.random() / 10))
+    raise error
+
+async def fetch_prices(requests, url_template, cache, concurrency=8, rate_per_second=10, retries=3, backoff=0.5,
+                       cache_path=None, save_every=SAVE_EVERY):
+    """Fetch every uncached range with bounded concurrency, merging each result into the cache as it arrives
+
+    With cache_path, the cache is also saved every save_every merged symbols.
+    """
+    pending = missing_ranges(requests, cache)
+    semaphore = asyncio.Semaphore(concurrency)
+    limiter = RateLimiter(rate_per_second)
+
+    async def fetch_one(symbol):
+        try:
+            return symbol, await fetch_symbol(symbol, *pending[symbol], url_template, semaphore, limiter, retries, backoff)
+        except Exception as e:
+            return symbol, e
+
+    failed = []
+    merged = 0
+    for task in asyncio.as_completed([fetch_one(symbol) for symbol in pending]):
+        symbol, result = await task
+        if isinstance(result, Exception):
+            failed.append(symbol)
+            continue
+        start, end = pending[symbol]
+        prices = cache.get(symbol, {}).get('prices', {})
+        prices.update(result)
+        cache[symbol] = {'start': start, 'end': end, 'prices': prices}
+        merged += 1
+        if cache_path and merged % save_every == 0:
+            save_cache(cache, cache_path)
+    return {
+        'requested': len(requests),
+        'cached': len(requests) - len(pending),
+        'fetched': len(pending) - len(failed),
+        'failed': failed,
+    }
+
+def cache_to_frame(cache, symbols=None):
+    """Cached prices as (Symbol, Date, Close) rows for the price store"""
+    frames = []
+    for symbol in symbols if symbols is not None else cache:
+        prices = cache.get(symbol, {}).get('prices', {})
+        if prices:
+            frames.append(pd.DataFrame({
+                'Symbol': symbol,
+                'Date': pd.to_datetime(list(prices)).to_numpy(dtype='datetime64[D]'),
+                'Close': list(prices.values()),
+            }))
+    if not frames:
+        return pd.DataFrame({'Symbol': [], 'Date': pd.Series([], dtype='datetime64[s]'), 'Close': []})
+    return pd.concat(frames, ignore_index=True)
+
+def fetch_price_history(transactions_df, url_template, cache_path=DEFAULT_CACHE_PATH, **fetch_options):
+    """Fill the persistent cache for every symbol/range the transactions need; reruns make no requests"""
+    cache = load_cache(cache_path)
+    requests = plan_requests(transactions_df)
+    try:
+        stats = asyncio.run(fetch_prices(requests, url_template, cache, cache_path=cache_path, **fetch_options))
+    finally:
+        save_cache(cache, cache_path)
+    return cache_to_frame(cache, list(requests)), stats
+
+class CannedPriceServer:
+    """Local stand-in for the price endpoint, serving canned closes over HTTP
+
+    Serves GET /prices/<symbol>?start=YYYY-MM-DD&end=YYYY-MM-DD as
+    {"symbol": ..., "prices": [{"date": ..., "close": ...}]}. Unknown symbols get 404.
+    The first fail_first requests get fail_status (503 by default) so retry and
+    error paths can be exercised.
+    Use as a context manager; url_template points at the running server.
+    """
+
+    def __init__(self, prices, host='127.0.0.1', port=0, fail_first=0, fail_status=503):
+        prices = prices.copy()
+        prices['Date'] = pd.to_datetime(prices['Date']).dt.strftime('%Y-%m-%d')
+        self.prices = {symbol: rows.sort_values('Date') for symbol, rows in prices.groupby('Symbol')}
+        self.fail_first = fail_first
+        self.fail_status = fail_status
+        self.request_count = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.thread = None
+
+    @property
+    def url_template(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/prices/{{symbol}}?start={{start}}&end={{end}}"
+
+    def _handler(self):
+        canned = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with canned.lock:
+                    canned.request_count += 1
+                    should_fail = canned.request_count <= canned.fail_first
+                parsed = urllib.parse.urlparse(self.path)
+                symbol = urllib.parse.unquote(parsed.path.rsplit('/', 1)[-1])
+                query = urllib.parse.parse_qs(parsed.query)
+                if should_fail:
+                    return self._send(canned.fail_status, {'error': 'unavailable'})
+                if symbol not in canned.prices:
+                    return self._send(404, {'error': 'unknown symbol'})
+                rows = canned.prices[symbol]
+                rows = rows[(rows['Date'] >= query['start'][0]) & (rows['Date'] <= query['end'][0])]
+                self._send(200, {
+                    'symbol': symbol,
+                    'prices': [{'date': d, 'close': c} for d, c in zip(rows['Date'], rows['Close'])],
+                })
+
+            def _send(self, status, body):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fetch per-symbol price history into the persistent cache")
+    subparsers = parser.add_subparsers(dest='action', required=True)
+
+    fetch_parser = subparsers.add_parser('fetch', help="Fetch prices for every symbol/range in a transactions CSV")
+    fetch_parser.add_argument('transactions')
+    fetch_parser.add_argument('--url-template', required=True,
+                              help="e.g. http://host/prices/{symbol}?start={start}&end={end}")
+    fetch_parser.add_argument('--cache', default=DEFAULT_CACHE_PATH)
+    fetch_parser.add_argument('--price-store-dir', default=os.path.join(DEFAULT_STORE_DIR, "price_store"))
+    fetch_parser.add_argument('--concurrency', type=int, default=8)
+    fetch_parser.add_argument('--rate', type=float, default=10, help="Max requests started per second")
+    fetch_parser.add_argument('--retries', type=int, default=3)
+
+    serve_parser = subparsers.add_parser('serve', help="Serve canned closes from a Symbol/Date/Close CSV locally")
+    serve_parser.add_argument('prices')
+    serve_parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    if args.action == 'fetch':
+        prices, stats = fetch_price_history(
+            pd.read_csv(args.transactions), args.url_template, args.cache,
+            concurrency=args.concurrency, rate_per_second=args.rate, retries=args.retries
+        )
+        print(f"{stats['cached']} symbols from cache, {stats['fetched']} fetched, {len(stats['failed'])} failed")
+        if len(prices):
+            symbol_count, row_count = ingest_prices(prices, args.price_store_dir)
+            print(f"Price store now holds {row_count} closes for {symbol_count} symbols")
+    else:
+        with CannedPriceServer(pd.read_csv(args.prices), port=args.port) as server:
+            print(f"Serving canned prices at {server.url_template}")
+            threading.Event().wait()
@@ -0,0 +1,199 @@
+import argparse
+import glob
+import os
+import numpy as np
+import pandas as pd
+
+from horizons import DEFAULT_HORIZONS, forward_price_columns, parse_horizons
+from stage_store import DEFAULT_STORE_DIR, current_version_dir, new_version_dir, publish_version, read_current
+
+# Forward price column -> days after the transaction date (same offsets as the benchmark periods)
+FORWARD_PRICE_COLUMNS = forward_price_columns(DEFAULT_HORIZONS)
+
+# Composite (symbol code, day) keys keep the whole table in one sorted array;
+# days are offset so pre-1970 dates stay positive
+DAY_OFFSET = 2 ** 19
+SYMBOL_SPAN = 2 ** 20
+
+STORE_ARRAYS = ['symbols', 'offsets', 'days', 'closes', 'keys']
+
+def _search_keys(symbol_codes, days):
+    return symbol_codes.astype(np.int64) * SYMBOL_SPAN + (days.astype(np.int64) + DAY_OFFSET)
+
+def _to_days(dates):
+    """Calendar day numbers for dates, with timezone offsets dropped"""
+    dates = pd.to_datetime(pd.Series(dates), utc=True).dt.tz_localize(None).dt.normalize()
+    return dates.to_numpy(dtype='datetime64[D]')
+
+def read_price_dump(path, close_column='Close'):
+    """Read a local CSV dump of daily closes as (Symbol, Date, Close)
+
+    Accepts either a multi-symbol file with a Symbol column or a single-symbol
+    file named <SYMBOL>.csv with Date and close columns.
+    """
+    dump = pd.read_csv(path)
+    if 'Symbol' not in dump.columns:
+        dump['Symbol'] = os.path.splitext(os.path.basename(path))[0]
+    if close_column not in dump.columns and 'Adj Close' in dump.columns:
+        close_column = 'Adj Close'
+    return pd.DataFrame({
+        'Symbol': dump['Symbol'].astype(str),
+        'Date': _to_days(dump['Date']),
+        'Close': pd.to_numeric(dump[close_column], errors='coerce'),
+    })
+
+def price_store_exists(store_dir):
+    return os.path.exists(os.path.join(current_version_dir(store_dir) or store_dir, "keys.npy"))
+
+def write_price_store(prices, store_dir):
+    """Write (Symbol, Date, Close) rows as per-symbol sorted arrays that can be memory-mapped"""
+    prices = prices.dropna(subset=['Symbol', 'Date', 'Close'])
+    prices = prices.sort_values(['Symbol', 'Date'], kind='mergesort')
+    # Later rows (newer dumps) win for a repeated (symbol, day)
+    prices = prices.drop_duplicates(['Symbol', 'Date'], keep='last')
+
+    symbols, counts = np.unique(prices['Symbol'].to_numpy().astype(str), return_counts=True)
+    days = prices['Date'].to_numpy(dtype='datetime64[D]').astype(np.int64).astype(np.int32)
+    codes = np.repeat(np.arange(len(symbols)), counts)
+    arrays = {
+        'symbols': symbols,
+        'offsets': np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+        'days': days,
+        'closes': prices['Close'].to_numpy(dtype=np.float64),
+        'keys': _search_keys(codes, days),
+    }
+
+    # The arrays go to a new version directory and CURRENT is swapped to it in one
+    # rename, so a reader never sees arrays from two different writes. The version
+    # it replaces stays for readers that already resolved it; older ones are pruned
+    os.makedirs(store_dir, exist_ok=True)
+    flat_layout = current_version_dir(store_dir) is None
+    version_dir = new_version_dir(store_dir)
+    for name in STORE_ARRAYS:
+        np.save(os.path.join(version_dir, f"{name}.npy"), arrays[name])
+    publish_version(store_dir, version_dir)
+
+    if flat_layout:
+        for name in STORE_ARRAYS:
+            try:
+                os.remove(os.path.join(store_dir, f"{name}.npy"))
+            except OSError:
+                pass
+    return len(symbols), len(prices)
+
+class PriceStore:
+    """Memory-mapped (symbol, date) -> close table with batched nearest-trading-day lookups
+
+    There is no per-symbol cache: the arrays are memory-mapped, so the OS page
+    cache keeps the segments of hot symbols in memory for every lookup.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        read_current(store_dir, self._load)
+
+    def _load(self, version_dir):
+        version_dir = version_dir or self.store_dir
+        self.symbols = np.load(os.path.join(version_dir, "symbols.npy"))
+        self.offsets = np.load(os.path.join(version_dir, "offsets.npy"))
+        self.days = np.load(os.path.join(version_dir, "days.npy"), mmap_mode='r')
+        self.closes = np.load(os.path.join(version_dir, "closes.npy"), mmap_mode='r')
+        self.keys = np.load(os.path.join(version_dir, "keys.npy"), mmap_mode='r')
+
+    def to_frame(self):
+        """All stored rows as a (Symbol, Date, Close) DataFrame"""
+        counts = np.diff(self.offsets)
+        return pd.DataFrame({
+            'Symbol': np.repeat(self.symbols, counts),
+            'Date': np.asarray(self.days).astype('datetime64[D]'),
+            'Close': np.asarray(self.closes),
+        })
+
+    def symbol_codes(self, symbols):
+        """Position of each symbol in the store, or -1 when it has no prices"""
+        symbols = pd.Series(symbols).astype(object).fillna('').astype(str).to_numpy()
+        if len(self.symbols) == 0:
+            return np.full(len(symbols), -1)
+        codes = np.minimum(np.searchsorted(self.symbols, symbols), len(self.symbols) - 1)
+        return np.where(self.symbols[codes] == symbols, codes, -1)
+
+    def prices_at(self, symbols, dates, offset_days=0, max_gap_days=7):
+        """Close on the nearest trading day to date + offset_days for every (symbol, date) pair
+
+        Ties go to the earlier trading day. Pairs with an unknown symbol, a missing
+        date, or no trading day within max_gap_days come back as NaN.
+        """
+        codes = self.symbol_codes(symbols)
+        dates = pd.to_datetime(pd.Series(dates)).dt.tz_localize(None)
+        missing_date = dates.isna().to_numpy()
+        target = dates.fillna(pd.Timestamp(0)).to_numpy(dtype='datetime64[D]').astype(np.int64) + offset_days
+
+        known = (codes >= 0) & ~missing_date
+        safe_codes = np.where(known, codes, 0)
+        if len(self.symbols) == 0:
+            return np.full(len(codes), np.nan)
+
+        # One binary search over composite keys, clamped to each symbol's segment
+        start = self.offsets[safe_codes]
+        last = self.offsets[safe_codes + 1] - 1
+        right = np.searchsorted(self.keys, _search_keys(safe_codes, target), side='left')
+        right = np.clip(right, start, last)
+        left = np.maximum(right - 1, start)
+
+        left_days = self.days[left].astype(np.int64)
+        right_days = self.days[right].astype(np.int64)
+        use_left = (target - left_days) <= (right_days - target)
+        positions = np.where(use_left, left, right)
+        gap = np.abs(np.where(use_left, left_days, right_days) - target)
+
+        prices = np.asarray(self.closes[positions], dtype=float)
+        prices[~known | (gap > max_gap_days)] = np.nan
+        return prices
+
+def ingest_prices(prices, store_dir):
+    """Merge (Symbol, Date, Close) rows into the price store (new rows win over stored ones)"""
+    frames = []
+    if price_store_exists(store_dir):
+        frames.append(PriceStore(store_dir).to_frame())
+    frames.append(prices)
+    return write_price_store(pd.concat(frames, ignore_index=True), store_dir)
+
+def ingest_price_dumps(paths, store_dir, close_column='Close'):
+    """Merge local CSV dumps into the price store"""
+    dumps = [read_price_dump(path, close_column) for path in paths]
+    return ingest_prices(pd.concat(dumps, ignore_index=True), store_dir)
+
+def add_forward_prices(df, price_store, price_columns=FORWARD_PRICE_COLUMNS, max_gap_days=7):
+    """Fill forward price columns for all transactions from the local price store"""
+    for column, days in price_columns.items():
+        df[column] = price_store.prices_at(df['ISSUERTRADINGSYMBOL'], df['TRANS_DATE'], days, max_gap_days)
+    return df
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local indexed price store")
+    parser.add_argument('--price-store-dir', default=os.path.join(DEFAULT_STORE_DIR, "price_store"))
+    subparsers = parser.add_subparsers(dest='action', required=True)
+
+    ingest_parser = subparsers.add_parser('ingest', help="Ingest CSV dumps of daily closes")
+    ingest_parser.add_argument('paths', nargs='+', help="CSV files or glob patterns")
+    ingest_parser.add_argument('--close-column', default='Close')
+
+    fill_parser = subparsers.add_parser('fill', help="Fill forward price columns for a transactions CSV")
+    fill_parser.add_argument('input')
+    fill_parser.add_argument('output')
+    fill_parser.add_argument('--max-gap-days', type=int, default=7)
+    fill_parser.add_argument('--horizons', default='6M,1Y,18M',
+                             help="Comma-separated horizons whose forward price columns are filled")
+    args = parser.parse_args()
+
+    if args.action == 'ingest':
+        paths = sorted(path for pattern in args.paths for path in glob.glob(pattern))
+        symbol_count, row_count = ingest_price_dumps(paths, args.price_store_dir, args.close_column)
+        print(f"Price store now holds {row_count} closes for {symbol_count} symbols")
+    else:
+        transactions_df = pd.read_csv(args.input)
+        price_columns = forward_price_columns(parse_horizons(args.horizons))
+        transactions_df = add_forward_prices(transactions_df, PriceStore(args.price_store_dir), price_columns,
+                                             max_gap_days=args.max_gap_days)
+        transactions_df.to_csv(args.output, index=False)
+        print(f"Forward prices written to {args.output}")
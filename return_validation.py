@@ -0,0 +1,181 @@
+import argparse
+import json
+import os
+import warnings
+import numpy as np
+import pandas as pd
+
+from horizons import DEFAULT_HORIZONS, horizon_labels, parse_horizons, price_column
+from stage_store import DEFAULT_STORE_DIR, read_stage, write_stage
+from transactions_with_weighted_returns import INVESTOR_KEYS
+
+# Returns are decimals (0.15 = 15%); anything beyond +/-500% is out of range
+MAX_ABS_RETURN = 5
+# A return about 100x the one implied by its prices was stored in percent
+PERCENT_SCALE = 100
+PERCENT_SCALE_TOLERANCE = 1
+# Implied returns smaller than this are too close to zero to compare scales
+MIN_IMPLIED_RETURN = 0.001
+
+COUNT_KINDS = ['Null', 'Out_Of_Range', 'Zero', 'Percent_Scale']
+
+# Column summary metric -> (warn above, fail above); None disables that level.
+# Missing returns are expected for recent transactions, so nulls never fail
+DEFAULT_THRESHOLDS = {
+    'Null_Rate': (0.25, None),
+    'Out_Of_Range_Rate': (0.001, 0.01),
+    'Zero_Rate': (0.01, None),
+    'Percent_Scale_Rate': (0.0, 0.01),
+    'Median_Abs_Return': (None, 1.0),
+}
+
+def return_sources(horizons=DEFAULT_HORIZONS):
+    """Return column -> (end, start) columns its value is implied from, as end / start - 1"""
+    sources = {}
+    for prefix, level in [('', None), ('SP500_', 'SP500'), ('SECTOR_', 'SECTOR')]:
+        for label in horizon_labels(horizons):
+            if level is None:
+                sources[f'RETURN_{label}'] = (price_column(label), 'ADJUSTED_TRANS_PRICEPERSHARE')
+            else:
+                sources[f'{prefix}RETURN_{label}'] = (f'{level}_{label}', level)
+    return sources
+
+def validation_columns(horizons=DEFAULT_HORIZONS):
+    """Stage columns read by the validation"""
+    columns = INVESTOR_KEYS + list(return_sources(horizons))
+    for end, start in return_sources(horizons).values():
+        columns += [col for col in (end, start) if col not in columns]
+    return columns
+
+def implied_returns(df, sources):
+    """(transactions x returns) array of returns recomputed from their source columns (NaN if unavailable)"""
+    implied = np.full((len(df), len(sources)), np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for i, (end, start) in enumerate(sources.values()):
+            if end in df.columns and start in df.columns:
+                implied[:, i] = df[end].to_numpy(dtype=float) / df[start].to_numpy(dtype=float) - 1
+    return implied
+
+def investor_validation_counts(df, horizons=DEFAULT_HORIZONS, max_abs_return=MAX_ABS_RETURN):
+    """Null, out-of-range, zero and percent-scale counts for every investor and return column
+
+    All checks are evaluated as (transactions x columns) boolean arrays and
+    reduced by one groupby; the result is a long table with one row per
+    (investor, return column).
+    """
+    sources = return_sources(horizons)
+    return_cols = list(sources)
+    returns = df[return_cols].to_numpy(dtype=float)
+    implied = implied_returns(df, sources)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        percent_scale = (np.abs(implied) >= MIN_IMPLIED_RETURN) & \
+            (np.abs(returns / implied - PERCENT_SCALE) <= PERCENT_SCALE_TOLERANCE)
+        checks = {
+            'Null': np.isnan(returns),
+            'Out_Of_Range': np.abs(returns) > max_abs_return,
+            'Zero': returns == 0,
+            'Percent_Scale': percent_scale,
+        }
+
+    flags = pd.DataFrame(
+        np.concatenate([checks[kind] for kind in COUNT_KINDS], axis=1).astype(np.int32),
+        columns=pd.MultiIndex.from_product([[f'{kind}_Count' for kind in COUNT_KINDS], return_cols],
+                                           names=[None, 'Column']),
+    )
+    keys = [df[key].to_numpy() for key in INVESTOR_KEYS]
+    grouped = flags.groupby(keys, dropna=False).sum()
+    grouped.index.names = INVESTOR_KEYS
+    rows = pd.Series(1, index=flags.index).groupby(keys, dropna=False).sum()
+
+    counts = grouped.stack('Column', future_stack=True).reset_index()
+    counts.insert(len(INVESTOR_KEYS) + 1, 'Rows', rows.to_numpy().repeat(len(return_cols)))
+    return counts
+
+def column_summary(df, counts, horizons=DEFAULT_HORIZONS):
+    """Per-column totals and rates, summed from the investor counts"""
+    return_cols = list(return_sources(horizons))
+    summary = counts.groupby('Column', sort=False)[['Rows'] + [f'{kind}_Count' for kind in COUNT_KINDS]].sum()
+    summary = summary.reindex(return_cols)
+    for kind in COUNT_KINDS:
+        summary[f'{kind}_Rate'] = summary[f'{kind}_Count'] / summary['Rows'].where(summary['Rows'] > 0)
+    # A median move above 100% across all transactions means the column is in percent, not decimals
+    with warnings.catch_warnings():
+        # Columns without any return (e.g. a horizon beyond the data) have no median
+        warnings.simplefilter('ignore', RuntimeWarning)
+        summary['Median_Abs_Return'] = np.nanmedian(np.abs(df[return_cols].to_numpy(dtype=float)), axis=0) \
+            if len(df) else np.nan
+    return summary
+
+def evaluate_thresholds(summary, thresholds=DEFAULT_THRESHOLDS):
+    """Flag every column metric above its warn or fail threshold; returns (status, flags)"""
+    flags = []
+    for metric, (warn, fail) in thresholds.items():
+        for column, value in summary[metric].items():
+            if pd.isna(value):
+                continue
+            if fail is not None and value > fail:
+                flags.append({'column': column, 'metric': metric, 'value': float(value), 'level': 'fail', 'threshold': fail})
+            elif warn is not None and value > warn:
+                flags.append({'column': column, 'metric': metric, 'value': float(value), 'level': 'warn', 'threshold': warn})
+    levels = {flag['level'] for flag in flags}
+    status = 'fail' if 'fail' in levels else 'warn' if 'warn' in levels else 'ok'
+    return status, flags
+
+def validation_report(df, horizons=DEFAULT_HORIZONS, max_abs_return=MAX_ABS_RETURN, thresholds=DEFAULT_THRESHOLDS):
+    """Investor counts table and a JSON-ready report with column summaries, totals and flags"""
+    counts = investor_validation_counts(df, horizons, max_abs_return)
+    summary = column_summary(df, counts, horizons)
+    status, flags = evaluate_thresholds(summary, thresholds)
+    count_columns = [f'{kind}_Count' for kind in COUNT_KINDS]
+    report = {
+        'status': status,
+        'transactions': len(df),
+        'investors': int(counts[INVESTOR_KEYS].drop_duplicates().shape[0]),
+        'max_abs_return': max_abs_return,
+        'thresholds': {metric: {'warn': warn, 'fail': fail} for metric, (warn, fail) in thresholds.items()},
+        'totals': {col: int(summary[col].sum()) for col in count_columns},
+        'columns': json.loads(summary.reset_index().to_json(orient='records')),
+        'flags': flags,
+    }
+    return counts, report
+
+def load_thresholds(path):
+    """DEFAULT_THRESHOLDS updated from a JSON file of {metric: {"warn": x, "fail": y}}"""
+    thresholds = dict(DEFAULT_THRESHOLDS)
+    with open(path) as f:
+        for metric, levels in json.load(f).items():
+            if metric not in thresholds:
+                raise ValueError(f"Unknown validation threshold '{metric}' (expected one of {', '.join(thresholds)})")
+            warn, fail = thresholds[metric]
+            thresholds[metric] = (levels.get('warn', warn), levels.get('fail', fail))
+    return thresholds
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Validate transaction returns per investor and column")
+    parser.add_argument('--store-dir', default=DEFAULT_STORE_DIR)
+    parser.add_argument('--csv', action='store_true', help="Also export the investor counts as CSV")
+    parser.add_argument('--horizons', default='6M,1Y,18M',
+                        help="Comma-separated return horizons, e.g. 1M,3M,6M,1Y,18M,2Y,3Y")
+    parser.add_argument('--max-abs-return', type=float, default=MAX_ABS_RETURN,
+                        help="Returns beyond +/- this (as a decimal) are out of range (default: 5 = 500%%)")
+    parser.add_argument('--thresholds', help="JSON file overriding warn/fail thresholds per metric")
+    parser.add_argument('--strict', action='store_true', help="Exit with an error on warnings as well as failures")
+    args = parser.parse_args()
+    horizons = parse_horizons(args.horizons)
+    thresholds = load_thresholds(args.thresholds) if args.thresholds else DEFAULT_THRESHOLDS
+
+    df = read_stage('transactions_with_returns_and_relatives', args.store_dir, columns=validation_columns(horizons))
+    counts, report = validation_report(df, horizons, args.max_abs_return, thresholds)
+
+    output_path = write_stage(counts, 'return_validation', args.store_dir, export_csv=args.csv)
+    report_path = os.path.join(args.store_dir, "return_validation.json")
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    summary = pd.DataFrame(report['columns']).set_index('Column')
+    print(summary[['Rows', 'Null_Rate', 'Out_Of_Range_Rate', 'Zero_Rate', 'Percent_Scale_Rate', 'Median_Abs_Return']].to_string())
+    for flag in report['flags']:
+        print(f"{flag['level'].upper()}: {flag['column']} {flag['metric']}={flag['value']:.4g} > {flag['threshold']}")
+    print(f"Validation {report['status']}: counts saved to {output_path}, report to {report_path}")
+    if report['status'] == 'fail' or (args.strict and report['status'] == 'warn'):
+        raise SystemExit(1)
@@ -0,0 +1,346 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+import pandas as pd
+
+from horizons import parse_horizons
+from instrumentation import enable, step, write_report
+from stage_store import DEFAULT_STORE_DIR, append_stage, export_stage_csv, read_stage, stage_exists, write_stage
+from transactions_combined_with_SP500_sector_performance import (
+    build_benchmark_index, add_benchmark_levels, add_benchmark_returns, add_relative_returns
+)
+from transactions_with_split_adjustments import build_split_factors, add_split_adjustments
+from transactions_with_calculated_returns import calculate_returns
+from transactions_with_weighted_returns import (
+    calculate_investor_metrics_parallel, finalize_investor_metrics, investor_aggregation_columns,
+    investor_partial_sums, merge_partial_sums, prepare_transactions
+)
+
+# Raw inputs, read from --input-dir
+INPUT_FILES = {
+    'transactions': "insider_transactions_with_prices_final.csv",
+    'benchmarks': "S_P_500_and_Sectors_Ten_Yr_Performance.csv",
+    'splits': "stock_splits_history_final.csv",
+}
+
+# Stages the other scripts read; written unless --materialize says otherwise
+DEFAULT_MATERIALIZE = ['transactions_with_returns_and_relatives', 'investor_weighted_returns']
+MANIFEST_FILE = "pipeline_manifest.json"
+HASH_BLOCK_SIZE = 1 << 20
+# Transactions per chunk in --stream mode
+DEFAULT_CHUNK_SIZE = 250_000
+
+def parse_trans_dates(df):
+    df['TRANS_DATE'] = pd.to_datetime(df['TRANS_DATE']).dt.tz_localize(None)
+    return df
+
+def read_transactions(path, chunk_size=None):
+    """Raw transactions with a timezone-naive TRANS_DATE, whole or as an iterator of chunks"""
+    if chunk_size is not None:
+        return read_transaction_chunks(path, chunk_size)
+    with step('read_csv') as info:
+        df = parse_trans_dates(pd.read_csv(path))
+        info['rows_out'] = len(df)
+    return df
+
+def read_transaction_chunks(path, chunk_size):
+    reader = pd.read_csv(path, chunksize=chunk_size)
+    while True:
+        # Parsing happens when the next chunk is pulled, so that is what gets timed
+        with step('read_csv') as info:
+            chunk = next(reader, None)
+            if chunk is not None:
+                chunk = parse_trans_dates(chunk)
+                info['rows_out'] = len(chunk)
+        if chunk is None:
+            return
+        yield chunk
+
+def read_benchmarks(path):
+    sp500_sectors_df = pd.read_csv(path)
+    sp500_sectors_df['Date'] = pd.to_datetime(sp500_sectors_df['Date']).dt.tz_localize(None)
+    return sp500_sectors_df
+
+def split_adjust(df, inputs, horizons, workers):
+    df = read_transactions(inputs['transactions'])
+    return add_split_adjustments(df, build_split_factors(pd.read_csv(inputs['splits'])))
+
+def returns(df, inputs, horizons, workers):
+    return calculate_returns(df, horizons)
+
+def benchmark_join(df, inputs, horizons, workers):
+    sp500_sectors_df = read_benchmarks(inputs['benchmarks'])
+    df = add_benchmark_levels(df, build_benchmark_index(sp500_sectors_df), horizons)
+    return add_benchmark_returns(df, sp500_sectors_df, horizons)
+
+def relative_returns(df, inputs, horizons, workers):
+    return add_relative_returns(df, horizons)
+
+def investor_metrics(df, inputs, horizons, workers):
+    # prepare_transactions adds columns in place; copy only the columns it and the aggregation read
+    df = prepare_transactions(df[investor_aggregation_columns(horizons)].copy())
+    return calculate_investor_metrics_parallel(df, workers, horizons)
+
+# (stage, upstream stage, raw inputs, step, module holding the stage's logic) in execution order.
+# Each stage feeds the next in memory; the stage names are the ones the separate scripts use
+PIPELINE = [
+    ('transactions_split_adjusted', None, ['transactions', 'splits'], split_adjust,
+     'transactions_with_split_adjustments'),
+    ('transactions_with_returns', 'transactions_split_adjusted', [], returns,
+     'transactions_with_calculated_returns'),
+    ('transactions_with_market_performance', 'transactions_with_returns', ['benchmarks'], benchmark_join,
+     'transactions_combined_with_SP500_sector_performance'),
+    ('transactions_with_returns_and_relatives', 'transactions_with_market_performance', [], relative_returns,
+     'transactions_combined_with_SP500_sector_performance'),
+    ('investor_weighted_returns', 'transactions_with_returns_and_relatives', [], investor_metrics,
+     'transactions_with_weighted_returns'),
+]
+PIPELINE_STAGES = [stage for stage, _, _, _, _ in PIPELINE]
+
+def file_hash(path):
+    """sha256 of a file's contents, read in blocks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def stage_keys(inputs, horizons):
+    """Content key of every stage from its raw inputs, its code, the horizons and its upstream key
+
+    Keys chain, so a changed input re-runs its stage and everything after it.
+    """
+    input_hashes = {name: file_hash(path) for name, path in inputs.items()}
+    keys = {}
+    for stage, upstream, stage_inputs, _, module in PIPELINE:
+        keys[stage] = hashlib.sha256(json.dumps({
+            'stage': stage,
+            'horizons': horizons,
+            'inputs': {name: input_hashes[name] for name in stage_inputs},
+            'code': file_hash(sys.modules[module].__file__),
+            'upstream': keys.get(upstream),
+        }, sort_keys=True).encode()).hexdigest()
+    return keys
+
+def load_manifest(output_dir):
+    path = os.path.join(output_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def save_manifest(manifest, output_dir):
+    path = os.path.join(output_dir, MANIFEST_FILE)
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(f"{path}.tmp", path)
+
+def run_pipeline(input_dir, output_dir, horizons, materialize=DEFAULT_MATERIALIZE, workers=1,
+                 export_csv=False, force=False):
+    """Run the stages in one process, passing frames in memory and writing only the stages in materialize
+
+    A materialized stage whose key matches the manifest and whose output exists
+    is skipped; stages are only computed (or read back from a skipped stage)
+    when a stage that has to be written needs them. Returns per-stage
+    (action, seconds) timings.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    inputs = {name: os.path.join(input_dir, filename) for name, filename in INPUT_FILES.items()}
+    start = time.perf_counter()
+    with step('hash_inputs'):
+        keys = stage_keys(inputs, horizons)
+    timings = {'hash inputs': ('hashed', time.perf_counter() - start)}
+    manifest = {} if force else load_manifest(output_dir)
+    steps = {stage: (upstream, step) for stage, upstream, _, step, _ in PIPELINE}
+    frames = {}
+
+    def unchanged(stage):
+        return manifest.get(stage) == keys[stage] and stage_exists(stage, output_dir)
+
+    def frame_timed(stage, action, compute, rows_in=None):
+        stage_start = time.perf_counter()
+        with step(stage, rows_in=rows_in) as info:
+            df = compute()
+            info['rows_out'] = len(df)
+        timings[stage] = (action, time.perf_counter() - stage_start)
+        print(f"{stage}: {action} {len(df)} rows in {timings[stage][1]:.2f}s")
+        return df
+
+    def frame(stage):
+        if stage in frames:
+            return frames[stage]
+        upstream, stage_step = steps[stage]
+        if unchanged(stage):
+            # A written stage with the same key is read back instead of recomputed
+            df = frame_timed(stage, 'loaded', lambda: read_stage(stage, output_dir))
+        else:
+            upstream_df = frame(upstream) if upstream else None
+            df = frame_timed(stage, 'ran', lambda: stage_step(upstream_df, inputs, horizons, workers),
+                             None if upstream_df is None else len(upstream_df))
+            if stage in materialize:
+                write_start = time.perf_counter()
+                write_stage(df, stage, output_dir, export_csv=export_csv)
+                manifest[stage] = keys[stage]
+                save_manifest(manifest, output_dir)
+                timings[f'{stage} (write)'] = ('written', time.perf_counter() - write_start)
+        frames[stage] = df
+        return df
+
+    for stage in PIPELINE_STAGES:
+        if stage not in materialize:
+            continue
+        if unchanged(stage):
+            timings[stage] = ('unchanged', 0.0)
+            print(f"{stage}: unchanged, skipped")
+        else:
+            frame(stage)
+    timings['total'] = ('', time.perf_counter() - start)
+    return timings
+
+def stream_pipeline(input_dir, output_dir, horizons, materialize=DEFAULT_MATERIALIZE, chunk_size=DEFAULT_CHUNK_SIZE,
+                    export_csv=False, force=False):
+    """Run the pipeline over chunks of the transaction file; output matches run_pipeline
+
+    The split factors and benchmark table are built once; every chunk then
+    passes through the per-row stages and is appended to the materialized
+    stages, and investor metrics are finalized from partial sums merged chunk
+    by chunk. Peak memory is set by the chunk size plus one row of sums per
+    investor. Stages are skipped only when every materialized stage is unchanged.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    inputs = {name: os.path.join(input_dir, filename) for name, filename in INPUT_FILES.items()}
+    start = time.perf_counter()
+    with step('hash_inputs'):
+        keys = stage_keys(inputs, horizons)
+    timings = {'hash inputs': ('hashed', time.perf_counter() - start)}
+    manifest = {} if force else load_manifest(output_dir)
+    if all(manifest.get(stage) == keys[stage] and stage_exists(stage, output_dir) for stage in materialize):
+        for stage in materialize:
+            timings[stage] = ('unchanged', 0.0)
+            print(f"{stage}: unchanged, skipped")
+        timings['total'] = ('', time.perf_counter() - start)
+        return timings
+
+    # The stages are rewritten chunk by chunk, so until the last chunk is in they
+    # must not look complete to a rerun after a crash
+    for stage in materialize:
+        manifest.pop(stage, None)
+    save_manifest(manifest, output_dir)
+
+    split_factors = build_split_factors(pd.read_csv(inputs['splits']))
+    sp500_sectors_df = read_benchmarks(inputs['benchmarks'])
+    benchmark_index = build_benchmark_index(sp500_sectors_df)
+    row_steps = [
+        ('transactions_split_adjusted', lambda df: add_split_adjustments(df, split_factors)),
+        ('transactions_with_returns', lambda df: calculate_returns(df, horizons)),
+        ('transactions_with_market_performance', lambda df: add_benchmark_returns(
+            add_benchmark_levels(df, benchmark_index, horizons), sp500_sectors_df, horizons)),
+        ('transactions_with_returns_and_relatives', lambda df: add_relative_returns(df, horizons)),
+    ]
+    seconds = dict.fromkeys(PIPELINE_STAGES, 0.0)
+    write_seconds = 0.0
+    partials = None
+    rows = 0
+
+    for chunk_number, chunk in enumerate(read_transactions(inputs['transactions'], chunk_size)):
+        for stage, row_step in row_steps:
+            stage_start = time.perf_counter()
+            with step(stage, rows_in=len(chunk)) as info:
+                chunk = row_step(chunk)
+                info['rows_out'] = len(chunk)
+            seconds[stage] += time.perf_counter() - stage_start
+            if stage in materialize:
+                write_start = time.perf_counter()
+                # The first chunk replaces the stage, later ones are appended as new parts
+                if chunk_number == 0:
+                    write_stage(chunk, stage, output_dir)
+                else:
+                    append_stage(chunk, stage, output_dir)
+                write_seconds += time.perf_counter() - write_start
+        if 'investor_weighted_returns' in materialize:
+            stage_start = time.perf_counter()
+            with step('investor_weighted_returns', rows_in=len(chunk)):
+                investor_chunk = prepare_transactions(chunk[investor_aggregation_columns(horizons)].copy())
+                chunk_partials = investor_partial_sums(investor_chunk, horizons)
+                partials = chunk_partials if partials is None else merge_partial_sums(partials, chunk_partials)
+            seconds['investor_weighted_returns'] += time.perf_counter() - stage_start
+        rows += len(chunk)
+        print(f"Chunk {chunk_number + 1}: {rows} transactions processed")
+
+    if partials is not None:
+        stage_start = time.perf_counter()
+        with step('investor_weighted_returns') as info:
+            investor_returns = finalize_investor_metrics(partials, horizons)
+            info['rows_out'] = len(investor_returns)
+        seconds['investor_weighted_returns'] += time.perf_counter() - stage_start
+        write_start = time.perf_counter()
+        write_stage(investor_returns, 'investor_weighted_returns', output_dir)
+        write_seconds += time.perf_counter() - write_start
+
+    for stage in PIPELINE_STAGES:
+        if stage in materialize:
+            if export_csv:
+                export_stage_csv(stage, output_dir)
+            manifest[stage] = keys[stage]
+        if stage != 'investor_weighted_returns' or partials is not None:
+            timings[stage] = ('streamed', seconds[stage])
+    save_manifest(manifest, output_dir)
+    timings['writes'] = ('written', write_seconds)
+    timings['total'] = ('', time.perf_counter() - start)
+    return timings
+
+def parse_materialize(spec):
+    """Stage names from a comma-separated --materialize value ('all' for every stage)"""
+    if spec == 'all':
+        return list(PIPELINE_STAGES)
+    stages = [stage.strip() for stage in spec.split(',') if stage.strip()]
+    unknown = [stage for stage in stages if stage not in PIPELINE_STAGES]
+    if unknown:
+        raise ValueError(f"Unknown stage(s) {', '.join(unknown)} (expected 'all' or any of {', '.join(PIPELINE_STAGES)})")
+    return stages
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run split adjustment, returns, benchmark join, relative returns and investor metrics in one process")
+    parser.add_argument('--input-dir', default=DEFAULT_STORE_DIR,
+                        help="Directory with the transaction, benchmark and split history CSVs")
+    parser.add_argument('--output-dir', help="Stage store to write to (default: --input-dir)")
+    parser.add_argument('--materialize', default=','.join(DEFAULT_MATERIALIZE),
+                        help="Comma-separated stages to write, or 'all' (default: the stages other scripts read)")
+    parser.add_argument('--force', action='store_true', help="Re-run every stage even if its inputs are unchanged")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Number of worker processes for the investor aggregation (default: 1, serial)")
+    parser.add_argument('--stream', action='store_true',
+                        help="Process the transaction file in chunks so memory stays bounded (same output)")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help=f"Transactions per chunk with --stream (default: {DEFAULT_CHUNK_SIZE})")
+    parser.add_argument('--csv', action='store_true', help="Also export materialized stages as CSV")
+    parser.add_argument('--horizons', default='6M,1Y,18M',
+                        help="Comma-separated return horizons, e.g. 1M,3M,6M,1Y,18M,2Y,3Y")
+    parser.add_argument('--report', help="Write a JSON run report (time, CPU, memory, rows and bytes per step) here")
+    parser.add_argument('--profile-step', help="Also sample the Python stacks of this step, e.g. investor_weighted_returns")
+    args = parser.parse_args()
+    horizons = parse_horizons(args.horizons)
+    if args.report:
+        enable(args.profile_step)
+    try:
+        materialize = parse_materialize(args.materialize)
+    except ValueError as error:
+        parser.error(str(error))
+
+    output_dir = args.output_dir or args.input_dir
+    if args.stream:
+        timings = stream_pipeline(args.input_dir, output_dir, horizons, materialize, args.chunk_size,
+                                  args.csv, args.force)
+    else:
+        timings = run_pipeline(args.input_dir, output_dir, horizons, materialize, args.workers, args.csv, args.force)
+
+    print("\nWall time per stage:")
+    for stage, (action, seconds) in timings.items():
+        print(f"  {stage:<50} {action:<10} {seconds:8.2f}s")
+    if args.report:
+        write_report(args.report)
+        print(f"Run report saved to {args.report}")
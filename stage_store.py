@@ -0,0 +1,287 @@
+import os
+import glob
+import re
+import shutil
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from instrumentation import step
+
+DEFAULT_STORE_DIR = r"C:\Users\Riot\OneDrive\Business\SP500_form4_analysis"
+
+# Stages handed between scripts; each is stored as <store_dir>/<stage>.parquet/<version>/part-NNNNN.parquet
+STAGES = [
+    'transactions_split_adjusted',
+    'transactions_with_market_performance',
+    'transactions_with_returns',
+    'transactions_with_returns_and_relatives',
+    'transaction_clusters',
+    'investor_weighted_returns',
+    'investor_weighted_returns_clustered',
+    'investor_significance',
+    'investor_breakdowns',
+    'investor_regime_summary',
+    'return_validation',
+    'transaction_facts',
+    'transaction_owner_links',
+    'transaction_owners',
+]
+
+# Declared column types shared by every stage. Columns not listed here are
+# float64 (prices, values, returns and investor metrics), except *_STATUS codes
+STRING_COLUMNS = [
+    'ACCESSION_NUMBER', 'FILING_DATE', 'PERIOD_OF_REPORT', 'ISSUERNAME', 'ISSUERTRADINGSYMBOL',
+    'GICS_SECTOR', 'GICS_SUB_INDUSTRY', 'OWNER_NAME', 'OWNER_RELATIONSHIP', 'SECURITY_TITLE',
+    'DIRECT_INDIRECT_OWNERSHIP', 'Market_Condition', 'Market_Cap_Category',
+    'Most_Common_Company', 'Most_Active_Sector', 'Most_Common_Company_Cap_Category', 'Preferred_Cap_Category', 'Column', '0',
+]
+INT_COLUMNS = [
+    'ISSUERCIK', 'OWNER_CIK', 'CLUSTER_ID', 'TRANSACTION_COUNT',
+    'Rows', 'Null_Count', 'Out_Of_Range_Count', 'Zero_Count', 'Percent_Scale_Count',
+]
+DATE_COLUMNS = ['TRANS_DATE', 'LAST_TRANS_DATE']
+# Row and dictionary codes of the compact transaction stages (compact_transactions.py)
+CODE_COLUMNS = ['FACT_ID', 'OWNER_CODE']
+
+ROW_GROUP_SIZE = 128_000
+
+# Versioned directories: every rewrite goes to a new vNNNNN directory and a CURRENT
+# file naming it is swapped in with one os.replace, so a reader sees one whole
+# version. The previous version is kept for readers that resolved CURRENT just
+# before the swap; older ones are pruned by the next publish.
+CURRENT_FILE = "CURRENT"
+VERSION_PATTERN = re.compile(r'v(\d{5,})$')
+
+def current_version_dir(root):
+    """Directory of root's current version, or None when root has no CURRENT pointer"""
+    try:
+        with open(os.path.join(root, CURRENT_FILE)) as f:
+            return os.path.join(root, f.read().strip())
+    except FileNotFoundError:
+        return None
+
+def _versions(root):
+    names = os.listdir(root) if os.path.isdir(root) else []
+    return sorted((name for name in names if VERSION_PATTERN.match(name)), key=lambda name: int(name[1:]))
+
+def new_version_dir(root):
+    """Create an empty directory for the next version of root (numbered past any left by an interrupted write)"""
+    versions = _versions(root)
+    path = os.path.join(root, f"v{int(versions[-1][1:]) + 1 if versions else 1:05d}")
+    os.makedirs(path)
+    return path
+
+def publish_version(root, version_dir):
+    """Point root's CURRENT at version_dir, then prune every version but it and the one it replaces
+
+    A version the OS refuses to delete (still memory-mapped on Windows) is left
+    for a later publish to prune.
+    """
+    previous = current_version_dir(root)
+    tmp_path = os.path.join(root, f"{CURRENT_FILE}.{os.getpid()}.tmp")
+    with open(tmp_path, 'w') as f:
+        f.write(os.path.basename(version_dir))
+    os.replace(tmp_path, os.path.join(root, CURRENT_FILE))
+    keep = {os.path.basename(version_dir), os.path.basename(previous or '')}
+    for name in _versions(root):
+        if name not in keep:
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+def read_current(root, read, attempts=3):
+    """read(version_dir) on root's current version, retrying if a publish prunes it mid-read
+
+    version_dir is None when root has no CURRENT pointer.
+    """
+    for attempt in range(attempts):
+        try:
+            return read(current_version_dir(root))
+        except FileNotFoundError:
+            if attempt == attempts - 1:
+                raise
+
+def column_type(column, categorical=False):
+    """Arrow type declared for a stage column; categorical string columns are dictionary-encoded"""
+    if column in STRING_COLUMNS:
+        return pa.dictionary(pa.int32(), pa.string()) if categorical else pa.string()
+    if column in CODE_COLUMNS:
+        return pa.int32()
+    if column in INT_COLUMNS:
+        return pa.int64()
+    if column in DATE_COLUMNS:
+        return pa.timestamp('ns')
+    if column.endswith('_STATUS'):
+        return pa.int8()
+    return pa.float64()
+
+def stage_schema(columns, categorical_columns=()):
+    """Arrow schema for the given stage columns"""
+    return pa.schema([(column, column_type(column, column in categorical_columns)) for column in columns])
+
+def categorical_columns(df):
+    return [column for column in df.columns if isinstance(df[column].dtype, pd.CategoricalDtype)]
+
+def apply_schema(df):
+    """Coerce a DataFrame to the declared column types (used for CSV input)"""
+    df = df.copy()
+    for column in df.columns:
+        if column in STRING_COLUMNS and isinstance(df[column].dtype, pd.CategoricalDtype):
+            # Dictionary-encoded strings stay categorical; only the dictionary is coerced
+            df[column] = df[column].cat.rename_categories(df[column].cat.categories.astype(str))
+        elif column in STRING_COLUMNS:
+            df[column] = df[column].where(df[column].isna(), df[column].astype(str))
+        elif column in DATE_COLUMNS:
+            df[column] = pd.to_datetime(df[column]).dt.tz_localize(None).astype('datetime64[ns]')
+        elif column in CODE_COLUMNS:
+            df[column] = pd.to_numeric(df[column]).astype('int32')
+        elif column in INT_COLUMNS:
+            values = pd.to_numeric(df[column], errors='coerce')
+            df[column] = values.astype('int64' if values.notna().all() else 'Int64')
+        elif column.endswith('_STATUS'):
+            # Missing when a part appended to the stage predates the status column
+            values = pd.to_numeric(df[column], errors='coerce')
+            df[column] = values.astype('int8' if values.notna().all() else 'Int8')
+        else:
+            df[column] = pd.to_numeric(df[column], errors='coerce').astype(float)
+    return df
+
+def stage_path(stage, store_dir):
+    return os.path.join(store_dir, f"{stage}.parquet")
+
+def csv_path(stage, store_dir):
+    return os.path.join(store_dir, f"{stage}.csv")
+
+def stage_version_dir(stage, store_dir):
+    """Directory holding the stage's current parts (the stage directory itself for the older flat layout)"""
+    return current_version_dir(stage_path(stage, store_dir)) or stage_path(stage, store_dir)
+
+def part_files(stage, store_dir):
+    return sorted(glob.glob(os.path.join(stage_version_dir(stage, store_dir), "part-*.parquet")))
+
+def stage_files(stage, store_dir):
+    """Files currently backing a stage: its Parquet parts, or the CSV fallback"""
+    parts = part_files(stage, store_dir)
+    if parts:
+        return parts
+    return [csv_path(stage, store_dir)] if os.path.exists(csv_path(stage, store_dir)) else []
+
+def stage_exists(stage, store_dir):
+    return bool(part_files(stage, store_dir)) or os.path.exists(csv_path(stage, store_dir))
+
+def _write_part(df, path):
+    table = pa.Table.from_pandas(apply_schema(df), schema=stage_schema(df.columns, categorical_columns(df)),
+                                 preserve_index=False)
+    tmp_path = f"{path}.tmp"
+    pq.write_table(table, tmp_path, row_group_size=ROW_GROUP_SIZE)
+    os.replace(tmp_path, path)
+
+def write_stage(df, stage, store_dir, export_csv=False):
+    """Replace a stage with df as typed Parquet; optionally also export it as CSV
+
+    The new part goes to a new version of the stage, so readers see either all
+    of the old parts or only the new one.
+    """
+    path = stage_path(stage, store_dir)
+    os.makedirs(path, exist_ok=True)
+    version_dir = new_version_dir(path)
+    with step(f"write_stage {stage}", rows_in=len(df)):
+        _write_part(df, os.path.join(version_dir, "part-00000.parquet"))
+    publish_version(path, version_dir)
+    # Parts of the older flat layout are superseded by the first version
+    for old_part in glob.glob(os.path.join(path, "part-*.parquet")):
+        try:
+            os.remove(old_part)
+        except OSError:
+            pass
+    if export_csv:
+        export_stage_csv(stage, store_dir)
+    return path
+
+def part_path(stage, store_dir, part_name):
+    return os.path.join(stage_version_dir(stage, store_dir), f"part-{part_name}.parquet")
+
+def append_stage(df, stage, store_dir, part_name=None):
+    """Add df to a stage as a new part file; existing rows are never rewritten
+
+    A named part (part-<part_name>.parquet) is replaced if it already exists,
+    so retrying the same append does not add its rows twice.
+    """
+    path = stage_path(stage, store_dir)
+    os.makedirs(path, exist_ok=True)
+    parts = part_files(stage, store_dir)
+    if parts:
+        # Keep the stage's column layout so every part shares one schema
+        columns = pq.read_schema(parts[0]).names
+        df = df.reindex(columns=columns)
+    with step(f"append_stage {stage}", rows_in=len(df)):
+        _write_part(df, part_path(stage, store_dir, part_name or f"{len(parts):05d}"))
+    return path
+
+def build_filters(owner_ciks=None, date_range=None):
+    """Parquet predicates on OWNER_CIK and TRANS_DATE"""
+    filters = []
+    if owner_ciks is not None:
+        filters.append(('OWNER_CIK', 'in', [int(cik) for cik in owner_ciks]))
+    if date_range is not None:
+        start, end = date_range
+        if start is not None:
+            filters.append(('TRANS_DATE', '>=', pd.Timestamp(start)))
+        if end is not None:
+            filters.append(('TRANS_DATE', '<=', pd.Timestamp(end)))
+    return filters or None
+
+def read_stage(stage, store_dir, columns=None, owner_ciks=None, date_range=None):
+    """Read a stage with column projection and OWNER_CIK / TRANS_DATE predicate pushdown
+
+    Falls back to <stage>.csv (typed with the declared schema) when no Parquet parts exist.
+    """
+    with step(f"read_stage {stage}") as info:
+        df = _read_stage(stage, store_dir, columns, owner_ciks, date_range)
+        info['rows_out'] = len(df)
+    return df
+
+def _read_stage(stage, store_dir, columns, owner_ciks, date_range):
+    path = stage_path(stage, store_dir)
+
+    def read_parts(version_dir):
+        parts = sorted(glob.glob(os.path.join(version_dir or path, "part-*.parquet")))
+        if not parts:
+            return None
+        return pq.read_table(parts, columns=columns, filters=build_filters(owner_ciks, date_range)).to_pandas()
+
+    df = read_current(path, read_parts)
+    if df is not None:
+        return df
+
+    df = pd.read_csv(csv_path(stage, store_dir), usecols=columns)
+    df = apply_schema(df)
+    if owner_ciks is not None:
+        df = df[df['OWNER_CIK'].isin(owner_ciks)]
+    if date_range is not None:
+        start, end = date_range
+        if start is not None:
+            df = df[df['TRANS_DATE'] >= pd.Timestamp(start)]
+        if end is not None:
+            df = df[df['TRANS_DATE'] <= pd.Timestamp(end)]
+    return df.reset_index(drop=True)
+
+def export_stage_csv(stage, store_dir, output_path=None):
+    """Write a stage out as CSV for spreadsheets and the hosted dashboard"""
+    output_path = output_path or csv_path(stage, store_dir)
+    read_stage(stage, store_dir).to_csv(output_path, index=False)
+    return output_path
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Convert between CSV stage files and the Parquet stage store")
+    parser.add_argument('action', choices=['import', 'export'])
+    parser.add_argument('stage', choices=STAGES)
+    parser.add_argument('--store-dir', default=DEFAULT_STORE_DIR)
+    args = parser.parse_args()
+
+    if args.action == 'import':
+        df = pd.read_csv(csv_path(args.stage, args.store_dir))
+        print(f"Wrote {write_stage(df, args.stage, args.store_dir)}")
+    else:
+        print(f"Wrote {export_stage_csv(args.stage, args.store_dir)}")
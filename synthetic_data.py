@@ -0,0 +1,193 @@
+import argparse
+import os
+import numpy as np
+import pandas as pd
+
+from run_pipeline import INPUT_FILES
+
+SECTORS = [
+    'Communication Services', 'Consumer Discretionary', 'Consumer Staples', 'Energy', 'Financials', 'Health Care',
+    'Industrials', 'Information Technology', 'Materials', 'Real Estate', 'Utilities',
+]
+RELATIONSHIPS = ['Director', 'Officer', 'TenPercentOwner', 'Director,Officer', 'Officer,TenPercentOwner', 'Other']
+SECURITY_TITLES = ['Common Stock', 'Class A Common Stock', 'Common Shares']
+SPLIT_RATIOS = [2.0, 3.0, 1.5, 4.0, 0.1]
+# Tickers pandas would read back as missing values
+RESERVED_SYMBOLS = {'NA', 'NAN', 'NULL'}
+
+FIRST_TRANS_DATE = pd.Timestamp('2014-01-01')
+LAST_TRANS_DATE = pd.Timestamp('2023-12-31')
+# The benchmark table covers every transaction date plus the longest horizon
+FIRST_BENCHMARK_DATE = pd.Timestamp('2013-01-01')
+LAST_BENCHMARK_DATE = pd.Timestamp('2025-12-31')
+
+# Rows per investor and per issuer, roughly as in the sample data (mean ~6, median 2 per investor)
+ROWS_PER_INVESTOR = 6
+ROWS_PER_ISSUER = 30
+MAX_ISSUERS = 8000
+# Activity ~ rank ** -INVESTOR_SKEW: a few funds file hundreds of times, most insiders a handful
+INVESTOR_SKEW = 0.8
+ISSUER_SKEW = 0.7
+MISSING_PRICE_RATE = 0.01
+
+def skewed_choice(rng, count, size, skew):
+    """Draw size codes in [0, count) with Zipf-like weights rank ** -skew, shuffled so code order carries no rank"""
+    weights = np.arange(1, count + 1, dtype=float) ** -skew
+    ranks = np.searchsorted(np.cumsum(weights / weights.sum()), rng.random(size), side='right')
+    return rng.permutation(count)[np.minimum(ranks, count - 1)]
+
+def symbol_names(count):
+    """Distinct upper-case tickers: A..Z, then AA.., AAA.. (skipping ones read back as missing)"""
+    names, width, index = [], 1, 0
+    while len(names) < count:
+        if index == 26 ** width:
+            width, index = width + 1, 0
+        letters, value = [], index
+        for _ in range(width):
+            value, letter = divmod(value, 26)
+            letters.append(chr(ord('A') + letter))
+        name = ''.join(reversed(letters))
+        if name not in RESERVED_SYMBOLS:
+            names.append(name)
+        index += 1
+    return np.array(names, dtype=object)
+
+def business_days(start, end):
+    return pd.bdate_range(start, end)
+
+def mdy_strings(dates):
+    """M/D/YYYY strings without zero padding, built from the date parts ('%-m' is glibc-only)"""
+    return (pd.Index(dates.month).astype(str) + '/' + pd.Index(dates.day).astype(str) + '/'
+            + pd.Index(dates.year).astype(str))
+
+def synthetic_benchmarks(seed=0):
+    """S&P 500 and sector levels on every business day as geometric random walks"""
+    rng = np.random.default_rng(seed)
+    dates = business_days(FIRST_BENCHMARK_DATE, LAST_BENCHMARK_DATE)
+    market = np.cumsum(rng.normal(0.0003, 0.011, len(dates)))
+    benchmarks = pd.DataFrame({'Date': mdy_strings(dates), 'S&P 500': 1500 * np.exp(market)})
+    for sector in SECTORS:
+        # Sectors follow the market plus their own drift and noise
+        own = np.cumsum(rng.normal(rng.normal(0, 0.0002), 0.007, len(dates)))
+        benchmarks[sector] = rng.uniform(100, 800) * np.exp(market + own)
+    return benchmarks
+
+def synthetic_issuers(count, rng):
+    """Issuer attributes: CIK, name, ticker, sector, sub-industry, market cap, price level and drift"""
+    sectors = rng.integers(0, len(SECTORS), count)
+    codes = np.arange(count)
+    return pd.DataFrame({
+        'ISSUERCIK': 100000 + codes * 7,
+        'ISSUERNAME': [f"SYNTHETIC ISSUER {code} INC" for code in codes],
+        'ISSUERTRADINGSYMBOL': symbol_names(count),
+        'GICS_SECTOR': np.array(SECTORS, dtype=object)[sectors],
+        'GICS_SUB_INDUSTRY': [f"{SECTORS[sector]} Industry {code % 10}" for code, sector in zip(codes, sectors)],
+        'Market Cap': np.exp(rng.normal(23, 1.5, count)).round(),
+        'price': np.exp(rng.normal(3.5, 1.0, count)),
+        'drift': rng.normal(0.06, 0.15, count),
+        'volatility': rng.uniform(0.15, 0.6, count),
+    })
+
+def synthetic_splits(issuers, seed=0):
+    """Split history for about 5% of issuers, in the stock_splits_history_final.csv layout"""
+    rng = np.random.default_rng(seed + 1)
+    split_issuers = np.flatnonzero(rng.random(len(issuers)) < 0.05)
+    days = rng.integers(0, (LAST_TRANS_DATE - FIRST_TRANS_DATE).days, len(split_issuers))
+    return pd.DataFrame({
+        'Symbol': issuers['ISSUERTRADINGSYMBOL'].to_numpy()[split_issuers],
+        'Date': mdy_strings(FIRST_TRANS_DATE + pd.to_timedelta(days, unit='D')),
+        'Split Ratio': rng.choice(SPLIT_RATIOS, len(split_issuers)),
+    })
+
+def synthetic_transactions(rows, seed=0):
+    """rows transactions in the insider_transactions_with_prices_final.csv layout, plus the issuer table
+
+    Transactions come in filings of one to a few rows sharing owner, issuer and
+    date. Owners and issuers are drawn with Zipf-like skew, so the busiest
+    investors hold a few percent of all rows while most have a handful.
+    Forward prices follow each issuer's drift and volatility; about 1% are missing.
+    """
+    rng = np.random.default_rng(seed)
+    investor_count = max(rows // ROWS_PER_INVESTOR, 10)
+    issuers = synthetic_issuers(int(np.clip(rows // ROWS_PER_ISSUER, 50, MAX_ISSUERS)), rng)
+
+    # Filings of 1-4 rows; every row in a filing shares its owner, issuer and date
+    filing_sizes = np.minimum(rng.geometric(0.55, rows), 4)
+    filing_sizes = filing_sizes[:np.searchsorted(np.cumsum(filing_sizes), rows) + 1]
+    filing_sizes[-1] -= filing_sizes.sum() - rows
+    filing_count = len(filing_sizes)
+    filing_owner = skewed_choice(rng, investor_count, filing_count, INVESTOR_SKEW)
+    # Investors mostly trade their own company: each has a home issuer and sometimes trades another
+    home_issuer = skewed_choice(rng, len(issuers), investor_count, ISSUER_SKEW)
+    other_issuer = skewed_choice(rng, len(issuers), filing_count, ISSUER_SKEW)
+    filing_issuer = np.where(rng.random(filing_count) < 0.8, home_issuer[filing_owner], other_issuer)
+    filing_day = rng.integers(0, (LAST_TRANS_DATE - FIRST_TRANS_DATE).days + 1, filing_count)
+
+    filing = np.repeat(np.arange(filing_count), filing_sizes)
+    owner, issuer, day = filing_owner[filing], filing_issuer[filing], filing_day[filing]
+    trans_dates = FIRST_TRANS_DATE + pd.to_timedelta(day, unit='D')
+    filing_dates = trans_dates + pd.to_timedelta(rng.integers(0, 3, rows), unit='D')
+
+    # Trade price near the issuer's price path on the day; forward prices drift from there
+    years = day / 365.0
+    price_level = issuers['price'].to_numpy()[issuer] * np.exp(issuers['drift'].to_numpy()[issuer] * years)
+    price = (price_level * np.exp(rng.normal(0, 0.02, rows))).round(2)
+    shares = np.ceil(np.exp(rng.normal(7.5, 1.8, rows)))
+
+    df = pd.DataFrame({
+        'ACCESSION_NUMBER': pd.Series(filing_owner % 10_000_000_000).astype(str).str.zfill(10).to_numpy()[filing] + '-'
+                            + pd.Series(trans_dates.year % 100).astype(str).str.zfill(2).to_numpy() + '-'
+                            + pd.Series(filing % 1_000_000).astype(str).str.zfill(6).to_numpy(),
+        'FILING_DATE': day_strings(filing_dates),
+        'PERIOD_OF_REPORT': day_strings(trans_dates),
+    })
+    for col in ['ISSUERCIK', 'ISSUERNAME', 'ISSUERTRADINGSYMBOL', 'GICS_SECTOR', 'GICS_SUB_INDUSTRY']:
+        df[col] = issuers[col].to_numpy()[issuer]
+    owner_ciks = 1_000_000 + owner * 3
+    df['OWNER_CIK'] = owner_ciks
+    df['OWNER_NAME'] = pd.Categorical.from_codes(owner, [f"SYNTHETIC OWNER {code}" for code in range(investor_count)]).astype(object)
+    df['OWNER_RELATIONSHIP'] = np.array(RELATIONSHIPS, dtype=object)[owner % len(RELATIONSHIPS)]
+    df['SECURITY_TITLE'] = np.array(SECURITY_TITLES, dtype=object)[rng.choice(len(SECURITY_TITLES), rows, p=[0.9, 0.07, 0.03])]
+    # Timezone-aware ISO timestamps, like the price fetcher writes
+    df['TRANS_DATE'] = trans_dates.tz_localize('UTC')
+    df['TRANS_SHARES'] = shares
+    df['TRANS_PRICEPERSHARE'] = price
+    df['DIRECT_INDIRECT_OWNERSHIP'] = np.where(rng.random(rows) < 0.8, 'D', 'I').astype(object)
+    df['SHARES_OWNED_FOLLOWING_TRANSACTION'] = shares + np.ceil(np.exp(rng.normal(10, 2, rows)))
+
+    drift = issuers['drift'].to_numpy()[issuer]
+    volatility = issuers['volatility'].to_numpy()[issuer]
+    for column, horizon_years in [('6 Month Price', 0.5), ('1 Year Price', 1.0), ('18 Month Price', 1.5)]:
+        forward = price_level * np.exp(rng.normal(drift * horizon_years, volatility * np.sqrt(horizon_years)))
+        forward[rng.random(rows) < MISSING_PRICE_RATE] = np.nan
+        # Prices after the last transaction date are not known yet
+        forward[years + horizon_years > (LAST_TRANS_DATE - FIRST_TRANS_DATE).days / 365.0] = np.nan
+        df[column] = forward
+    df['Market Cap'] = issuers['Market Cap'].to_numpy()[issuer]
+    return df, issuers
+
+def day_strings(dates):
+    """M/D/YYYY strings like the SEC exports, formatted once per distinct day"""
+    days, positions = np.unique(dates.to_numpy(dtype='datetime64[D]'), return_inverse=True)
+    return mdy_strings(pd.DatetimeIndex(days)).to_numpy(dtype=object)[positions]
+
+def write_synthetic_inputs(output_dir, rows, seed=0):
+    """Write the transaction, benchmark and split history CSVs that run_pipeline.py reads"""
+    os.makedirs(output_dir, exist_ok=True)
+    transactions, issuers = synthetic_transactions(rows, seed)
+    transactions.to_csv(os.path.join(output_dir, INPUT_FILES['transactions']), index=False)
+    synthetic_benchmarks(seed).to_csv(os.path.join(output_dir, INPUT_FILES['benchmarks']), index=False)
+    synthetic_splits(issuers, seed).to_csv(os.path.join(output_dir, INPUT_FILES['splits']), index=False)
+    return transactions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write seeded synthetic pipeline inputs for benchmarking")
+    parser.add_argument('output_dir')
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    transactions = write_synthetic_inputs(args.output_dir, args.rows, args.seed)
+    per_investor = transactions.groupby('OWNER_CIK').size()
+    print(f"Wrote {len(transactions)} transactions for {len(per_investor)} investors to {args.output_dir} "
+          f"(rows per investor: median {per_investor.median():.0f}, max {per_investor.max()})")
@@ -0,0 +1,138 @@
+import asyncio
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import price_fetcher
+from price_fetcher import CannedPriceServer, fetch_price_history, load_cache, plan_requests, save_cache
+
+SYMBOLS = ['AAA', 'BBB', 'CCC']
+
+@pytest.fixture
+def prices():
+    days = pd.bdate_range('2019-01-01', '2021-12-31')
+    return pd.DataFrame({
+        'Symbol': np.repeat(SYMBOLS, len(days)),
+        'Date': np.tile(days, len(SYMBOLS)),
+        'Close': np.arange(len(SYMBOLS) * len(days), dtype=float) / 10 + 1,
+    })
+
+@pytest.fixture
+def transactions():
+    # Several dates per symbol and repeated (symbol, date) rows, as in joint filings
+    return pd.DataFrame({
+        'ISSUERTRADINGSYMBOL': ['AAA', 'AAA', 'AAA', 'BBB', 'BBB', 'CCC', 'CCC'],
+        'TRANS_DATE': ['2019-03-04', '2019-03-04', '2019-09-10', '2019-05-01', '2019-05-01', '2019-07-15', '2019-08-01'],
+    })
+
+def fetch(transactions, server, cache_path, **options):
+    options = {'concurrency': 4, 'rate_per_second': 0, 'backoff': 0.01, **options}
+    return fetch_price_history(transactions, server.url_template, str(cache_path), **options)
+
+def test_one_request_per_symbol_range(prices, transactions, tmp_path):
+    requests = plan_requests(transactions)
+    assert sorted(requests) == SYMBOLS
+    assert requests['AAA'][0] < '2019-03-04' and requests['AAA'][1] > '2019-09-10'
+
+    with CannedPriceServer(prices) as server:
+        fetched, stats = fetch(transactions, server, tmp_path / 'cache.json')
+        assert server.request_count == len(SYMBOLS)
+    assert stats == {'requested': 3, 'cached': 0, 'fetched': 3, 'failed': []}
+    assert sorted(fetched['Symbol'].unique()) == SYMBOLS
+
+def test_retries_transient_failures(prices, transactions, tmp_path):
+    with CannedPriceServer(prices, fail_first=4) as server:
+        fetched, stats = fetch(transactions, server, tmp_path / 'cache.json', retries=3)
+        assert server.request_count == len(SYMBOLS) + 4
+    assert stats['fetched'] == len(SYMBOLS) and stats['failed'] == []
+
+    with CannedPriceServer(prices, fail_first=100) as server:
+        _, stats = fetch(transactions, server, tmp_path / 'other.json', retries=1)
+        # Every symbol gives up after its first attempt and one retry
+        assert server.request_count == 2 * len(SYMBOLS)
+    assert sorted(stats['failed']) == SYMBOLS
+
+def test_unknown_symbol_is_not_retried(prices, tmp_path):
+    transactions = pd.DataFrame({'ISSUERTRADINGSYMBOL': ['NOPE'], 'TRANS_DATE': ['2020-01-02']})
+    with CannedPriceServer(prices) as server:
+        fetched, stats = fetch(transactions, server, tmp_path / 'cache.json')
+        assert server.request_count == 1
+    assert stats['failed'] == [] and len(fetched) == 0
+
+def test_rerun_makes_no_requests(prices, transactions, tmp_path):
+    cache_path = tmp_path / 'cache.json'
+    with CannedPriceServer(prices) as server:
+        first, _ = fetch(transactions, server, cache_path)
+        count = server.request_count
+        second, stats = fetch(transactions, server, cache_path)
+        assert server.request_count == count
+    assert stats['cached'] == len(SYMBOLS) and stats['fetched'] == 0
+    pd.testing.assert_frame_equal(second, first)
+
+def test_cache_write_is_atomic(prices, transactions, tmp_path, monkeypatch):
+    cache_path = tmp_path / 'cache.json'
+    with CannedPriceServer(prices) as server:
+        fetch(transactions, server, cache_path)
+    assert os.listdir(tmp_path) == ['cache.json']
+    saved = load_cache(str(cache_path))
+
+    # A write that dies part way leaves the previous cache in place
+    def failing_dump(cache, f):
+        f.write('{"AAA": ')
+        raise OSError("disk full")
+    monkeypatch.setattr(price_fetcher.json, 'dump', failing_dump)
+    with pytest.raises(OSError):
+        save_cache({'DDD': {}}, str(cache_path))
+    with open(cache_path) as f:
+        assert json.load(f) == saved
+
+def test_client_errors_are_not_cached(prices, transactions, tmp_path):
+    cache_path = tmp_path / 'cache.json'
+    with CannedPriceServer(prices, fail_first=1, fail_status=403) as server:
+        _, stats = fetch(transactions, server, cache_path)
+        # A 403 is not retried, and the symbol is fetched again on the next run
+        assert server.request_count == len(SYMBOLS)
+        assert len(stats['failed']) == 1
+        _, stats = fetch(transactions, server, cache_path)
+        assert server.request_count == len(SYMBOLS) + 1
+    assert stats['cached'] == len(SYMBOLS) - 1 and stats['failed'] == []
+
+def test_interrupted_run_keeps_fetched_symbols(prices, transactions, tmp_path, monkeypatch):
+    cache_path = tmp_path / 'cache.json'
+    fetch_symbol = price_fetcher.fetch_symbol
+
+    class Interrupted(BaseException):
+        pass
+
+    # Stands in for Ctrl-C or a kill while CCC is still in flight
+    async def interrupted(symbol, *args, **kwargs):
+        if symbol == 'CCC':
+            await asyncio.sleep(0.2)
+            raise Interrupted
+        return await fetch_symbol(symbol, *args, **kwargs)
+    monkeypatch.setattr(price_fetcher, 'fetch_symbol', interrupted)
+    with CannedPriceServer(prices) as server:
+        with pytest.raises(Interrupted):
+            fetch(transactions, server, cache_path)
+    assert sorted(load_cache(str(cache_path))) == ['AAA', 'BBB']
+
+    monkeypatch.setattr(price_fetcher, 'fetch_symbol', fetch_symbol)
+    with CannedPriceServer(prices) as server:
+        _, stats = fetch(transactions, server, cache_path)
+        assert server.request_count == 1
+    assert stats['cached'] == 2 and stats['fetched'] == 1
+
+def test_cache_saved_while_fetching(prices, transactions, tmp_path, monkeypatch):
+    # A hard kill skips the final save, so fetched symbols are also saved along the way
+    saved = []
+    save_cache = price_fetcher.save_cache
+    def recording_save(cache, cache_path):
+        saved.append(sorted(cache))
+        save_cache(cache, cache_path)
+    monkeypatch.setattr(price_fetcher, 'save_cache', recording_save)
+    with CannedPriceServer(prices) as server:
+        fetch(transactions, server, tmp_path / 'cache.json', save_every=1)
+    assert [len(symbols) for symbols in saved] == [1, 2, 3, 3]
@@ -0,0 +1,118 @@
+import argparse
+import numpy as np
+import pandas as pd
+
+from horizons import DEFAULT_HORIZONS, horizon_labels, parse_horizons, price_column
+from stage_store import DEFAULT_STORE_DIR, read_stage, write_stage
+
+# A new cluster starts when the gap to the owner's previous trade in the same symbol exceeds this
+CLUSTER_GAP_DAYS = 30
+CLUSTER_KEYS = ['OWNER_CIK', 'ISSUERTRADINGSYMBOL']
+VALUE_COLUMN = 'ADJUSTED_TOTAL_TRANS_VALUE'
+
+# Descriptive columns taken from the first trade of each cluster
+FIRST_COLUMNS = ['OWNER_NAME', 'ISSUERNAME', 'GICS_SECTOR', 'GICS_SUB_INDUSTRY', 'Market Cap']
+
+def weighted_return_columns(labels):
+    """Per-trade return columns that are value-weighted into cluster returns"""
+    prefixes = ['RETURN', 'SP500_RETURN', 'SECTOR_RETURN', 'Vs_SP500', 'Vs_Sector']
+    return [f'{prefix}_{label}' for prefix in prefixes for label in labels]
+
+def cluster_order(df, gap_days=CLUSTER_GAP_DAYS):
+    """Row positions in (OWNER_CIK, symbol, date) order and the cluster id of each of them
+
+    A cluster breaks at a new (owner, symbol) pair, a missing date, or a gap of
+    more than gap_days to the previous trade.
+    """
+    ordered = df[CLUSTER_KEYS + ['TRANS_DATE']].reset_index(drop=True)
+    ordered = ordered.sort_values(CLUSTER_KEYS + ['TRANS_DATE'], kind='mergesort')
+    same_key = np.ones(len(ordered), dtype=bool)
+    for col in CLUSTER_KEYS:
+        values = ordered[col].to_numpy()
+        same_key[1:] &= values[1:] == values[:-1]
+    dates = ordered['TRANS_DATE'].to_numpy(dtype='datetime64[ns]')
+    within_gap = np.zeros(len(ordered), dtype=bool)
+    # NaT gaps compare False, so undated trades always start their own cluster
+    within_gap[1:] = (dates[1:] - dates[:-1]) <= np.timedelta64(gap_days, 'D')
+    if len(ordered):
+        same_key[0] = False
+    return ordered.index.to_numpy(), np.cumsum(~(same_key & within_gap)) - 1
+
+def assign_clusters(df, gap_days=CLUSTER_GAP_DAYS):
+    """Cluster id for every row of df, numbered in (OWNER_CIK, symbol, date) order"""
+    positions, cluster_ids = cluster_order(df, gap_days)
+    assigned = np.empty(len(df), dtype=np.int64)
+    assigned[positions] = cluster_ids
+    return pd.Series(assigned, index=df.index)
+
+def build_clusters(df, horizons=DEFAULT_HORIZONS, gap_days=CLUSTER_GAP_DAYS):
+    """Collapse trades into gap-based clusters with summed size and value-weighted returns
+
+    Returns are weighted by ADJUSTED_TOTAL_TRANS_VALUE over the trades that have
+    the return; clusters without a positive value weight their trades equally.
+    Forward prices are the last trade's, as in the old monthly view.
+    """
+    labels = horizon_labels(horizons)
+    # Only the columns being aggregated are gathered into cluster order
+    positions, cluster_ids = cluster_order(df, gap_days)
+    starts = np.flatnonzero(np.r_[True, cluster_ids[1:] != cluster_ids[:-1]]) if len(df) else positions[:0]
+    ends = np.r_[starts[1:], len(df)].astype(int)
+
+    def ordered(col):
+        return df[col].to_numpy(dtype=float)[positions]
+
+    def cluster_sums(values):
+        values = np.nan_to_num(values)
+        return np.add.reduceat(values, starts, axis=0) if len(df) else values[:0]
+
+    first_rows, last_rows = positions[starts], positions[ends - 1]
+    clusters = pd.DataFrame({'CLUSTER_ID': cluster_ids[starts]})
+    for col in ['OWNER_CIK'] + [col for col in FIRST_COLUMNS if col in df.columns] + ['ISSUERTRADINGSYMBOL']:
+        clusters[col] = df[col].iloc[first_rows].array
+    clusters['TRANS_DATE'] = df['TRANS_DATE'].iloc[first_rows].array
+    clusters['LAST_TRANS_DATE'] = df['TRANS_DATE'].iloc[last_rows].array
+    clusters['TRANSACTION_COUNT'] = ends - starts
+
+    shares = cluster_sums(ordered('ADJUSTED_TRANS_SHARES'))
+    value = ordered(VALUE_COLUMN)
+    clusters['ADJUSTED_TRANS_SHARES'] = shares
+    clusters[VALUE_COLUMN] = cluster_sums(value)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        clusters['ADJUSTED_TRANS_PRICEPERSHARE'] = clusters[VALUE_COLUMN] / shares
+
+    for label in labels:
+        if price_column(label) in df.columns:
+            clusters[price_column(label)] = df[price_column(label)].iloc[last_rows].array
+
+    # All return columns are weighted in one pass over a trades x columns array
+    return_cols = [col for col in weighted_return_columns(labels) if col in df.columns]
+    weights = np.where(value > 0, value, 0.0)
+    no_weight = cluster_sums(weights) == 0
+    weights = np.where(np.repeat(no_weight, ends - starts), 1.0, weights)
+    returns = df[return_cols].to_numpy(dtype=float)[positions]
+    has_return = ~np.isnan(returns)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        weighted_sums = cluster_sums(np.where(has_return, returns * weights[:, None], 0.0))
+        weight_totals = cluster_sums(has_return * weights[:, None])
+        cluster_returns = np.where(weight_totals > 0, weighted_sums / weight_totals, np.nan)
+    for i, col in enumerate(return_cols):
+        clusters[col] = cluster_returns[:, i]
+    return clusters
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Group each owner's trades in a symbol into gap-based clusters")
+    parser.add_argument('--store-dir', default=DEFAULT_STORE_DIR)
+    parser.add_argument('--csv', action='store_true', help="Also export the stage as CSV")
+    parser.add_argument('--gap-days', type=int, default=CLUSTER_GAP_DAYS,
+                        help="Start a new cluster after a gap of more than this many days")
+    parser.add_argument('--horizons', default='6M,1Y,18M',
+                        help="Comma-separated return horizons, e.g. 1M,3M,6M,1Y,18M,2Y,3Y")
+    args = parser.parse_args()
+    horizons = parse_horizons(args.horizons)
+
+    df = read_stage('transactions_with_returns_and_relatives', args.store_dir)
+    clusters = build_clusters(df, horizons, args.gap_days)
+    print(f"Grouped {len(df)} transactions into {len(clusters)} clusters ({args.gap_days}-day gap)")
+
+    output_path = write_stage(clusters, 'transaction_clusters', args.store_dir, export_csv=args.csv)
+    print(f"Output saved to {output_path}")
@@ -1,79 +1,170 @@
+import argparse
+import os
 import pandas as pd
+import numpy as np
 from datetime import datetime, timedelta
-from tqdm import tqdm  # For progress bar
 
-print("Starting data processing...")
+from horizons import DEFAULT_HORIZONS, horizon_labels, parse_horizons
+from instrumentation import step
+from stage_store import DEFAULT_STORE_DIR, write_stage
 
-# Read the CSV files
-transactions_df = pd.read_csv(r"C:\Users\Riot\OneDrive\Business\SP500_form4_analysis\insider_transactions_with_prices_final.csv")
-sp500_sectors_df = pd.read_csv(r"C:\Users\Riot\OneDrive\Business\SP500_form4_analysis\S_P_500_and_Sectors_Ten_Yr_Performance.csv")
+def benchmark_periods(horizons):
+    """Benchmark offsets (column suffix, days after the transaction date), starting with the transaction date itself"""
+    return [('', 0)] + [(f'_{label}', days) for label, days in horizons]
 
-# Convert date columns to datetime, ensuring they're timezone-naive
-transactions_df['TRANS_DATE'] = pd.to_datetime(transactions_df['TRANS_DATE']).dt.tz_localize(None)
-sp500_sectors_df['Date'] = pd.to_datetime(sp500_sectors_df['Date']).dt.tz_localize(None)
+periods = benchmark_periods(DEFAULT_HORIZONS)
 
-def get_closest_date_value(target_date, sp500_df, column_name):
-    if hasattr(target_date, 'tz'):
-        target_date = target_date.tz_localize(None)
-    closest_date = sp500_df['Date'].iloc[(sp500_df['Date'] - target_date).abs().argsort()[0]]
-    return sp500_df.loc[sp500_df['Date'] == closest_date, column_name].iloc[0]
+# Status codes stored in the {column}_STATUS column next to every benchmark return
+RETURN_STATUS_OK = 0
+RETURN_STATUS_FUTURE_UNAVAILABLE = 1
+RETURN_STATUS_HISTORICAL_UNAVAILABLE = 2
+RETURN_STATUS_NO_CHANGE = 3
 
-# Initialize new columns for SP500 and sector performance
-periods = [('', 0), ('_6M', 180), ('_1Y', 365), ('_18M', 547)]
+RETURN_STATUS_LABELS = {
+    RETURN_STATUS_OK: 'OK',
+    RETURN_STATUS_FUTURE_UNAVAILABLE: 'Future data not available',
+    RETURN_STATUS_HISTORICAL_UNAVAILABLE: 'Historical data not available',
+    RETURN_STATUS_NO_CHANGE: 'No price change',
+}
 
-print("Processing market data...")
-# Use tqdm for progress tracking
-for period_suffix, days_offset in tqdm(periods, desc="Processing time periods"):
-    # Add SP500 columns
-    transactions_df[f'SP500{period_suffix}'] = transactions_df['TRANS_DATE'].apply(
-        lambda x: get_closest_date_value(x + timedelta(days=days_offset), sp500_sectors_df, 'S&P 500')
-    )
-    
-    # Add sector-specific columns
-    transactions_df[f'SECTOR{period_suffix}'] = transactions_df.apply(
-        lambda row: get_closest_date_value(
-            row['TRANS_DATE'] + timedelta(days=days_offset), 
-            sp500_sectors_df, 
-            row['GICS_SECTOR']
-        ),
-        axis=1
-    )
+def build_benchmark_index(sp500_sectors_df):
+    """Sort the benchmark table once and expose it as a dates array plus a dates x columns matrix"""
+    benchmark = sp500_sectors_df.sort_values('Date', kind='mergesort')
+    # Keep the first row for any repeated date, like the old equality lookup did
+    benchmark = benchmark.drop_duplicates('Date', keep='first')
+    columns = [col for col in benchmark.columns if col != 'Date']
+    return {
+        'dates': benchmark['Date'].to_numpy(dtype='datetime64[ns]'),
+        'columns': columns,
+        'column_positions': {col: i for i, col in enumerate(columns)},
+        'values': benchmark[columns].to_numpy(dtype=float),
+    }
 
-print("Calculating returns...")
-# Calculate returns and embed context for zero returns
-for period_suffix, days in periods[1:]:  # Skip the initial period
-    # Calculate SP500 returns
-    transactions_df[f'SP500_RETURN{period_suffix}'] = transactions_df.apply(
-        lambda row: (
-            (row[f'SP500{period_suffix}'] / row['SP500'] - 1)
-            if (row['TRANS_DATE'] + timedelta(days=days) <= sp500_sectors_df['Date'].max() and 
-                row['TRANS_DATE'] >= sp500_sectors_df['Date'].min())
-            else 'Future data not available'
-            if row['TRANS_DATE'] + timedelta(days=days) > sp500_sectors_df['Date'].max()
-            else 'Historical data not available'
-            if row['TRANS_DATE'] < sp500_sectors_df['Date'].min()
-            else 'No price change'
-        ),
-        axis=1
-    )
-    
-    # Calculate sector returns
-    transactions_df[f'SECTOR_RETURN{period_suffix}'] = transactions_df.apply(
-        lambda row: (
-            (row[f'SECTOR{period_suffix}'] / row['SECTOR'] - 1)
-            if (row['TRANS_DATE'] + timedelta(days=days) <= sp500_sectors_df['Date'].max() and 
-                row['TRANS_DATE'] >= sp500_sectors_df['Date'].min())
-            else 'Future data not available'
-            if row['TRANS_DATE'] + timedelta(days=days) > sp500_sectors_df['Date'].max()
-            else 'Historical data not available'
-            if row['TRANS_DATE'] < sp500_sectors_df['Date'].min()
-            else 'No price change'
-        ),
-        axis=1
+def nearest_date_positions(sorted_dates, target_dates):
+    """Return the position of the closest benchmark date for every target date (ties go to the earlier date)"""
+    target_dates = np.asarray(target_dates, dtype='datetime64[ns]')
+    if len(sorted_dates) == 1:
+        return np.zeros(target_dates.shape, dtype=np.intp)
+    right = np.searchsorted(sorted_dates, target_dates, side='left')
+    right = np.clip(right, 1, len(sorted_dates) - 1)
+    left = right - 1
+    use_left = (target_dates - sorted_dates[left]) <= (sorted_dates[right] - target_dates)
+    return np.where(use_left, left, right)
+
+def lookup_benchmark_values(benchmark_index, trans_dates, sectors, offsets):
+    """Look up S&P 500 and sector levels for every transaction and offset in one batched pass"""
+    trans_dates = np.asarray(trans_dates, dtype='datetime64[ns]')
+    offsets = np.asarray(offsets, dtype='timedelta64[D]').astype('timedelta64[ns]')
+
+    # transactions x offsets matrix of target dates, resolved with a single binary search
+    targets = trans_dates[:, None] + offsets[None, :]
+    positions = nearest_date_positions(benchmark_index['dates'], targets.ravel()).reshape(targets.shape)
+    missing_date = np.isnat(targets)
+
+    values = benchmark_index['values']
+    sp500 = values[positions, benchmark_index['column_positions']['S&P 500']]
+
+    # Gather sector levels from the dates x sectors matrix using per-row column codes
+    sector_codes = pd.Series(sectors).map(benchmark_index['column_positions'])
+    missing_sector = sector_codes.isna().to_numpy()
+    sector_codes = sector_codes.fillna(0).to_numpy(dtype=np.intp)
+    sector = values[positions, sector_codes[:, None]]
+
+    sp500[missing_date] = np.nan
+    sector[missing_date | missing_sector[:, None]] = np.nan
+    return sp500, sector
+
+def add_benchmark_levels(transactions_df, benchmark_index, horizons=DEFAULT_HORIZONS):
+    """Add SP500{suffix} and SECTOR{suffix} columns for the transaction date and every horizon"""
+    horizon_periods = benchmark_periods(horizons)
+    sp500, sector = lookup_benchmark_values(
+        benchmark_index,
+        transactions_df['TRANS_DATE'],
+        transactions_df['GICS_SECTOR'],
+        [days_offset for _, days_offset in horizon_periods]
     )
+    for i, (period_suffix, _) in enumerate(horizon_periods):
+        transactions_df[f'SP500{period_suffix}'] = sp500[:, i]
+        transactions_df[f'SECTOR{period_suffix}'] = sector[:, i]
+    return transactions_df
+
+def add_benchmark_returns(transactions_df, sp500_sectors_df, horizons=DEFAULT_HORIZONS):
+    """Calculate float64 benchmark returns plus an int8 status column for every horizon
+
+    Returns and statuses are computed as transactions x horizons arrays, so adding
+    horizons adds columns rather than passes over the data.
+    """
+    # Availability bounds are computed once instead of per row
+    first_date = np.datetime64(sp500_sectors_df['Date'].min(), 'ns')
+    last_date = np.datetime64(sp500_sectors_df['Date'].max(), 'ns')
+    trans_dates = transactions_df['TRANS_DATE'].to_numpy(dtype='datetime64[ns]')
+    suffixes = [f'_{label}' for label in horizon_labels(horizons)]
+    offsets = np.array([days for _, days in horizons], dtype='timedelta64[D]').astype('timedelta64[ns]')
+
+    future_unavailable = trans_dates[:, None] + offsets[None, :] > last_date
+    historical_unavailable = (trans_dates < first_date)[:, None] & ~future_unavailable
+    available = ~(future_unavailable | historical_unavailable)
+
+    results = {}
+    for prefix in ['SP500', 'SECTOR']:
+        levels = transactions_df[[f'{prefix}{suffix}' for suffix in suffixes]].to_numpy(dtype=float)
+        returns = levels / transactions_df[prefix].to_numpy(dtype=float)[:, None] - 1
+        status = np.full(returns.shape, RETURN_STATUS_OK, dtype=np.int8)
+        status[available & (returns == 0)] = RETURN_STATUS_NO_CHANGE
+        status[future_unavailable] = RETURN_STATUS_FUTURE_UNAVAILABLE
+        status[historical_unavailable] = RETURN_STATUS_HISTORICAL_UNAVAILABLE
+        returns[~available] = np.nan
+        results[prefix] = returns, status
+
+    for i, period_suffix in enumerate(suffixes):
+        for prefix in ['SP500', 'SECTOR']:
+            returns, status = results[prefix]
+            transactions_df[f'{prefix}_RETURN{period_suffix}'] = returns[:, i]
+            transactions_df[f'{prefix}_RETURN{period_suffix}_STATUS'] = status[:, i]
+    return transactions_df
+
+def add_relative_returns(transactions_df, horizons=DEFAULT_HORIZONS):
+    """Add Vs_SP500{suffix} and Vs_Sector{suffix} stock-minus-benchmark returns (needs RETURN{suffix})"""
+    suffixes = [f'_{label}' for label in horizon_labels(horizons)]
+    stock_returns = transactions_df[[f'RETURN{suffix}' for suffix in suffixes]].to_numpy(dtype=float)
+    vs_sp500 = stock_returns - transactions_df[[f'SP500_RETURN{suffix}' for suffix in suffixes]].to_numpy(dtype=float)
+    vs_sector = stock_returns - transactions_df[[f'SECTOR_RETURN{suffix}' for suffix in suffixes]].to_numpy(dtype=float)
+    for i, period_suffix in enumerate(suffixes):
+        transactions_df[f'Vs_SP500{period_suffix}'] = vs_sp500[:, i]
+        transactions_df[f'Vs_Sector{period_suffix}'] = vs_sector[:, i]
+    return transactions_df
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Add S&P 500 and sector benchmark levels and returns")
+    parser.add_argument('--store-dir', default=DEFAULT_STORE_DIR)
+    parser.add_argument('--csv', action='store_true', help="Also export the stage as CSV")
+    parser.add_argument('--horizons', default='6M,1Y,18M',
+                        help="Comma-separated return horizons, e.g. 1M,3M,6M,1Y,18M,2Y,3Y")
+    args = parser.parse_args()
+    horizons = parse_horizons(args.horizons)
+
+    print("Starting data processing...")
+
+    # Read the CSV files
+    with step('read_csv') as info:
+        transactions_df = pd.read_csv(os.path.join(args.store_dir, "insider_transactions_with_prices_final.csv"))
+        sp500_sectors_df = pd.read_csv(os.path.join(args.store_dir, "S_P_500_and_Sectors_Ten_Yr_Performance.csv"))
+
+        # Convert date columns to datetime, ensuring they're timezone-naive
+        transactions_df['TRANS_DATE'] = pd.to_datetime(transactions_df['TRANS_DATE']).dt.tz_localize(None)
+        sp500_sectors_df['Date'] = pd.to_datetime(sp500_sectors_df['Date']).dt.tz_localize(None)
+        info['rows_out'] = len(transactions_df)
+
+    print("Processing market data...")
+    with step('benchmark_levels', rows_in=len(transactions_df)):
+        benchmark_index = build_benchmark_index(sp500_sectors_df)
+        transactions_df = add_benchmark_levels(transactions_df, benchmark_index, horizons)
+
+    print("Calculating returns...")
+    with step('benchmark_returns', rows_in=len(transactions_df)):
+        transactions_df = add_benchmark_returns(transactions_df, sp500_sectors_df, horizons)
 
-# Save the results
-output_path = r"C:\Users\Riot\OneDrive\Business\SP500_form4_analysis\transactions_with_market_performance.csv"
-transactions_df.to_csv(output_path, index=False)
+    # Save the results
+    output_path = write_stage(transactions_df, 'transactions_with_market_performance', args.store_dir, export_csv=args.csv)
 
-print(f"\nProcess complete! Output file saved to:\n{output_path}")
+    print(f"\nProcess complete! Output file saved to:\n{output_path}")
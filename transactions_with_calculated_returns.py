@@ -1,56 +1,89 @@
+import argparse
+import numpy as np
 import pandas as pd
 
-# Read the CSV file
-df = pd.read_csv(r"C:\Users\Riot\OneDrive\Business\SP500_form4_analysis\transactions_split_adjusted.csv")
+from horizons import DEFAULT_HORIZONS, horizon_labels, parse_horizons, price_column, forward_price_columns
+from instrumentation import step
+from price_store import PriceStore, add_forward_prices
+from stage_store import DEFAULT_STORE_DIR, read_stage, write_stage
 
-# Convert price columns to numeric, handling any non-numeric values as NaN
-df['6 Month Price'] = pd.to_numeric(df['6 Month Price'], errors='coerce')
-df['1 Year Price'] = pd.to_numeric(df['1 Year Price'], errors='coerce')
-df['18 Month Price'] = pd.to_numeric(df['18 Month Price'], errors='coerce')
-df['ADJUSTED_TRANS_PRICEPERSHARE'] = pd.to_numeric(df['ADJUSTED_TRANS_PRICEPERSHARE'], errors='coerce')
+def calculate_returns(df, horizons=DEFAULT_HORIZONS):
+    """Add total transaction values and a stock return per horizon to split-adjusted transactions
 
-# Calculate total transaction values
-df['TOTAL_TRANS_VALUE'] = df['TRANS_SHARES'] * df['TRANS_PRICEPERSHARE']
-df['ADJUSTED_TOTAL_TRANS_VALUE'] = df['ADJUSTED_TRANS_SHARES'] * df['ADJUSTED_TRANS_PRICEPERSHARE']
+    Every horizon needs its forward price column (e.g. '2 Year Price'); horizons
+    without one get NaN returns until the column is filled from the price store.
+    """
+    labels = horizon_labels(horizons)
+    price_cols = [price_column(label) for label in labels]
+    return_cols = [f'RETURN_{label}' for label in labels]
+    missing = [col for col in price_cols if col not in df.columns]
+    if missing:
+        print(f"Warning: no {', '.join(missing)} column; those returns will be empty (fill them with price_store.py)")
+        for col in missing:
+            df[col] = float('nan')
 
-# Calculate stock returns at different intervals
-df['RETURN_6M'] = (df['6 Month Price'] - df['ADJUSTED_TRANS_PRICEPERSHARE']) / df['ADJUSTED_TRANS_PRICEPERSHARE']
+    # Convert price columns to numeric, handling any non-numeric values as NaN
+    for col in price_cols:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    df['ADJUSTED_TRANS_PRICEPERSHARE'] = pd.to_numeric(df['ADJUSTED_TRANS_PRICEPERSHARE'], errors='coerce')
 
-df['RETURN_1Y'] = (df['1 Year Price'] - df['ADJUSTED_TRANS_PRICEPERSHARE']) / df['ADJUSTED_TRANS_PRICEPERSHARE']
+    # Calculate total transaction values
+    df['TOTAL_TRANS_VALUE'] = df['TRANS_SHARES'] * df['TRANS_PRICEPERSHARE']
+    df['ADJUSTED_TOTAL_TRANS_VALUE'] = df['ADJUSTED_TRANS_SHARES'] * df['ADJUSTED_TRANS_PRICEPERSHARE']
 
-df['RETURN_18M'] = (df['18 Month Price'] - df['ADJUSTED_TRANS_PRICEPERSHARE']) / df['ADJUSTED_TRANS_PRICEPERSHARE']
+    # Stock returns for all horizons at once as a transactions x horizons array
+    cost = df['ADJUSTED_TRANS_PRICEPERSHARE'].to_numpy(dtype=float)[:, None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = (df[price_cols].to_numpy(dtype=float) - cost) / cost
+    for i, col in enumerate(return_cols):
+        df[col] = returns[:, i]
 
-# Reorder columns - first get the list of all columns
-cols = df.columns.tolist()
+    # Reorder columns - first get the list of all columns
+    cols = df.columns.tolist()
 
-# Find the position after '18 Month Price'
-insert_position = cols.index('18 Month Price') + 1
+    # Keep the forward prices together, in horizon order, followed by the returns
+    insert_position = min(cols.index(col) for col in price_cols)
+    for col in price_cols + return_cols:
+        cols.remove(col)
+    cols[insert_position:insert_position] = price_cols + return_cols
 
-# Move the return columns to their new positions
-cols.remove('RETURN_6M')
-cols.remove('RETURN_1Y')
-cols.remove('RETURN_18M')
-cols.insert(insert_position, 'RETURN_6M')
-cols.insert(insert_position + 1, 'RETURN_1Y')
-cols.insert(insert_position + 2, 'RETURN_18M')
+    # Find the position after TRANS_PRICEPERSHARE
+    insert_position = cols.index('TRANS_PRICEPERSHARE') + 1
 
-# Find the position after TRANS_PRICEPERSHARE
-insert_position = cols.index('TRANS_PRICEPERSHARE') + 1
+    # Add TOTAL_TRANS_VALUE after TRANS_PRICEPERSHARE
+    cols.remove('TOTAL_TRANS_VALUE')
+    cols.insert(insert_position, 'TOTAL_TRANS_VALUE')
 
-# Add TOTAL_TRANS_VALUE after TRANS_PRICEPERSHARE
-cols.remove('TOTAL_TRANS_VALUE')
-cols.insert(insert_position, 'TOTAL_TRANS_VALUE')
+    # Find the position after ADJUSTED_TRANS_PRICEPERSHARE
+    insert_position = cols.index('ADJUSTED_TRANS_PRICEPERSHARE') + 1
 
-# Find the position after ADJUSTED_TRANS_PRICEPERSHARE
-insert_position = cols.index('ADJUSTED_TRANS_PRICEPERSHARE') + 1
+    # Add ADJUSTED_TOTAL_TRANS_VALUE after ADJUSTED_TRANS_PRICEPERSHARE
+    cols.remove('ADJUSTED_TOTAL_TRANS_VALUE')
+    cols.insert(insert_position, 'ADJUSTED_TOTAL_TRANS_VALUE')
 
-# Add ADJUSTED_TOTAL_TRANS_VALUE after ADJUSTED_TRANS_PRICEPERSHARE
-cols.remove('ADJUSTED_TOTAL_TRANS_VALUE')
-cols.insert(insert_position, 'ADJUSTED_TOTAL_TRANS_VALUE')
+    # Reorder the dataframe columns
+    return df[cols]
 
-# Reorder the dataframe columns
-df = df[cols]
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calculate per-horizon stock returns for split-adjusted transactions")
+    parser.add_argument('--store-dir', default=DEFAULT_STORE_DIR)
+    parser.add_argument('--csv', action='store_true', help="Also export the stage as CSV")
+    parser.add_argument('--horizons', default='6M,1Y,18M',
+                        help="Comma-separated return horizons, e.g. 1M,3M,6M,1Y,18M,2Y,3Y")
+    parser.add_argument('--price-store-dir', help="Fill forward prices the input lacks from this price store")
+    args = parser.parse_args()
+    horizons = parse_horizons(args.horizons)
 
-# Save the updated dataframe to a new CSV
-output_path = r"C:\Users\Riot\OneDrive\Business\SP500_form4_analysis\transactions_with_returns.csv"
-df.to_csv(output_path, index=False) 
\ No newline at end of file
+    # Read the split-adjusted stage
+    df = read_stage('transactions_split_adjusted', args.store_dir)
+
+    missing_prices = {col: days for col, days in forward_price_columns(horizons).items() if col not in df.columns}
+    if missing_prices and args.price_store_dir:
+        with step('forward_prices', rows_in=len(df)):
+            df = add_forward_prices(df, PriceStore(args.price_store_dir), missing_prices)
+
+    with step('returns', rows_in=len(df)):
+        df = calculate_returns(df, horizons)
+
+    # Save the updated dataframe as the next stage
+    write_stage(df, 'transactions_with_returns', args.store_dir, export_csv=args.csv)
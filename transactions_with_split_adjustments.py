@@ -0,0 +1,92 @@
+import argparse
+import os
+import numpy as np
+import pandas as pd
+
+from instrumentation import step
+from stage_store import DEFAULT_STORE_DIR, read_stage, write_stage
+
+# Composite (symbol code, day) search keys: days are offset so pre-1970 dates stay positive
+DAY_OFFSET = 2 ** 19
+SYMBOL_SPAN = 2 ** 20
+
+def _search_keys(symbol_codes, dates):
+    days = np.asarray(dates, dtype='datetime64[D]').astype(np.int64)
+    return symbol_codes.astype(np.int64) * SYMBOL_SPAN + (days + DAY_OFFSET)
+
+def build_split_factors(splits_df):
+    """Precompute per-symbol sorted split dates and the cumulative factor of each split and every later one
+
+    Prices in the price columns are on today's share basis, so a transaction is
+    adjusted by the product of all splits dated after it. Reverse splits
+    (ratio < 1) fold into the same product.
+    """
+    splits = splits_df[['Symbol', 'Date', 'Split Ratio']].dropna().copy()
+    splits['Date'] = pd.to_datetime(splits['Date']).dt.tz_localize(None)
+    # The split history repeats rows; one split per symbol and date
+    splits = splits.drop_duplicates(['Symbol', 'Date'])
+    splits = splits.sort_values(['Symbol', 'Date'], ascending=[True, False], kind='mergesort')
+    splits['Cumulative_Factor'] = splits.groupby('Symbol')['Split Ratio'].cumprod()
+    splits = splits.sort_values(['Symbol', 'Date'], kind='mergesort')
+
+    symbols = np.sort(splits['Symbol'].unique())
+    symbol_codes = np.searchsorted(symbols, splits['Symbol'].to_numpy())
+    return {
+        'symbols': symbols,
+        'keys': _search_keys(symbol_codes, splits['Date'].to_numpy()),
+        'symbol_codes': symbol_codes,
+        'factors': splits['Cumulative_Factor'].to_numpy(dtype=float),
+    }
+
+def lookup_split_factors(split_factors, symbols, trans_dates):
+    """Resolve every transaction's split factor with one binary search over (symbol, date) keys"""
+    symbols = pd.Series(symbols).astype(object).to_numpy()
+    trans_dates = np.asarray(pd.to_datetime(trans_dates), dtype='datetime64[ns]')
+    known_symbols = split_factors['symbols']
+
+    codes = np.searchsorted(known_symbols, symbols.astype(str)) if len(known_symbols) else np.zeros(len(symbols), dtype=np.intp)
+    codes = np.minimum(codes, max(len(known_symbols) - 1, 0))
+    has_splits = (known_symbols[codes] == symbols) if len(known_symbols) else np.zeros(len(symbols), dtype=bool)
+
+    # First split strictly after the transaction date within the same symbol
+    positions = np.searchsorted(split_factors['keys'], _search_keys(codes, trans_dates), side='right')
+    in_range = positions < len(split_factors['keys'])
+    positions = np.minimum(positions, len(split_factors['keys']) - 1)
+    later_split = has_splits & in_range & (split_factors['symbol_codes'][positions] == codes)
+
+    factors = np.where(later_split, split_factors['factors'][positions], 1.0)
+    factors[np.isnat(trans_dates)] = np.nan
+    return factors
+
+def add_split_adjustments(df, split_factors):
+    """Add SPLIT_ADJUSTMENT and the split-adjusted share, price and holdings columns"""
+    factors = lookup_split_factors(split_factors, df['ISSUERTRADINGSYMBOL'], df['TRANS_DATE'])
+    adjusted = pd.DataFrame({
+        'SPLIT_ADJUSTMENT': factors,
+        'ADJUSTED_TRANS_SHARES': df['TRANS_SHARES'].to_numpy(dtype=float) * factors,
+        'ADJUSTED_TRANS_PRICEPERSHARE': df['TRANS_PRICEPERSHARE'].to_numpy(dtype=float) / factors,
+        'ADJUSTED_SHARES_OWNED_FOLLOWING': df['SHARES_OWNED_FOLLOWING_TRANSACTION'].to_numpy(dtype=float) * factors,
+    }, index=df.index)
+
+    # Place the adjusted columns right after SHARES_OWNED_FOLLOWING_TRANSACTION
+    df = df.drop(columns=[col for col in adjusted.columns if col in df.columns])
+    insert_position = df.columns.get_loc('SHARES_OWNED_FOLLOWING_TRANSACTION') + 1
+    return pd.concat([df.iloc[:, :insert_position], adjusted, df.iloc[:, insert_position:]], axis=1)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Split-adjust transaction shares and prices from the split history")
+    parser.add_argument('--store-dir', default=DEFAULT_STORE_DIR)
+    parser.add_argument('--csv', action='store_true', help="Also export the stage as CSV")
+    args = parser.parse_args()
+
+    print("Loading transactions and split history...")
+    df = read_stage('transactions_with_market_performance', args.store_dir)
+    splits_df = pd.read_csv(os.path.join(args.store_dir, "stock_splits_history_final.csv"))
+
+    with step('split_adjust', rows_in=len(df)):
+        split_factors = build_split_factors(splits_df)
+        df = add_split_adjustments(df, split_factors)
+    print(f"Adjusted {(df['SPLIT_ADJUSTMENT'] != 1).sum()} of {len(df)} transactions for splits")
+
+    output_path = write_stage(df, 'transactions_split_adjusted', args.store_dir, export_csv=args.csv)
+    print(f"Output saved to {output_path}")
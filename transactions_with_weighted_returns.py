@@ -1,18 +1,21 @@
 import pandas as pd
 import numpy as np
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import time
+from functools import partial
 import warnings
 
+from horizons import DEFAULT_HORIZONS, horizon_labels, parse_horizons
+from instrumentation import step
+from compact_transactions import category_codes, read_compact
+from stage_store import DEFAULT_STORE_DIR, read_stage, write_stage
+
 # Suppress warnings
 warnings.filterwarnings('ignore', category=RuntimeWarning)
 warnings.filterwarnings('ignore', category=DeprecationWarning)
 
-# Read the CSV file
-df = pd.read_csv(r"C:\Users\Riot\OneDrive\Business\SP500_form4_analysis\transactions_with_returns.csv")
-
-# Convert TRANS_DATE to datetime
-df['TRANS_DATE'] = pd.to_datetime(df['TRANS_DATE'])
-
 # Function to clean return values
 def clean_return_value(x):
     try:
@@ -20,212 +23,446 @@ def clean_return_value(x):
     except (ValueError, TypeError):
         return 0.0  # Replace any non-numeric values with 0
 
-# List of return columns to clean
-return_columns = [
-    'RETURN_6M', 'RETURN_1Y', 'RETURN_18M',
-    'SP500_RETURN_6M', 'SP500_RETURN_1Y', 'SP500_RETURN_18M',
-    'SECTOR_RETURN_6M', 'SECTOR_RETURN_1Y', 'SECTOR_RETURN_18M',
-    'SP500_6M', 'SP500_1Y', 'SP500_18M',
-    'SECTOR_6M', 'SECTOR_1Y', 'SECTOR_18M'
-]
+# Investors are identified by CIK and name; transactions are weighted by adjusted value
+INVESTOR_KEYS = ['OWNER_CIK', 'OWNER_NAME']
+VALUE_COLUMN = 'ADJUSTED_TOTAL_TRANS_VALUE'
 
-# Convert all return columns to numeric
-for col in return_columns:
-    df[col] = pd.to_numeric(df[col], errors='coerce')
+def horizon_metric_columns(horizons=DEFAULT_HORIZONS):
+    """Per-horizon metric definitions, grouped by metric kind in horizon order
 
-# Convert Market Cap to numeric, replacing any non-numeric values with NaN
-df['Market Cap'] = pd.to_numeric(df['Market Cap'], errors='coerce')
+    Returns (weighted, relative, win_rate):
+      weighted - output metric -> transaction return column it is value-weighted from
+      relative - relative metric -> (weighted stock return, weighted benchmark return)
+      win_rate - win-rate metric -> (transaction return, benchmark return)
+    """
+    labels = horizon_labels(horizons)
+    weighted = {}
+    for name, return_prefix in [('Return', ''), ('SP500', 'SP500_'), ('Sector', 'SECTOR_')]:
+        for label in labels:
+            weighted[f'Weighted_{name}_{label}'] = f'{return_prefix}RETURN_{label}'
+    relative = {}
+    win_rate = {}
+    for name, return_prefix in [('SP500', 'SP500_'), ('Sector', 'SECTOR_')]:
+        for label in labels:
+            relative[f'Return_vs_{name}_{label}'] = (f'Weighted_Return_{label}', f'Weighted_{name}_{label}')
+            win_rate[f'Pct_Positive_vs_{name}_{label}'] = (f'RETURN_{label}', f'{return_prefix}RETURN_{label}')
+    return weighted, relative, win_rate
+
+# Return columns are written as float64 upstream (unavailable periods are NaN
+# with the reason in the matching _STATUS column), so no coercion is needed
+weighted_return_columns, relative_return_columns, win_rate_columns = horizon_metric_columns()
+return_columns = list(weighted_return_columns.values())
 
 # Define bull/bear markets based on SP500 returns
-# A common definition is that a bear market is when prices fall by 20% or more
-def classify_market_condition(row):
-    if row['SP500_RETURN_6M'] <= -0.10:  # Bear market (using 10% for 6-month window)
-        return 'Bear'
-    elif row['SP500_RETURN_6M'] >= 0.10:  # Bull market
-        return 'Bull'
-    else:
-        return 'Neutral'
+# A common definition is that a bear market is when prices fall by 20% or more;
+# 10% is used for the 6-month window
+MARKET_CONDITION_THRESHOLD = 0.10
+MARKET_CONDITIONS = ['Bull', 'Bear', 'Neutral']
+
+# Market cap category -> lower bound, largest first; anything smaller (or unknown) is Micro Cap
+MARKET_CAP_CATEGORIES = {
+    'Mega Cap': 200e9,   # $200B+
+    'Large Cap': 10e9,   # $10B-$200B
+    'Mid Cap': 2e9,      # $2B-$10B
+    'Small Cap': 300e6,  # $300M-$2B
+}
+SMALLEST_CAP_CATEGORY = 'Micro Cap'
+CAP_CATEGORIES = list(MARKET_CAP_CATEGORIES) + [SMALLEST_CAP_CATEGORY]
 
-df['Market_Condition'] = df.apply(classify_market_condition, axis=1)
+def classify_market_condition(row):
+    return market_conditions([row['SP500_RETURN_6M']])[0]
 
-# Add market cap categorization function
 def categorize_market_cap(cap_value):
-    if cap_value >= 200e9:  # $200B+
-        return 'Mega Cap'
-    elif cap_value >= 10e9:  # $10B-$200B
-        return 'Large Cap'
-    elif cap_value >= 2e9:   # $2B-$10B
-        return 'Mid Cap'
-    elif cap_value >= 300e6: # $300M-$2B
-        return 'Small Cap'
-    else:
-        return 'Micro Cap'
-
-# Add to main code before the groupby
-df['Market_Cap_Category'] = df['Market Cap'].apply(categorize_market_cap)
-
-def safe_mode(series):
-    """Safely get mode of a series, returning None if empty or no mode exists"""
-    if series.empty:
-        return None
-    mode_result = series.mode()
-    return mode_result.iloc[0] if not mode_result.empty else None
-
-def validate_returns(group, owner_name):
-    """Validate return values are within reasonable bounds"""
-    return_cols = [
-        'RETURN_6M', 'RETURN_1Y', 'RETURN_18M',
-        'SP500_RETURN_6M', 'SP500_RETURN_1Y', 'SP500_RETURN_18M',
-        'SECTOR_RETURN_6M', 'SECTOR_RETURN_1Y', 'SECTOR_RETURN_18M'
-    ]
-    
-    for col in return_cols:
-        # Convert to numeric, forcing non-numeric values to NaN
-        group[col] = pd.to_numeric(group[col], errors='coerce')
-        
-        # Add null check
-        null_count = group[col].isnull().sum()
-        if null_count > 0:
-            print(f"Warning: {null_count} null values in {col} for {owner_name}")
-        
-        # Check for invalid values (now safe to use abs() since values are numeric)
-        invalid_values = group[col][(group[col].abs() > 5) | (group[col] == 0)].count()
-        if invalid_values > 0:
-            print(f"Warning: {invalid_values} suspicious {col} values for {owner_name}")
-
-def weighted_return_calc(group, return_col, value_col, total_value):
-    """Calculate weighted return using transaction values as weights"""
-    if total_value == 0:
-        return 0
-    
-    # Filter out only null values
-    valid_mask = (
-        group[return_col].notna() & 
-        group[value_col].notna() &
-        (group[value_col] > 0)
-    )
-    
-    filtered_group = group[valid_mask]
-    
-    # Calculate weights for each transaction
-    weights = filtered_group[value_col] / total_value
-    
-    # Calculate weighted return
-    weighted_return = (filtered_group[return_col] * weights).sum()
-    
-    return weighted_return
-
-def calculate_weighted_returns(group):
-    if group.empty:
-        # Return empty row (keep existing empty return structure)
-        return pd.DataFrame([{...}])
-    
-    # Get owner name from the group index
-    owner_name = group.name[1] if isinstance(group.name, tuple) else "Unknown"
-    
-    # Calculate transaction metrics
-    transaction_dates = pd.to_datetime(group['TRANS_DATE'])
-    date_diffs = transaction_dates.sort_values().diff()
-    avg_days_between = date_diffs.mean().days if len(date_diffs) > 1 else 0
-    
-    # Filter out rows with invalid transaction values
-    group = group[group['ADJUSTED_TOTAL_TRANS_VALUE'] > 0]
-    total_trans_value = group['ADJUSTED_TOTAL_TRANS_VALUE'].sum()
-    
-    if total_trans_value <= 0:
-        print(f"Warning: No valid transactions for {owner_name}")
-        return pd.DataFrame([{...}])  # Return empty row
-    
-    # First calculate all weighted returns
-    metrics = {
-        'Weighted_Return_6M': weighted_return_calc(group, 'RETURN_6M', 'ADJUSTED_TOTAL_TRANS_VALUE', total_trans_value),
-        'Weighted_Return_1Y': weighted_return_calc(group, 'RETURN_1Y', 'ADJUSTED_TOTAL_TRANS_VALUE', total_trans_value),
-        'Weighted_Return_18M': weighted_return_calc(group, 'RETURN_18M', 'ADJUSTED_TOTAL_TRANS_VALUE', total_trans_value),
-        
-        'Weighted_SP500_6M': weighted_return_calc(group, 'SP500_RETURN_6M', 'ADJUSTED_TOTAL_TRANS_VALUE', total_trans_value),
-        'Weighted_SP500_1Y': weighted_return_calc(group, 'SP500_RETURN_1Y', 'ADJUSTED_TOTAL_TRANS_VALUE', total_trans_value),
-        'Weighted_SP500_18M': weighted_return_calc(group, 'SP500_RETURN_18M', 'ADJUSTED_TOTAL_TRANS_VALUE', total_trans_value),
-        
-        'Weighted_Sector_6M': weighted_return_calc(group, 'SECTOR_RETURN_6M', 'ADJUSTED_TOTAL_TRANS_VALUE', total_trans_value),
-        'Weighted_Sector_1Y': weighted_return_calc(group, 'SECTOR_RETURN_1Y', 'ADJUSTED_TOTAL_TRANS_VALUE', total_trans_value),
-        'Weighted_Sector_18M': weighted_return_calc(group, 'SECTOR_RETURN_18M', 'ADJUSTED_TOTAL_TRANS_VALUE', total_trans_value),
-    }
-    
-    # Calculate relative performance
-    metrics.update({
-        'Return_vs_SP500_6M': metrics['Weighted_Return_6M'] - metrics['Weighted_SP500_6M'],
-        'Return_vs_SP500_1Y': metrics['Weighted_Return_1Y'] - metrics['Weighted_SP500_1Y'],
-        'Return_vs_SP500_18M': metrics['Weighted_Return_18M'] - metrics['Weighted_SP500_18M'],
-        'Return_vs_Sector_6M': metrics['Weighted_Return_6M'] - metrics['Weighted_Sector_6M'],
-        'Return_vs_Sector_1Y': metrics['Weighted_Return_1Y'] - metrics['Weighted_Sector_1Y'],
-        'Return_vs_Sector_18M': metrics['Weighted_Return_18M'] - metrics['Weighted_Sector_18M']
-    })
-    
-    # Now calculate individual transaction relative returns for win rates
-    group['Return_vs_SP500_6M'] = group['RETURN_6M'] - group['SP500_RETURN_6M']
-    group['Return_vs_SP500_1Y'] = group['RETURN_1Y'] - group['SP500_RETURN_1Y']
-    group['Return_vs_Sector_6M'] = group['RETURN_6M'] - group['SECTOR_RETURN_6M']
-    
-    # Calculate win rates
-    metrics.update({
-        'Pct_Positive_vs_SP500_6M': (group['Return_vs_SP500_6M'] > 0).mean(),
-        'Pct_Positive_vs_SP500_1Y': (group['Return_vs_SP500_1Y'] > 0).mean(),
-        'Pct_Positive_vs_Sector_6M': (group['Return_vs_Sector_6M'] > 0).mean(),
+    return market_cap_categories([cap_value])[0]
+
+def market_conditions(sp500_returns):
+    """Bull/Bear/Neutral for an array of 6M S&P 500 returns; missing returns are Neutral"""
+    returns = np.asarray(sp500_returns, dtype=float)
+    return np.select([returns <= -MARKET_CONDITION_THRESHOLD, returns >= MARKET_CONDITION_THRESHOLD],
+                     ['Bear', 'Bull'], 'Neutral').astype(object)
+
+def market_cap_categories(caps):
+    """Market cap category for an array of market caps"""
+    caps = np.asarray(caps, dtype=float)
+    return np.select([caps >= bound for bound in MARKET_CAP_CATEGORIES.values()],
+                     list(MARKET_CAP_CATEGORIES), SMALLEST_CAP_CATEGORY).astype(object)
+
+def prepare_transactions(df):
+    """Parse dates and add the per-transaction market columns"""
+    # Convert TRANS_DATE to datetime
+    df['TRANS_DATE'] = pd.to_datetime(df['TRANS_DATE'])
+
+    # Convert Market Cap to numeric, replacing any non-numeric values with NaN
+    df['Market Cap'] = pd.to_numeric(df['Market Cap'], errors='coerce')
+
+    df['Market_Condition'] = market_conditions(df['SP500_RETURN_6M'])
+    df['Market_Cap_Category'] = market_cap_categories(df['Market Cap'])
+    return df
+
+def investor_partial_sums(df, horizons=DEFAULT_HORIZONS):
+    """Reduce transactions to additive per-investor sums that every investor metric is finalized from
+
+    Returns a dict of DataFrames:
+      investors - per investor sums/min/max over all rows and over positive-value rows
+      years     - transaction counts per (investor, year) over all rows
+      companies - transaction counts and first market cap per (investor, symbol) over positive-value rows
+      sectors   - transaction counts per (investor, sector) over positive-value rows
+    """
+    trans_dates = pd.to_datetime(df['TRANS_DATE'])
+
+    # Date span metrics use every transaction, including ones without a valid value
+    all_rows = pd.DataFrame({
+        'OWNER_CIK': df['OWNER_CIK'],
+        'OWNER_NAME': df['OWNER_NAME'],
+        'Row_Count': 1,
+        'Date_Count': trans_dates.notna().astype(int),
+        'Date_Min': trans_dates,
+        'Date_Max': trans_dates,
     })
-    
-    # Add transaction pattern metrics
-    metrics.update({
-        'Transaction_Count': len(group),
-        'Min_Transaction_Value': group['ADJUSTED_TOTAL_TRANS_VALUE'].min(),
-        'Avg_Transaction_Value': group['ADJUSTED_TOTAL_TRANS_VALUE'].mean(),
-        'Total_Transaction_Value': total_trans_value,
-        'Avg_Days_Between_Transactions': avg_days_between,
-        'Number_of_Companies': group['ISSUERTRADINGSYMBOL'].nunique(),
-        'Earliest_Transaction_Year': transaction_dates.dt.year.min(),
-        'Most_Recent_Transaction_Year': transaction_dates.dt.year.max(),
-        'Unique_Transaction_Years': transaction_dates.dt.year.nunique(),
+    grouped = all_rows.groupby(INVESTOR_KEYS)
+    investors = grouped[['Row_Count', 'Date_Count']].sum()
+    investors['Date_Min'] = grouped['Date_Min'].min()
+    investors['Date_Max'] = grouped['Date_Max'].max()
+
+    years = pd.DataFrame({
+        'OWNER_CIK': df['OWNER_CIK'],
+        'OWNER_NAME': df['OWNER_NAME'],
+        'Year': trans_dates.dt.year,
+    }).groupby(INVESTOR_KEYS + ['Year']).size().rename('Count').reset_index()
+
+    # Everything else only uses transactions with a positive value
+    valid = df[df[VALUE_COLUMN] > 0]
+    value = valid[VALUE_COLUMN]
+    weighted_columns, _, win_columns = horizon_metric_columns(horizons)
+
+    # Value-weighted returns and wins for every horizon as transactions x horizons arrays,
+    # reduced by a single groupby so more horizons only add columns to one pass
+    return_cols = list(weighted_columns.values())
+    weighted = value.to_numpy(dtype=float)[:, None] * valid[return_cols].to_numpy(dtype=float)
+    stock_cols = [return_col for return_col, _ in win_columns.values()]
+    benchmark_cols = [benchmark_col for _, benchmark_col in win_columns.values()]
+    wins = (valid[stock_cols].to_numpy(dtype=float) - valid[benchmark_cols].to_numpy(dtype=float)) > 0
+
+    sums = pd.DataFrame({
+        'OWNER_CIK': valid['OWNER_CIK'],
+        'OWNER_NAME': valid['OWNER_NAME'],
+        'Valid_Count': 1,
+        'Value_Sum': value,
     })
-    
-    # Add company/sector info
-    metrics.update({
-        'Most_Common_Company': safe_mode(group['ISSUERTRADINGSYMBOL']),
-        'Most_Active_Sector': safe_mode(group['GICS_SECTOR'])
+    sums = pd.concat([
+        sums,
+        pd.DataFrame(weighted, index=valid.index, columns=[f'Value_x_{col}' for col in return_cols]),
+        pd.DataFrame(wins.astype(int), index=valid.index, columns=[f'Wins_{metric}' for metric in win_columns]),
+    ], axis=1)
+    grouped = sums.groupby(INVESTOR_KEYS)
+    investors = investors.join(grouped.sum())
+    investors['Value_Min'] = grouped['Value_Sum'].min()
+
+    # Count columns are zero, not missing, for investors without valid transactions
+    sum_columns = [col for col in sums.columns if col not in INVESTOR_KEYS]
+    investors['Valid_Count'] = investors['Valid_Count'].fillna(0).astype(int)
+    investors[sum_columns] = investors[sum_columns].fillna(0)
+
+    # The market cap of the first transaction in each company backs the cap category
+    companies = valid.groupby(INVESTOR_KEYS + ['ISSUERTRADINGSYMBOL']).size().rename('Count').to_frame()
+    first_rows = valid.drop_duplicates(INVESTOR_KEYS + ['ISSUERTRADINGSYMBOL'], keep='first')
+    companies['First_Market_Cap'] = first_rows.set_index(INVESTOR_KEYS + ['ISSUERTRADINGSYMBOL'])['Market Cap']
+    companies = companies.reset_index()
+
+    sectors = valid.groupby(INVESTOR_KEYS + ['GICS_SECTOR']).size().rename('Count').reset_index()
+
+    return {
+        'investors': investors,
+        'years': years,
+        'companies': companies,
+        'sectors': sectors,
+    }
+
+def investor_partial_sums_compact(compact, horizons=DEFAULT_HORIZONS):
+    """investor_partial_sums over the compact form (compact_transactions.py), without expanding it
+
+    Values, weighted returns and wins are computed once per fact and gathered
+    per link, and every group-by runs on integer owner, symbol and sector codes.
+    Links keep the original row order, so each sum adds the same values in the
+    same order as on the expanded rows and the partial sums are identical.
+    """
+    facts, owners, links = compact['facts'], compact['owners'], compact['links']
+    fact_ids, owner_codes = links['FACT_ID'].to_numpy(), links['OWNER_CODE'].to_numpy()
+    # Owners with a missing CIK or name are left out, as the group-by on expanded rows drops them
+    keep = owners[INVESTOR_KEYS].notna().all(axis=1).to_numpy()[owner_codes]
+    fact_ids, owner_codes = fact_ids[keep], owner_codes[keep]
+
+    def with_owner_keys(table):
+        """Replace the OWNER_CODE column of a grouped table with the investor key columns"""
+        codes = table.pop('OWNER_CODE').to_numpy()
+        keys = pd.DataFrame({col: owners[col].to_numpy()[codes] for col in INVESTOR_KEYS})
+        return pd.concat([keys, table.reset_index(drop=True)], axis=1)
+
+    trans_dates = pd.to_datetime(facts['TRANS_DATE'])
+    link_dates = trans_dates.to_numpy()[fact_ids]
+    all_rows = pd.DataFrame({
+        'OWNER_CODE': owner_codes,
+        'Row_Count': 1,
+        'Date_Count': (~np.isnat(link_dates)).astype(int),
+        'Date_Min': link_dates,
+        'Date_Max': link_dates,
     })
-    
-    # Add market cap category
-    most_common_company = metrics['Most_Common_Company']
-    if most_common_company:
-        company_data = group[group['ISSUERTRADINGSYMBOL'] == most_common_company].iloc[0]
-        metrics['Most_Common_Company_Cap_Category'] = categorize_market_cap(company_data['Market Cap'])
-    else:
-        metrics['Most_Common_Company_Cap_Category'] = ''
-    
-    return pd.DataFrame([metrics])
+    grouped = all_rows.groupby('OWNER_CODE')
+    investors = grouped[['Row_Count', 'Date_Count']].sum()
+    investors['Date_Min'] = grouped['Date_Min'].min()
+    investors['Date_Max'] = grouped['Date_Max'].max()
+
+    years = pd.DataFrame({'OWNER_CODE': owner_codes, 'Year': trans_dates.dt.year.to_numpy()[fact_ids]})
+    years = with_owner_keys(years.groupby(['OWNER_CODE', 'Year']).size().rename('Count').reset_index())
+
+    # Everything else only uses links to facts with a positive value
+    value = facts[VALUE_COLUMN].to_numpy(dtype=float)
+    valid = (value > 0)[fact_ids]
+    valid_ids, valid_owners = fact_ids[valid], owner_codes[valid]
+    weighted_columns, _, win_columns = horizon_metric_columns(horizons)
+
+    return_cols = list(weighted_columns.values())
+    weighted = value[:, None] * facts[return_cols].to_numpy(dtype=float)
+    stock_cols = [return_col for return_col, _ in win_columns.values()]
+    benchmark_cols = [benchmark_col for _, benchmark_col in win_columns.values()]
+    wins = (facts[stock_cols].to_numpy(dtype=float) - facts[benchmark_cols].to_numpy(dtype=float)) > 0
+
+    sums = pd.DataFrame({'OWNER_CODE': valid_owners, 'Valid_Count': 1, 'Value_Sum': value[valid_ids]})
+    sums = pd.concat([
+        sums,
+        pd.DataFrame(weighted[valid_ids], columns=[f'Value_x_{col}' for col in return_cols]),
+        pd.DataFrame(wins[valid_ids].astype(int), columns=[f'Wins_{metric}' for metric in win_columns]),
+    ], axis=1)
+    grouped = sums.groupby('OWNER_CODE')
+    investors = investors.join(grouped.sum())
+    investors['Value_Min'] = grouped['Value_Sum'].min()
+
+    sum_columns = [col for col in sums.columns if col != 'OWNER_CODE']
+    investors['Valid_Count'] = investors['Valid_Count'].fillna(0).astype(int)
+    investors[sum_columns] = investors[sum_columns].fillna(0)
+    investors = with_owner_keys(investors.reset_index()).set_index(INVESTOR_KEYS)
+
+    # Symbol and sector codes come from sorted dictionaries, so code order is name order
+    symbol_codes, symbols = category_codes(facts['ISSUERTRADINGSYMBOL'])
+    by_symbol = pd.DataFrame({'OWNER_CODE': valid_owners, 'Symbol': symbol_codes[valid_ids],
+                              'First_Market_Cap': facts['Market Cap'].to_numpy(dtype=float)[valid_ids]})
+    by_symbol = by_symbol[by_symbol['Symbol'] >= 0]
+    companies = by_symbol.groupby(['OWNER_CODE', 'Symbol']).size().rename('Count').to_frame()
+    companies['First_Market_Cap'] = by_symbol.drop_duplicates(['OWNER_CODE', 'Symbol'], keep='first') \
+        .set_index(['OWNER_CODE', 'Symbol'])['First_Market_Cap']
+    companies = companies.reset_index()
+    companies.insert(1, 'ISSUERTRADINGSYMBOL', symbols[companies.pop('Symbol').to_numpy()])
+    companies = with_owner_keys(companies)
+
+    sector_codes, sector_names = category_codes(facts['GICS_SECTOR'])
+    by_sector = pd.DataFrame({'OWNER_CODE': valid_owners, 'Sector': sector_codes[valid_ids]})
+    sectors = by_sector[by_sector['Sector'] >= 0].groupby(['OWNER_CODE', 'Sector']).size().rename('Count').reset_index()
+    sectors.insert(1, 'GICS_SECTOR', sector_names[sectors.pop('Sector').to_numpy()])
+    sectors = with_owner_keys(sectors)
+
+    return {
+        'investors': investors,
+        'years': years,
+        'companies': companies,
+        'sectors': sectors,
+    }
+
+def most_common(counts, column):
+    """Pick the most frequent value per investor, breaking ties by the smallest value like Series.mode"""
+    ranked = counts.sort_values(INVESTOR_KEYS + ['Count', column], ascending=[True, True, False, True])
+    return ranked.drop_duplicates(INVESTOR_KEYS, keep='first').set_index(INVESTOR_KEYS)
+
+def finalize_investor_metrics(partials, horizons=DEFAULT_HORIZONS):
+    """Turn per-investor partial sums into the investor_weighted_returns.csv layout"""
+    weighted_columns, relative_columns, win_columns = horizon_metric_columns(horizons)
+    investors = partials['investors']
+    valid_count = investors['Valid_Count']
+    total_value = investors['Value_Sum'].where(valid_count > 0)
+    metrics = pd.DataFrame(index=investors.index)
+
+    # Weighted return = sum(value * return) / sum(value), with missing returns contributing zero
+    for metric, return_col in weighted_columns.items():
+        metrics[metric] = investors[f'Value_x_{return_col}'] / total_value
+
+    for metric, (stock_metric, benchmark_metric) in relative_columns.items():
+        metrics[metric] = metrics[stock_metric] - metrics[benchmark_metric]
+
+    for metric in win_columns:
+        metrics[metric] = investors[f'Wins_{metric}'] / valid_count.where(valid_count > 0)
+
+    # Transaction pattern metrics
+    span_ns = (investors['Date_Max'] - investors['Date_Min']).to_numpy(dtype='timedelta64[ns]').astype(np.int64)
+    gaps = np.maximum(investors['Date_Count'].to_numpy() - 1, 1)
+    avg_days_between = (span_ns // gaps) // np.timedelta64(1, 'D').astype('timedelta64[ns]').astype(np.int64)
+    metrics['Transaction_Count'] = valid_count
+    metrics['Min_Transaction_Value'] = investors['Value_Min']
+    metrics['Avg_Transaction_Value'] = total_value / valid_count
+    metrics['Total_Transaction_Value'] = total_value
+    metrics['Avg_Days_Between_Transactions'] = np.where(investors['Row_Count'] > 1, avg_days_between, 0)
+
+    companies = partials['companies']
+    metrics['Number_of_Companies'] = companies.groupby(INVESTOR_KEYS).size()
+    metrics['Number_of_Companies'] = metrics['Number_of_Companies'].fillna(0).astype(int)
+
+    years = partials['years']
+    year_stats = years.groupby(INVESTOR_KEYS)['Year'].agg(['min', 'max', 'size'])
+    metrics['Earliest_Transaction_Year'] = year_stats['min']
+    metrics['Most_Recent_Transaction_Year'] = year_stats['max']
+    metrics['Unique_Transaction_Years'] = year_stats['size']
+
+    # Company/sector info
+    top_company = most_common(companies, 'ISSUERTRADINGSYMBOL')
+    metrics['Most_Common_Company'] = top_company['ISSUERTRADINGSYMBOL']
+    metrics['Most_Active_Sector'] = most_common(partials['sectors'], 'GICS_SECTOR')['GICS_SECTOR']
+    metrics['Most_Common_Company_Cap_Category'] = pd.Series(
+        market_cap_categories(top_company['First_Market_Cap']), index=top_company.index)
+    metrics['Most_Common_Company_Cap_Category'] = metrics['Most_Common_Company_Cap_Category'].fillna('')
+
+    # Investors without any positive-value transaction get an empty row; the
+    # old per-group apply marked those rows with a stray "0" column, which is
+    # kept so the CSV layout does not change
+    no_valid = valid_count == 0
+    if no_valid.any():
+        print(f"Warning: No valid transactions for {no_valid.sum()} investors")
+        metrics.loc[no_valid, :] = np.nan
+        metrics['0'] = np.where(no_valid, Ellipsis, None)
+
+    return metrics.reset_index()
+
+def calculate_investor_metrics(df, horizons=DEFAULT_HORIZONS):
+    """Calculate value-weighted returns and transaction metrics for every investor"""
+    return finalize_investor_metrics(investor_partial_sums(df, horizons), horizons)
+
+def calculate_investor_metrics_compact(compact, horizons=DEFAULT_HORIZONS):
+    """calculate_investor_metrics over the compact form; per-investor results are the same"""
+    return finalize_investor_metrics(investor_partial_sums_compact(compact, horizons), horizons)
+
+def investor_aggregation_columns(horizons=DEFAULT_HORIZONS):
+    """Transaction columns read by prepare_transactions and investor_partial_sums"""
+    columns = INVESTOR_KEYS + ['TRANS_DATE', VALUE_COLUMN, 'ISSUERTRADINGSYMBOL', 'GICS_SECTOR', 'Market Cap']
+    weighted_columns, _, _ = horizon_metric_columns(horizons)
+    return columns + [col for col in weighted_columns.values() if col not in columns]
+
+aggregation_columns = investor_aggregation_columns()
+
+def partition_by_investor(df, partitions):
+    """Hash-partition transactions by OWNER_CIK so every investor lands in exactly one partition"""
+    buckets = pd.util.hash_array(df['OWNER_CIK'].to_numpy()) % partitions
+    return [df[buckets == i] for i in range(partitions)]
+
+def concat_partial_sums(partials_list):
+    """Combine partial sums from disjoint investor partitions in serial (sorted) order"""
+    investors = pd.concat([partials['investors'] for partials in partials_list]).sort_index()
+    combined = {'investors': investors}
+    for table in ['years', 'companies', 'sectors']:
+        combined[table] = pd.concat([partials[table] for partials in partials_list], ignore_index=True)
+    return combined
+
+def merge_partial_sums(base, update):
+    """Add partial sums for new transactions onto existing partial sums (base rows come first)"""
+    investors = pd.concat([base['investors'], update['investors']])
+    grouped = investors.groupby(level=INVESTOR_KEYS)
+    merged = grouped.sum(numeric_only=True)
+    merged['Date_Min'] = grouped['Date_Min'].min()
+    merged['Date_Max'] = grouped['Date_Max'].max()
+    merged['Value_Min'] = grouped['Value_Min'].min()
+    combined = {'investors': merged[investors.columns]}
+
+    for table, key in [('years', 'Year'), ('sectors', 'GICS_SECTOR')]:
+        rows = pd.concat([base[table], update[table]], ignore_index=True)
+        combined[table] = rows.groupby(INVESTOR_KEYS + [key], as_index=False)['Count'].sum()
+
+    # The first transaction in a company stays the earliest one already in base
+    rows = pd.concat([base['companies'], update['companies']], ignore_index=True)
+    company_keys = INVESTOR_KEYS + ['ISSUERTRADINGSYMBOL']
+    companies = rows.groupby(company_keys)['Count'].sum().to_frame()
+    companies['First_Market_Cap'] = rows.drop_duplicates(company_keys, keep='first').set_index(company_keys)['First_Market_Cap']
+    combined['companies'] = companies.reset_index()
+    return combined
+
+def calculate_investor_metrics_parallel(df, workers, horizons=DEFAULT_HORIZONS):
+    """Aggregate hash partitions in a process pool and merge; output is identical to serial mode"""
+    if workers <= 1:
+        return calculate_investor_metrics(df, horizons)
+    # Only ship the columns the aggregation reads to the workers
+    partitions = partition_by_investor(df[investor_aggregation_columns(horizons)], workers)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        partials_list = list(pool.map(partial(investor_partial_sums, horizons=horizons), partitions))
+    return finalize_investor_metrics(concat_partial_sums(partials_list), horizons)
+
+def scaling_report(df, worker_counts=(1, 2, 4, 8), horizons=DEFAULT_HORIZONS):
+    """Time the investor aggregation at each worker count and report throughput"""
+    rows = []
+    for workers in worker_counts:
+        start = time.perf_counter()
+        calculate_investor_metrics_parallel(df, workers, horizons)
+        elapsed = time.perf_counter() - start
+        rows.append({
+            'Workers': workers,
+            'Seconds': elapsed,
+            'Transactions_per_Second': len(df) / elapsed,
+        })
+    report = pd.DataFrame(rows)
+    report['Speedup'] = report['Seconds'].iloc[0] / report['Seconds']
+    return report
 
 # Main execution
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calculate value-weighted returns per investor")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Number of worker processes for the investor aggregation (default: 1, serial)")
+    parser.add_argument('--scaling-report', action='store_true',
+                        help="Print throughput at 1/2/4/8 workers instead of writing results")
+    parser.add_argument('--store-dir', default=DEFAULT_STORE_DIR)
+    parser.add_argument('--csv', action='store_true', help="Also export the results as CSV")
+    parser.add_argument('--horizons', default='6M,1Y,18M',
+                        help="Comma-separated return horizons, e.g. 1M,3M,6M,1Y,18M,2Y,3Y")
+    parser.add_argument('--clusters', action='store_true',
+                        help="Aggregate trade clusters (transaction_clusters.py) instead of individual fills")
+    parser.add_argument('--compact', action='store_true',
+                        help="Aggregate the deduplicated transaction stages written by compact_transactions.py")
+    args = parser.parse_args()
+    if args.compact and (args.clusters or args.scaling_report or args.workers > 1):
+        parser.error("--compact runs serially on transactions; it cannot be combined with --clusters, --scaling-report or --workers")
+    horizons = parse_horizons(args.horizons)
+    input_stage, output_stage = 'transactions_with_returns_and_relatives', 'investor_weighted_returns'
+    if args.clusters:
+        # Each cluster counts as one transaction, weighted by its total value
+        input_stage, output_stage = 'transaction_clusters', 'investor_weighted_returns_clustered'
+
     print("Starting analysis...")
-    
-    # Read the CSV file
-    df = pd.read_csv(r"C:\Users\Riot\OneDrive\Business\SP500_form4_analysis\transactions_with_returns_and_relatives.csv")
-    print(f"Loaded {len(df)} transactions")
-    
-    # Convert return columns to numeric
-    for col in return_columns:
-        df[col] = pd.to_numeric(df[col], errors='coerce')
-    
-    # Basic data validation
+
+    # Read only the columns the aggregation needs
+    if args.compact:
+        compact = read_compact(args.store_dir, [col for col in investor_aggregation_columns(horizons) if col not in INVESTOR_KEYS])
+        print(f"Loaded {len(compact['links'])} transactions ({len(compact['facts'])} distinct)")
+        # Validation below covers each distinct transaction once
+        df = compact['facts']
+    else:
+        df = read_stage(input_stage, args.store_dir, columns=investor_aggregation_columns(horizons))
+        print(f"Loaded {len(df)} {'clusters' if args.clusters else 'transactions'}")
+    with step('prepare_transactions', rows_in=len(df)):
+        df = prepare_transactions(df)
+
+    # Basic data validation; return_validation.py writes the full per-investor report
     print("\nData validation:")
     print("Return columns range:")
-    for col in ['RETURN_6M', 'RETURN_1Y', 'RETURN_18M']:
+    for col in [f'RETURN_{label}' for label in horizon_labels(horizons)]:
         print(f"{col}: Min={df[col].min():.2%}, Max={df[col].max():.2%}, Mean={df[col].mean():.2%}")
-    
+
+    if args.scaling_report:
+        print("\nScaling report:")
+        print(scaling_report(df, horizons=horizons).to_string(index=False))
+        raise SystemExit(0)
+
     # Calculate weighted returns
-    investor_returns = df.groupby(['OWNER_CIK', 'OWNER_NAME']).apply(
-        calculate_weighted_returns
-    ).reset_index(level=[0,1]).drop('level_2', axis=1, errors='ignore')
-    
+    with step('investor_metrics', rows_in=len(df)) as info:
+        if args.compact:
+            investor_returns = calculate_investor_metrics_compact(dict(compact, facts=df), horizons)
+        else:
+            investor_returns = calculate_investor_metrics_parallel(df, args.workers, horizons)
+        info['rows_out'] = len(investor_returns)
+
     # Save results
-    output_path = r"C:\Users\Riot\OneDrive\Business\SP500_form4_analysis\investor_weighted_returns.csv"
-    investor_returns.to_csv(output_path, index=False)
+    output_path = write_stage(investor_returns, output_stage, args.store_dir, export_csv=args.csv)
     print(f"\nAnalysis complete. Results saved to {output_path}")